@@ -1,3 +1,4 @@
+import concurrent.futures
 import json
 import os
 import shutil
@@ -6,11 +7,12 @@ import time
 import uuid
 from io import BytesIO
 from threading import Timer
-from typing import Any
 
 import gradio as gr
 from dotenv import load_dotenv
+from e2b import Sandbox as SandboxBase
 from e2b_desktop import Sandbox
+from e2b_desktop.main import _VNCServer
 from gradio_modal import Modal
 from huggingface_hub import login, upload_folder
 from PIL import Image
@@ -19,6 +21,11 @@ from smolagents.gradio_ui import GradioUI
 
 from e2bqwen import E2BVisionAgent, get_agent_summary_erase_images
 from gradio_script import stream_to_gradio
+from model_replay import MODEL_CALLS_FILENAME, FakeModelReplayLog, RecordingModel
+from resilient_model import ResilientModel
+from run_budget import BUDGET_EXCEEDED_STATUS, RunBudget, budget_limits_from_env
+from run_status import write_status_file
+from sandbox_registry import LeaseRenewer, make_sandbox_registry
 from scripts_and_styling import (
     CUSTOM_JS,
     FOOTER_HTML,
@@ -26,6 +33,8 @@ from scripts_and_styling import (
     SANDBOX_HTML_TEMPLATE,
     apply_theme,
 )
+from trace_serializer import dumps as dumps_trace
+from trace_writer import TraceWriter
 
 load_dotenv(override=True)
 
@@ -38,18 +47,47 @@ TASK_EXAMPLES = [
 ]
 
 E2B_API_KEY = os.getenv("E2B_API_KEY")
+# Sandbox handles opened by this process; the registry is the source of truth
 SANDBOXES: dict[str, Sandbox] = {}
-SANDBOX_METADATA: dict[str, dict[str, Any]] = {}
+# Set SANDBOX_REGISTRY_PATH to a SQLite file to share sandboxes between app workers
+SANDBOX_REGISTRY = make_sandbox_registry(os.getenv("SANDBOX_REGISTRY_PATH"))
+WORKER_ID = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
 SANDBOX_TIMEOUT = 300
+SANDBOX_LEASE_SECONDS = 120
+CLEANUP_INTERVAL = 60
 WIDTH = 1280
 HEIGHT = 960
 TMP_DIR = "./tmp/"
+REPLAY_LOG_FOLDER = os.getenv("REPLAY_LOG_FOLDER")
+REPLAY_TOKENS_PER_SECOND = (
+    float(os.getenv("REPLAY_TOKENS_PER_SECOND"))
+    if os.getenv("REPLAY_TOKENS_PER_SECOND")
+    else None
+)
+# Budgets per run and per browser session, e.g. RUN_BUDGET_MAX_INPUT_TOKENS=500000
+RUN_BUDGET_LIMITS = budget_limits_from_env("RUN_BUDGET_")
+SESSION_BUDGET_LIMITS = budget_limits_from_env("SESSION_BUDGET_")
+SESSION_BUDGETS: dict[str, RunBudget] = {}
+# Final metadata.jsonl of runs, written off the request thread: run folder -> write
+FINAL_STATUS_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+FINAL_STATUS_WRITES: dict[str, concurrent.futures.Future] = {}
 if not os.path.exists(TMP_DIR):
     os.makedirs(TMP_DIR)
 
 hf_token = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_API_KEY")
 login(token=hf_token)
 
+# One per process: hedging is based on the latencies of all the runs it served
+INFERENCE_MODEL = ResilientModel(
+    InferenceClientModel(
+        model_id="https://n5wr7lfx6wp94tvl.us-east-1.aws.endpoints.huggingface.cloud",
+        token=hf_token,
+    ),
+    timeout=90,
+    max_retries=3,
+    hedge=True,
+)
+
 custom_css = SANDBOX_CSS_TEMPLATE.replace("<<WIDTH>>", str(WIDTH + 15)).replace(
     "<<HEIGHT>>", str(HEIGHT + 10)
 )
@@ -69,6 +107,7 @@ def upload_to_hf_and_remove(folder_paths: list[str]):
 
         # Copy all folders into the temporary directory
         for folder_path in folder_paths:
+            wait_for_final_status(folder_path)
             folder_name = os.path.basename(os.path.normpath(folder_path))
             target_path = os.path.join(temp_dir, folder_name)
             print("Scanning folder", os.path.join(folder_path, "metadata.jsonl"))
@@ -99,86 +138,147 @@ def upload_to_hf_and_remove(folder_paths: list[str]):
 def cleanup_sandboxes():
     """Remove sandboxes that haven't been accessed for longer than SANDBOX_TIMEOUT"""
     current_time = time.time()
-    sandboxes_to_remove = []
 
-    for session_id, metadata in SANDBOX_METADATA.items():
-        if current_time - metadata["last_accessed"] > SANDBOX_TIMEOUT:
-            sandboxes_to_remove.append(session_id)
+    for session_id, metadata in SANDBOX_REGISTRY.items():
+        if current_time - metadata["last_accessed"] <= SANDBOX_TIMEOUT:
+            continue
+        # Only one worker may reap a given sandbox: its owner, or anyone once the lease expired
+        if not SANDBOX_REGISTRY.acquire_lease(
+            session_id, WORKER_ID, SANDBOX_LEASE_SECONDS
+        ):
+            continue
+        try:
+            # Upload data before removing if needed
+            data_dir = os.path.join(TMP_DIR, session_id)
+            if os.path.exists(data_dir):
+                upload_to_hf_and_remove([data_dir])
+
+            # Close the sandbox
+            if session_id in SANDBOXES:
+                SANDBOXES.pop(session_id).kill()
+            else:
+                Sandbox.kill(metadata["sandbox_id"], api_key=E2B_API_KEY)
+            SANDBOX_REGISTRY.remove(session_id)
+            SESSION_BUDGETS.pop(session_id, None)
+            print(f"Cleaned up sandbox for session {session_id}")
+        except Exception as e:
+            print(f"Error cleaning up sandbox {session_id}: {str(e)}")
+            SANDBOX_REGISTRY.release_lease(session_id, WORKER_ID)
 
-    for session_id in sandboxes_to_remove:
-        if session_id in SANDBOXES:
-            try:
-                # Upload data before removing if needed
-                data_dir = os.path.join(TMP_DIR, session_id)
-                if os.path.exists(data_dir):
-                    upload_to_hf_and_remove(data_dir)
-
-                # Close the sandbox
-                SANDBOXES[session_id].kill()
-                del SANDBOXES[session_id]
-                del SANDBOX_METADATA[session_id]
-                print(f"Cleaned up sandbox for session {session_id}")
-            except Exception as e:
-                print(f"Error cleaning up sandbox {session_id}: {str(e)}")
+    schedule_cleanup()
 
 
-def get_or_create_sandbox(session_hash: str):
-    current_time = time.time()
+def schedule_cleanup():
+    timer = Timer(CLEANUP_INTERVAL, cleanup_sandboxes)
+    timer.daemon = True
+    timer.start()
 
-    if (
-        session_hash in SANDBOXES
-        and session_hash in SANDBOX_METADATA
-        and current_time - SANDBOX_METADATA[session_hash]["created_at"]
-        < SANDBOX_TIMEOUT
-    ):
-        print(f"Reusing Sandbox for session {session_hash}")
-        SANDBOX_METADATA[session_hash]["last_accessed"] = current_time
-        return SANDBOXES[session_hash]
-    else:
-        print("No sandbox found, creating a new one")
 
-    if session_hash in SANDBOXES:
-        try:
-            print(f"Closing expired sandbox for session {session_hash}")
-            SANDBOXES[session_hash].kill()
-        except Exception as e:
-            print(f"Error closing expired sandbox: {str(e)}")
-
-    print(f"Creating new sandbox for session {session_hash}")
-    desktop = Sandbox(
-        api_key=E2B_API_KEY,
-        resolution=(WIDTH, HEIGHT),
-        dpi=96,
-        timeout=SANDBOX_TIMEOUT,
-        template="k0wmnzir0zuzye6dndlw",
+def reattach_sandbox(sandbox_id: str) -> Sandbox:
+    """Handle on a running desktop sandbox created by another worker.
+
+    ``Sandbox.connect`` can't be used: it calls the desktop ``__init__``, which rejects
+    the arguments connect passes and would start Xvfb and xfce4 again on the running
+    desktop. Only the base sandbox is connected to, then the desktop attributes are set.
+    """
+    desktop = Sandbox.__new__(Sandbox)
+    SandboxBase.__init__(desktop, sandbox_id=sandbox_id, api_key=E2B_API_KEY)
+    desktop._display = ":0"
+    desktop._last_xfce4_pid = None
+    desktop._Sandbox__vnc_server = _VNCServer(desktop)
+    return desktop
+
+
+def get_or_create_sandbox(session_hash: str):
+    current_time = time.time()
+    metadata = SANDBOX_REGISTRY.get(session_hash)
+    # Only the worker holding the lease may replace or kill the session's sandbox. It is
+    # only held for that here: a run takes it again for its whole duration.
+    has_lease = metadata is not None and SANDBOX_REGISTRY.acquire_lease(
+        session_hash, WORKER_ID, SANDBOX_LEASE_SECONDS
     )
-    desktop.stream.start(require_auth=True)
-    setup_cmd = """sudo mkdir -p /usr/lib/firefox-esr/distribution && echo '{"policies":{"OverrideFirstRunPage":"","OverridePostUpdatePage":"","DisableProfileImport":true,"DontCheckDefaultBrowser":true}}' | sudo tee /usr/lib/firefox-esr/distribution/policies.json > /dev/null"""
-    desktop.commands.run(setup_cmd)
 
-    print(f"Sandbox ID for session {session_hash} is {desktop.sandbox_id}.")
+    try:
+        if metadata is not None and (
+            current_time - metadata["created_at"] < SANDBOX_TIMEOUT or not has_lease
+        ):
+            SANDBOX_REGISTRY.touch(session_hash, current_time)
+            desktop = SANDBOXES.get(session_hash)
+            if desktop is not None and desktop.sandbox_id == metadata["sandbox_id"]:
+                print(f"Reusing Sandbox for session {session_hash}")
+                return desktop
+            # The sandbox was created by another worker: reattach to it by ID
+            try:
+                print(
+                    f"Reattaching to sandbox {metadata['sandbox_id']} for session {session_hash}"
+                )
+                desktop = reattach_sandbox(metadata["sandbox_id"])
+                SANDBOXES[session_hash] = desktop
+                return desktop
+            except Exception as e:
+                print(f"Error reattaching to sandbox: {str(e)}")
+                if not has_lease:
+                    # Its owner is still serving it: never kill it from here
+                    raise gr.Error(
+                        "The sandbox of this session is busy on another worker, please retry"
+                    )
+        else:
+            print("No sandbox found, creating a new one")
 
-    SANDBOXES[session_hash] = desktop
-    SANDBOX_METADATA[session_hash] = {
-        "created_at": current_time,
-        "last_accessed": current_time,
-    }
-    return desktop
+        if metadata is not None:
+            try:
+                print(f"Closing expired sandbox for session {session_hash}")
+                if session_hash in SANDBOXES:
+                    SANDBOXES.pop(session_hash).kill()
+                else:
+                    Sandbox.kill(metadata["sandbox_id"], api_key=E2B_API_KEY)
+            except Exception as e:
+                print(f"Error closing expired sandbox: {str(e)}")
+
+        print(f"Creating new sandbox for session {session_hash}")
+        desktop = Sandbox(
+            api_key=E2B_API_KEY,
+            resolution=(WIDTH, HEIGHT),
+            dpi=96,
+            timeout=SANDBOX_TIMEOUT,
+            template="k0wmnzir0zuzye6dndlw",
+        )
+        desktop.stream.start(require_auth=True)
+        setup_cmd = """sudo mkdir -p /usr/lib/firefox-esr/distribution && echo '{"policies":{"OverrideFirstRunPage":"","OverridePostUpdatePage":"","DisableProfileImport":true,"DontCheckDefaultBrowser":true}}' | sudo tee /usr/lib/firefox-esr/distribution/policies.json > /dev/null"""
+        desktop.commands.run(setup_cmd)
+
+        print(f"Sandbox ID for session {session_hash} is {desktop.sandbox_id}.")
+
+        SANDBOXES[session_hash] = desktop
+        SANDBOX_REGISTRY.put(
+            session_hash,
+            {
+                "sandbox_id": desktop.sandbox_id,
+                "created_at": current_time,
+                "last_accessed": current_time,
+                "owner": None,
+                "lease_expires_at": 0,
+                # Other workers can't recover the stream password from a reattached handle
+                "stream_url": desktop.stream.get_url(
+                    auth_key=desktop.stream.get_auth_key()
+                ),
+            },
+        )
+        return desktop
+    finally:
+        if has_lease:
+            SANDBOX_REGISTRY.release_lease(session_hash, WORKER_ID)
 
 
 def update_html(interactive_mode: bool, session_hash: str):
-    desktop = get_or_create_sandbox(session_hash)
-    auth_key = desktop.stream.get_auth_key()
-    base_url = desktop.stream.get_url(auth_key=auth_key)
+    get_or_create_sandbox(session_hash)
+    metadata = SANDBOX_REGISTRY.get(session_hash)
+    base_url = metadata["stream_url"]
     stream_url = base_url if interactive_mode else f"{base_url}&view_only=true"
 
     status_class = "status-interactive" if interactive_mode else "status-view-only"
     status_text = "Interactive" if interactive_mode else "Agent running..."
-    creation_time = (
-        SANDBOX_METADATA[session_hash]["created_at"]
-        if session_hash in SANDBOX_METADATA
-        else time.time()
-    )
+    creation_time = metadata["created_at"]
 
     sandbox_html_content = sandbox_html_template.format(
         stream_url=stream_url,
@@ -194,13 +294,44 @@ def generate_interaction_id(session_hash: str):
 
 
 def save_final_status(folder, status: str, summary, error_message=None) -> None:
-    with open(os.path.join(folder, "metadata.jsonl"), "a") as output_file:
+    with open(
+        os.path.join(folder, "metadata.jsonl"), "a", encoding="utf-8"
+    ) as output_file:
         output_file.write(
             "\n"
-            + json.dumps(
+            + dumps_trace(
                 {"status": status, "summary": summary, "error_message": error_message},
             )
         )
+    write_status_file(folder, status, error_message=error_message)
+
+
+def save_final_status_from_agent(
+    folder, agent, status: str, error_message=None
+) -> None:
+    """Write the final status with the agent's memory as chat messages, the summary
+    format of the uploaded dataset"""
+    summary = get_agent_summary_erase_images(agent)
+    save_final_status(folder, status, summary=summary, error_message=error_message)
+
+
+def schedule_final_status(folder, agent, status: str, error_message=None) -> None:
+    def done(future: concurrent.futures.Future):
+        FINAL_STATUS_WRITES.pop(folder, None)
+        if future.exception() is not None:
+            print(f"Error saving final status of {folder}: {future.exception()}")
+
+    FINAL_STATUS_WRITES[folder] = FINAL_STATUS_EXECUTOR.submit(
+        save_final_status_from_agent, folder, agent, status, error_message
+    )
+    FINAL_STATUS_WRITES[folder].add_done_callback(done)
+
+
+def wait_for_final_status(folder) -> None:
+    """Wait for the final status of a run to be written, before uploading it"""
+    future = FINAL_STATUS_WRITES.get(folder)
+    if future is not None:
+        concurrent.futures.wait([future])
 
 
 def extract_browser_uuid(js_uuid):
@@ -215,11 +346,19 @@ def initialize_session(interactive_mode, request: gr.Request):
     return update_html(interactive_mode, request.session_hash), new_uuid
 
 
-def create_agent(data_dir, desktop):
-    model = InferenceClientModel(
-        model_id="https://n5wr7lfx6wp94tvl.us-east-1.aws.endpoints.huggingface.cloud",
-        token=hf_token,
-    )
+def create_agent(data_dir, desktop, record_model_calls: bool = False):
+    if REPLAY_LOG_FOLDER:
+        # Replays a recorded run's stream, to load-test the UI without a live model
+        model = FakeModelReplayLog(
+            REPLAY_LOG_FOLDER,
+            latency="recorded",
+            tokens_per_second=REPLAY_TOKENS_PER_SECOND,
+        )
+    else:
+        model = INFERENCE_MODEL.for_run()
+    if record_model_calls:
+        # Replayable offline with FakeModelReplayLog(data_dir)
+        model = RecordingModel(model, os.path.join(data_dir, MODEL_CALLS_FILENAME))
 
     # model = OpenAIServerModel(
     #     "gpt-4o",api_key=os.getenv("OPENAI_API_KEY")
@@ -268,11 +407,37 @@ class EnrichedGradioUI(GradioUI):
             os.makedirs(data_dir)
 
         # Always re-create an agent from scratch, else Qwen-VL gets confused with past history
-        session_state["agent"] = create_agent(data_dir=data_dir, desktop=desktop)
+        session_state["agent"] = create_agent(
+            data_dir=data_dir, desktop=desktop, record_model_calls=consent_storage
+        )
 
         if not task_input or len(task_input) == 0:
             raise gr.Error("Task cannot be empty")
 
+        if request.session_hash not in SESSION_BUDGETS:
+            SESSION_BUDGETS[request.session_hash] = RunBudget(**SESSION_BUDGET_LIMITS)
+        session_budget = SESSION_BUDGETS[request.session_hash]
+        exhausted_reason = session_budget.check()
+        if exhausted_reason is not None:
+            raise gr.Error(f"Session budget exhausted: {exhausted_reason}")
+        run_budget = RunBudget(**RUN_BUDGET_LIMITS, parent=session_budget)
+        # After the agent's own callbacks, which set token counts and the screenshot
+        session_state["agent"].step_callbacks.append(run_budget.step_callback)
+
+        # Hold the sandbox's lease for the whole run, so no other worker reaps it
+        if not SANDBOX_REGISTRY.acquire_lease(
+            request.session_hash, WORKER_ID, SANDBOX_LEASE_SECONDS
+        ):
+            raise gr.Error(
+                "The sandbox of this session is busy on another worker, please retry"
+            )
+        lease_renewer = LeaseRenewer(
+            SANDBOX_REGISTRY, request.session_hash, WORKER_ID, SANDBOX_LEASE_SECONDS
+        ).start()
+
+        status = "failed"
+        error_message = None
+        trace_writer = None
         try:
             stored_messages.append(
                 gr.ChatMessage(
@@ -288,6 +453,10 @@ class EnrichedGradioUI(GradioUI):
                             {"task": task_input},
                         )
                     )
+                # Persist each step as it completes, so a crashed run keeps its trace
+                trace_writer = TraceWriter(data_dir)
+                trace_writer.write_task(task_input)
+                session_state["agent"].step_callbacks.append(trace_writer.step_callback)
 
             screenshot_bytes = session_state["agent"].desktop.screenshot(format="bytes")
             initial_screenshot = Image.open(BytesIO(screenshot_bytes))
@@ -336,22 +505,39 @@ class EnrichedGradioUI(GradioUI):
             yield stored_messages
 
         except Exception as e:
-            error_message = f"Error in interaction: {str(e)}"
+            if run_budget.exceeded_reason is not None:
+                # The budget interrupted the agent: not a failure of the run itself
+                error_message = f"Budget exceeded: {run_budget.exceeded_reason}"
+                status = BUDGET_EXCEEDED_STATUS
+                content = "Run stopped:\n" + error_message
+            else:
+                error_message = f"Error in interaction: {str(e)}"
+                status = "failed"
+                content = "Run failed:\n" + error_message
             print(error_message)
-            stored_messages.append(
-                gr.ChatMessage(
-                    role="assistant", content="Run failed:\n" + error_message
-                )
-            )
-            status = "failed"
+            stored_messages.append(gr.ChatMessage(role="assistant", content=content))
             yield stored_messages
         finally:
-            if consent_storage:
-                summary = get_agent_summary_erase_images(session_state["agent"])
-                save_final_status(
-                    data_dir, status, summary=summary, error_message=error_message
+            lease_renewer.stop()
+            SANDBOX_REGISTRY.release_lease(request.session_hash, WORKER_ID)
+            model = session_state["agent"].model
+            if isinstance(model, RecordingModel):
+                model.close()
+            if not REPLAY_LOG_FOLDER:
+                # Process-wide: tail latency with and without hedging, and its request cost
+                print("MODEL CALL STATS", INFERENCE_MODEL.format_stats())
+            if trace_writer:
+                trace_writer.write_final(status, error_message=error_message)
+                trace_writer.close()
+                # Serializing a long run's memory stalls the request thread: it is done
+                # in the background, on this run's agent which the next run replaces
+                schedule_final_status(
+                    data_dir,
+                    session_state["agent"],
+                    status,
+                    error_message=error_message,
                 )
-                print("SAVING FINAL STATUS", data_dir, status, summary, error_message)
+                print("SAVING FINAL STATUS", data_dir, status, error_message)
 
 
 theme = gr.themes.Default(
@@ -497,6 +683,8 @@ _Please note that we store the task logs by default so **do not write any person
     stop_btn.click(fn=interrupt_agent, inputs=[session_state], outputs=[stop_btn])
 
     def upload_interaction_logs(session: gr.Request):
+        # The session ended: its budget can't be charged anymore
+        SESSION_BUDGETS.pop(session.session_hash, None)
         data_dirs = []
         for interaction_id in list(
             INTERACTION_IDS_PER_SESSION_HASH[session.session_hash].keys()
@@ -523,5 +711,5 @@ _Please note that we store the task logs by default so **do not write any person
 
 # Launch the app
 if __name__ == "__main__":
-    Timer(60, cleanup_sandboxes).start()  # Run every minute
+    schedule_cleanup()  # Run every minute
     demo.launch()
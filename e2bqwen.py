@@ -15,6 +15,8 @@ from smolagents.agent_types import AgentImage
 from smolagents.memory import ActionStep, TaskStep
 from smolagents.monitoring import LogLevel
 
+from token_counting import TokenCounter
+
 E2B_SYSTEM_PROMPT_TEMPLATE = """You are a desktop automation assistant that can control a remote desktop environment. The current date is <<current_date>>.
 
 <action process>
@@ -167,11 +169,14 @@ class E2BVisionAgent(CodeAgent):
         verbosity_level: LogLevel = 2,
         planning_interval: int = None,
         use_v1_prompt: bool = False,
+        sleep_scale: float = 1.0,
         **kwargs,
     ):
         self.desktop = desktop
         self.data_dir = data_dir
         self.planning_interval = planning_interval
+        # Scales every wait on the desktop: 0 skips them, e.g. when replaying against a fake desktop
+        self.sleep_scale = sleep_scale
         # Initialize Desktop
         self.width, self.height = self.desktop.get_screen_size()
         print(f"Screen size: {self.width}x{self.height}")
@@ -203,6 +208,9 @@ class E2BVisionAgent(CodeAgent):
         self.logger.log("Setting up agent tools...")
         self._setup_desktop_tools()
         self.step_callbacks.append(self.take_screenshot_callback)
+        # Fills in per-step token counts when the model doesn't report them
+        self.token_counter = TokenCounter()
+        self.step_callbacks.append(self.token_counter.step_callback)
 
     def _setup_desktop_tools(self):
         """Register all desktop tools"""
@@ -339,7 +347,7 @@ class E2BVisionAgent(CodeAgent):
             Args:
                 seconds: Number of seconds to wait, generally 3 is enough.
             """
-            time.sleep(seconds)
+            self._sleep(seconds)
             self.logger.log(f"Waited for {seconds} seconds")
             return f"Waited for {seconds} seconds"
 
@@ -356,7 +364,7 @@ class E2BVisionAgent(CodeAgent):
 
             self.desktop.open(url)
             # Give it time to load
-            time.sleep(2)
+            self._sleep(2)
             self.logger.log(f"Opening URL: {url}")
             return f"Opened URL: {url}"
 
@@ -368,12 +376,12 @@ class E2BVisionAgent(CodeAgent):
                 search_string: The string to search for on the page.
             """
             self.desktop.press(["ctrl", "f"])
-            time.sleep(0.3)
+            self._sleep(0.3)
             clean_text = normalize_text(search_string)
             self.desktop.write(clean_text, delay_in_ms=75)
-            time.sleep(0.3)
+            self._sleep(0.3)
             self.desktop.press("enter")
-            time.sleep(0.3)
+            self._sleep(0.3)
             self.desktop.press("esc")
             output_message = f"Scrolled to the first occurrence of '{clean_text}'"
             self.logger.log(output_message)
@@ -393,13 +401,17 @@ class E2BVisionAgent(CodeAgent):
         self.tools["drag_and_drop"] = drag_and_drop
         self.tools["find_on_page_ctrl_f"] = find_on_page_ctrl_f
 
+    def _sleep(self, seconds: float) -> None:
+        if self.sleep_scale > 0:
+            time.sleep(seconds * self.sleep_scale)
+
     def take_screenshot_callback(self, memory_step: ActionStep, agent=None) -> None:
         """Callback that takes a screenshot + memory snapshot after a step completes"""
         self.logger.log("Analyzing screen content...")
 
         current_step = memory_step.step_number
 
-        time.sleep(2.5)  # Let things happen on the desktop
+        self._sleep(2.5)  # Let things happen on the desktop
         screenshot_bytes = self.desktop.screenshot(format="bytes")
         image = Image.open(BytesIO(screenshot_bytes))
 
@@ -1,33 +1,57 @@
 import os
+import glob
 import json
+import time
+import shutil
+import socket
+import sqlite3
 import argparse
+import functools
+import statistics
 import subprocess
+import multiprocessing
 import threading
+import traceback
 import concurrent.futures
+from collections import Counter
 from datetime import datetime
 from e2b_desktop import Sandbox
 from huggingface_hub import get_token
 from io import BytesIO
 from PIL import Image
-from e2bqwen import QwenVLAPIModel, E2BVisionAgent, get_agent_summary_erase_images
+from e2bqwen import E2BVisionAgent, get_agent_summary_erase_images
+from model_replay import (
+    MODEL_CALLS_FILENAME,
+    FakeDesktop,
+    FakeModelReplayLog,
+    RecordingModel,
+    read_model_calls,
+)
+from eval_stats import aggregate_runs, failure_category, wilson_interval
+from results_store import (
+    RESULTS_STORE_FILENAME,
+    ResultsStore,
+    git_hash_from_name,
+    run_record,
+)
+from run_budget import BUDGET_EXCEEDED_STATUS, BUDGET_LIMITS, RunBudget
+from run_status import read_run_status, write_status_file
+from smolagents.memory import ActionStep
+from task_dataset import TaskDataset, parse_filters, parse_shard
+from trace_files import (
+    COMPRESSIONS as TRACE_COMPRESSIONS,
+    find_trace_file,
+    read_json_file,
+)
+from trace_serializer import write_json_file
+from trace_writer import TRACE_FILENAME, TraceWriter, read_trace
+from work_queue import WorkQueue
 
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 # Environment variables and constants
 E2B_API_KEY = os.getenv("E2B_API_KEY")
-# Try to get token dynamically, fall back to environment variable
-try:
-    HUGGINGFACE_API_KEY = get_token()
-    if not HUGGINGFACE_API_KEY:
-        HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-        if not HUGGINGFACE_API_KEY:
-            raise ValueError(
-                "No Hugging Face token found. Please login with `huggingface-cli login` or set HUGGINGFACE_API_KEY environment variable"
-            )
-except ImportError:
-    # Fall back if huggingface_hub is old version without get_token
-    HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 WIDTH = 1024
 HEIGHT = 768
 SANDBOX_TIMEOUT = 600  # 10 minutes
@@ -58,12 +82,30 @@ def get_git_hash():
         return "nogit"
 
 
-def create_agent(data_dir, desktop, max_steps: int):
+def get_hf_token():
+    """Token of the logged in Hugging Face user, else the HUGGINGFACE_API_KEY variable"""
+    token = get_token() or os.getenv("HUGGINGFACE_API_KEY")
+    if not token:
+        raise ValueError(
+            "No Hugging Face token found. Please login with `huggingface-cli login` or set HUGGINGFACE_API_KEY environment variable"
+        )
+    return token
+
+
+def create_agent(data_dir, desktop, max_steps: int, model=None, **kwargs):
     """Create an agent with the E2B desktop sandbox"""
-    model = QwenVLAPIModel(
-        model_id="Qwen/Qwen2.5-VL-72B-Instruct",
-        hf_token=HUGGINGFACE_API_KEY,
-    )
+    if model is None:
+        # Imported here so that offline replays don't need the inference client
+        from e2bqwen import QwenVLAPIModel
+
+        # Record every call so that this run can later be replayed offline
+        model = RecordingModel(
+            QwenVLAPIModel(
+                model_id="Qwen/Qwen2.5-VL-72B-Instruct",
+                hf_token=get_hf_token(),
+            ),
+            os.path.join(data_dir, MODEL_CALLS_FILENAME),
+        )
     # model = OpenAIServerModel(
     #     model_id="gpt-4o",
     #     api_key=os.getenv("OPENAI_API_KEY")
@@ -75,51 +117,95 @@ def create_agent(data_dir, desktop, max_steps: int):
         max_steps=max_steps,
         verbosity_level=2,
         # planning_interval=10,
+        **kwargs,
     )
 
 
-def chat_message_to_json(obj):
-    """Custom JSON serializer for ChatMessage and related objects"""
-    if hasattr(obj, "__dict__"):
-        # Create a copy of the object's __dict__ to avoid modifying the original
-        result = obj.__dict__.copy()
+def atomic_write(path, content: str) -> None:
+    """Write a file so that readers, or a resumed evaluation, never see it half-written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as output_file:
+        output_file.write(content)
+    os.replace(tmp_path, path)
 
-        # Remove the 'raw' field which may contain non-serializable data
-        if "raw" in result:
-            del result["raw"]
 
-        # Process the content or tool_calls if they exist
-        if "content" in result and result["content"] is not None:
-            if hasattr(result["content"], "__dict__"):
-                result["content"] = chat_message_to_json(result["content"])
+def save_final_status(
+    folder, status: str, summary, error_message=None, stats=None, compression=None
+) -> None:
+    """Save metadata about the run, with its performance stats (see run_stats).
 
-        if "tool_calls" in result and result["tool_calls"] is not None:
-            result["tool_calls"] = [
-                chat_message_to_json(tc) for tc in result["tool_calls"]
-            ]
+    With compression ("gz" or "zst"), saved as metadata.json.gz or .zst instead.
+    """
+    # Streamed to a temporary file then renamed, so readers never see it half-written
+    write_json_file(
+        os.path.join(folder, "metadata.json"),
+        {
+            "status": status,
+            "summary": summary,
+            "error_message": error_message,
+            "stats": stats,
+        },
+        compression=compression,
+    )
+    # Written last: a run with a status sidecar has its metadata.json complete
+    write_status_file(folder, status, error_message=error_message, stats=stats)
 
-        return result
-    elif isinstance(obj, (list, tuple)):
-        return [chat_message_to_json(item) for item in obj]
-    else:
-        return obj
 
+# Error of a run failing outside the agent, per phase, which is its failure category
+RUN_PHASE_ERRORS = {
+    "sandbox_setup": "Error setting up sandbox",
+    "saving_results": "Error saving results",
+}
 
-def save_final_status(folder, status: str, summary, error_message=None) -> None:
-    """Save metadata about the run"""
-    metadata_path = os.path.join(folder, "metadata.json")
-    with open(metadata_path, "w") as output_file:
-        output_file.write(
-            json.dumps(
-                {"status": status, "summary": summary, "error_message": error_message},
-                default=chat_message_to_json,
-            )
-        )
 
+def run_stats(run_dir, agent, budget, start_time, setup_time, category=None):
+    """Performance stats of a run, saved in its metadata.json for the eval summary"""
+    model_calls_path = os.path.join(run_dir, MODEL_CALLS_FILENAME)
+    model_latencies = (
+        [call["latency"] for call in read_model_calls(model_calls_path)]
+        if os.path.exists(model_calls_path)
+        else []
+    )
+    steps = (
+        sum(1 for step in agent.memory.steps if isinstance(step, ActionStep))
+        if agent is not None
+        else 0
+    )
+    return {
+        "duration": time.time() - start_time,
+        "setup_time": setup_time,
+        "steps": steps,
+        "input_tokens": budget.input_tokens,
+        "output_tokens": budget.output_tokens,
+        "model_latencies": model_latencies,
+        "failure_category": category,
+    }
 
-def run_example_once(example_name, example_text, run_index, example_dir, max_steps):
-    """Run a single example once and return the result"""
-    run_dir = os.path.join(example_dir, f"run_{run_index}")
+
+def run_example_once(
+    example_name,
+    example_text,
+    run_index,
+    example_dir,
+    max_steps,
+    replay_source=None,
+    replay_latency=1.0,
+    replay_seed=0,
+    replay_tokenizer=None,
+    budget_limits=None,
+    run_dir=None,
+    trace_compression=None,
+):
+    """Run a single example once and return the result.
+
+    With replay_source, the run is offline: the model replays the outputs recorded in that
+    run folder and the desktop is a local stand-in (see model_replay.py). Its tokens are
+    counted with replay_tokenizer, or estimated when None to stay offline. budget_limits are
+    the RunBudget limits of the run: crossing one stops it with the budget_exceeded status.
+    The run is saved in run_dir, by default run_<run_index> of example_dir, with its
+    metadata.json compressed if trace_compression is "gz" or "zst".
+    """
+    run_dir = run_dir or os.path.join(example_dir, f"run_{run_index}")
     os.makedirs(run_dir, exist_ok=True)
 
     # Save the example text
@@ -130,55 +216,119 @@ def run_example_once(example_name, example_text, run_index, example_dir, max_ste
 
     # Create a new sandbox for this run
     desktop = None
+    agent = None
+    trace_writer = None
+    budget = RunBudget(**(budget_limits or {}))
+    start_time = time.time()
+    setup_time = None
+    phase = "sandbox_setup"
     try:
-        desktop = Sandbox(
-            api_key=E2B_API_KEY,
-            resolution=(WIDTH, HEIGHT),
-            dpi=96,
-            timeout=SANDBOX_TIMEOUT,
-            template="k0wmnzir0zuzye6dndlw",
-        )
+        if replay_source:
+            desktop = FakeDesktop(
+                screenshot_dir=replay_source, resolution=(WIDTH, HEIGHT)
+            )
+            model = FakeModelReplayLog(
+                replay_source,
+                latency=replay_latency,
+                seed=replay_seed + run_index,
+                tokenizer_id=replay_tokenizer,
+            )
+            # No desktop to wait for: skip the tools' and screenshot callback's sleeps
+            agent = create_agent(
+                data_dir=run_dir,
+                desktop=desktop,
+                max_steps=max_steps,
+                model=model,
+                sleep_scale=0,
+            )
+        else:
+            desktop = Sandbox(
+                api_key=E2B_API_KEY,
+                resolution=(WIDTH, HEIGHT),
+                dpi=96,
+                timeout=SANDBOX_TIMEOUT,
+                template="k0wmnzir0zuzye6dndlw",
+            )
+
+            # Initialize the desktop environment
+            setup_cmd = """sudo mkdir -p /usr/lib/firefox-esr/distribution && echo '{"policies":{"OverrideFirstRunPage":"","OverridePostUpdatePage":"","DisableProfileImport":true,"DontCheckDefaultBrowser":true}}' | sudo tee /usr/lib/firefox-esr/distribution/policies.json > /dev/null"""
+            desktop.commands.run(setup_cmd)
 
-        # Initialize the desktop environment
-        setup_cmd = """sudo mkdir -p /usr/lib/firefox-esr/distribution && echo '{"policies":{"OverrideFirstRunPage":"","OverridePostUpdatePage":"","DisableProfileImport":true,"DontCheckDefaultBrowser":true}}' | sudo tee /usr/lib/firefox-esr/distribution/policies.json > /dev/null"""
-        desktop.commands.run(setup_cmd)
+            # Create and run the agent
+            agent = create_agent(data_dir=run_dir, desktop=desktop, max_steps=max_steps)
 
-        # Create and run the agent
-        agent = create_agent(data_dir=run_dir, desktop=desktop, max_steps=max_steps)
+        # Persist each step as it completes, so a crashed run keeps its trace
+        trace_writer = TraceWriter(run_dir)
+        trace_writer.write_task(example_text)
+        agent.step_callbacks.append(budget.step_callback)
+        agent.step_callbacks.append(trace_writer.step_callback)
 
         screenshot_bytes = desktop.screenshot(format="bytes")
         initial_screenshot = Image.open(BytesIO(screenshot_bytes))
+        setup_time = time.time() - start_time
+        # The time budget starts with the run, not with the sandbox setup
+        budget.start()
+        error = None
         try:
             agent.run(task=example_text, images=[initial_screenshot])
-            summary = get_agent_summary_erase_images(agent)
-            save_final_status(run_dir, "completed", summary=summary)
+        except Exception as e:
+            error = e
+
+        phase = "saving_results"
+        if error is None:
+            status, error_message = "completed", None
+        elif budget.exceeded_reason is not None:
+            status = BUDGET_EXCEEDED_STATUS
+            error_message = f"Budget exceeded: {budget.exceeded_reason}"
+        else:
+            status = "failed"
+            error_message = f"Error in agent execution: {str(error)}"
+        save_final_status(
+            run_dir,
+            status,
+            summary=get_agent_summary_erase_images(agent),
+            error_message=error_message,
+            stats=run_stats(
+                run_dir,
+                agent,
+                budget,
+                start_time,
+                setup_time,
+                category=failure_category(status, error),
+            ),
+            compression=trace_compression,
+        )
+        trace_writer.write_final(status, error_message=error_message)
+        if error is None:
             thread_safe_print(
                 f"  ✓ Example '{example_name}' run {run_index} completed successfully"
             )
             result = {"status": "completed", "run_dir": run_dir}
-        except Exception as e:
-            error_message = f"Error in agent execution: {str(e)}"
+        else:
             thread_safe_print(
-                f"  ✗ Example '{example_name}' run {run_index} failed: {error_message}"
+                f"  ✗ Example '{example_name}' run {run_index} {status}: {error_message}"
             )
-            summary = (
-                get_agent_summary_erase_images(agent)
-                if hasattr(agent, "memory")
-                else None
-            )
-            save_final_status(
-                run_dir, "failed", summary=summary, error_message=error_message
-            )
-            result = {"status": "failed", "run_dir": run_dir, "error": error_message}
+            result = {"status": status, "run_dir": run_dir, "error": error_message}
     except Exception as e:
-        raise e
-        error_message = f"Error setting up sandbox: {str(e)}"
+        # Failed around the agent: while setting up its sandbox or saving its results
+        error_message = f"{RUN_PHASE_ERRORS[phase]}: {str(e)}"
         thread_safe_print(
             f"  ✗ Example '{example_name}' run {run_index} failed: {error_message}"
         )
-        save_final_status(run_dir, "failed", summary=None, error_message=error_message)
+        save_final_status(
+            run_dir,
+            "failed",
+            summary=None,
+            error_message=error_message,
+            stats=run_stats(run_dir, agent, budget, start_time, setup_time, phase),
+            compression=trace_compression,
+        )
         result = {"status": "failed", "run_dir": run_dir, "error": error_message}
     finally:
+        if trace_writer:
+            trace_writer.close()
+        if agent is not None and isinstance(agent.model, RecordingModel):
+            agent.model.close()
         # Always clean up the sandbox
         if desktop:
             try:
@@ -186,102 +336,432 @@ def run_example_once(example_name, example_text, run_index, example_dir, max_ste
             except:
                 pass
 
+    result["duration"] = time.time() - start_time
+    result["budget"] = budget.to_dict()
+    if agent is not None:
+        result["steps"] = sum(
+            1 for step in agent.memory.steps if isinstance(step, ActionStep)
+        )
     return result
 
-import traceback
 
-def run_example(example_name, example_text, num_runs, example_dir, max_steps):
-    """Run a single example multiple times using threads for each run"""
-    thread_safe_print(f"\nRunning example '{example_name}': '{example_text[:50]}...'")
-
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_runs) as executor:
-        # Submit all runs to the executor
-        future_to_run = {
-            executor.submit(
-                run_example_once, example_name, example_text, j, example_dir, max_steps
-            ): j
-            for j in range(num_runs)
-        }
+def load_historical_durations(output_dir):
+    """Median wall-clock duration in seconds of past runs, per example name.
+
+    A run starts when its task.txt is written and ends when its metadata.json is, so the
+    file modification times of previous evaluations in output_dir are enough.
+    """
+    durations = {}
+    pattern = os.path.join(output_dir, "eval_*", "example_*", "run_*")
+    for run_dir in glob.glob(pattern):
+        if os.path.dirname(os.path.dirname(run_dir)).endswith("_replay"):
+            continue
+        task_path = os.path.join(run_dir, "task.txt")
+        metadata_path = find_trace_file(os.path.join(run_dir, "metadata.json"))
+        if not (os.path.exists(task_path) and metadata_path):
+            continue
+        example_name = os.path.basename(os.path.dirname(run_dir))[len("example_") :]
+        durations.setdefault(example_name, []).append(
+            os.path.getmtime(metadata_path) - os.path.getmtime(task_path)
+        )
+    return {name: statistics.median(values) for name, values in durations.items()}
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    return f"{minutes}m{seconds:02d}s"
+
+
+def run_jobs(
+    jobs,
+    max_parallel,
+    max_steps,
+    expected_durations,
+    run_fn=run_example_once,
+    on_result=None,
+):
+    """Run (example_name, example_text, run_index, example_dir) jobs on a single pool.
+
+    At most max_parallel runs, hence sandboxes, are alive at any time. Jobs start in
+    longest-expected-first order so that slow examples don't end up as stragglers, and
+    progress with an ETA is printed as runs complete. on_result(job, result) may return
+    more jobs to queue, e.g. for sequential early stopping.
+
+    A list of jobs is ordered as a whole. Any other iterable is consumed lazily, a small
+    window at a time, so streamed task sets never have to fit in memory.
+    """
+    default_duration = max(expected_durations.values(), default=1.0)
+
+    def expected(job):
+        return expected_durations.get(job[0], default_duration)
+
+    job_source = iter(jobs)
+    window = len(jobs) if isinstance(jobs, list) else 4 * max_parallel
+    exhausted = False
+    pending = []
+    total_expected = 0.0
+    done_expected = 0.0
+    total_jobs = 0
+    start_time = time.time()
+
+    all_results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        running = {}
+        while True:
+            while not exhausted and len(pending) < window:
+                job = next(job_source, None)
+                if job is None:
+                    exhausted = True
+                    break
+                pending.append(job)
+                total_expected += expected(job)
+                total_jobs += 1
+            pending.sort(key=expected, reverse=True)
+            if not pending and not running:
+                break
+
+            while pending and len(running) < max_parallel:
+                job = pending.pop(0)
+                future = executor.submit(run_fn, *job, max_steps)
+                running[future] = job
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                example_name, _, run_index, _ = job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    error_traceback = traceback.format_exc()
+                    thread_safe_print(
+                        f"  ✗ Run {run_index} for '{example_name}' generated an exception:\n{error_traceback}"
+                    )
+                    result = {
+                        "status": "error",
+                        "run_index": run_index,
+                        "error": str(exc),
+                    }
+                all_results.setdefault(example_name, []).append(result)
+                if on_result is not None:
+                    new_jobs = on_result(job, result)
+                    pending.extend(new_jobs)
+                    total_expected += sum(expected(new_job) for new_job in new_jobs)
+                    total_jobs += len(new_jobs)
+
+                # The ETA scales the expected work left by the observed pace so far
+                done_expected += expected(job)
+                completed = sum(len(results) for results in all_results.values())
+                elapsed = time.time() - start_time
+                eta = (
+                    elapsed * (total_expected - done_expected) / done_expected
+                    if done_expected > 0
+                    else 0.0
+                )
+                thread_safe_print(
+                    f"[{completed}/{total_jobs}{'' if exhausted else '+'}] '{example_name}' run {run_index}: {result['status']}"
+                    f" | elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}"
+                )
+
+    return all_results
+
+
+def coordinate_jobs(queue_path, jobs, options, on_result=None, poll_interval=2.0):
+    """Distributed counterpart of run_jobs: queue the jobs for workers and wait for them.
+
+    Jobs go to the WorkQueue at queue_path with options ({"max_steps", "budget_limits",
+    "trace_compression"}), and results are gathered in completion order as workers (see
+    run_worker) finish them, with on_result called like in run_jobs. Returns the results
+    per example, like run_jobs.
+    """
+    queue = WorkQueue(queue_path)
+    queue.set_closed(False)
+    seq = queue.last_finished_seq()
+    total_jobs = queue.enqueue(jobs, options)
+    start_time = time.time()
+
+    all_results = {}
+    while True:
+        # Counted before reading results, so nothing finishing in between is missed
+        counts = queue.counts()
+        new_jobs = []
+        for seq, job, result in queue.finished_since(seq):
+            example_name, _, run_index, _ = job
+            all_results.setdefault(example_name, []).append(result)
+            if on_result is not None:
+                new_jobs.extend(on_result(job, result))
+            completed = sum(len(results) for results in all_results.values())
+            thread_safe_print(
+                f"[{completed}/{total_jobs}] '{example_name}' run {run_index}: {result['status']}"
+                f" | {counts.get('running', 0)} running, elapsed {format_duration(time.time() - start_time)}"
+            )
+        if new_jobs:
+            total_jobs += queue.enqueue(new_jobs, options)
+        elif not counts.get("pending") and not counts.get("running"):
+            break
+        time.sleep(poll_interval)
+
+    # Let idle workers exit
+    queue.set_closed(True)
+    return all_results
+
+
+def run_worker(queue_path, max_parallel, lease_seconds=120, poll_interval=5.0):
+    """Run jobs claimed from the WorkQueue at queue_path until it is closed and drained.
 
-        # Collect results as they complete
-        for future in concurrent.futures.as_completed(future_to_run):
-            run_index = future_to_run[future]
+    Up to max_parallel runs (hence sandboxes) are alive in this process. Leases are renewed
+    in the background while runs are alive, so only jobs of dead workers are handed out
+    again. A worker whose lease expired may still be writing its run though, so every
+    attempt runs in its own hidden folder, moved to run_<index> only by the attempt that
+    completes the job.
+    """
+    queue = WorkQueue(queue_path)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    held_jobs = set()
+    held_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def renew_leases():
+        while not stopped.wait(lease_seconds / 3):
+            with held_lock:
+                job_ids = list(held_jobs)
             try:
-                result = future.result()
-                results.append(result)
+                queue.renew(job_ids, worker_id, lease_seconds)
+            except Exception as e:
+                thread_safe_print(f"Could not renew leases: {e}")
+
+    def work():
+        while True:
+            claimed = queue.claim(worker_id, lease_seconds)
+            if claimed is None:
+                counts = queue.counts()
+                if (
+                    queue.is_closed()
+                    and not counts.get("pending")
+                    and not counts.get("running")
+                ):
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            job_id, job, options, attempt = claimed
+            example_name, _, run_index, example_dir = job
+            if attempt > 1:
+                thread_safe_print(
+                    f"  Retrying run {run_index} for '{example_name}' (attempt {attempt})"
+                )
+            run_dir = os.path.join(example_dir, f"run_{run_index}")
+            attempt_dir = os.path.join(
+                example_dir, f".run_{run_index}.attempt{attempt}.{worker_id}"
+            )
+            with held_lock:
+                held_jobs.add(job_id)
+            try:
+                result = run_example_once(
+                    *job,
+                    options["max_steps"],
+                    budget_limits=options.get("budget_limits"),
+                    run_dir=attempt_dir,
+                    trace_compression=options.get("trace_compression"),
+                )
             except Exception as exc:
-                error_traceback = traceback.format_exc()
                 thread_safe_print(
-                    f"  ✗ Run {run_index} for '{example_name}' generated an exception:\n{error_traceback}"
+                    f"  ✗ Run {run_index} for '{example_name}' generated an exception:\n{traceback.format_exc()}"
                 )
-                results.append(
-                    {"status": "error", "run_index": run_index, "error": str(exc)}
+                result = {"status": "error", "run_index": run_index, "error": str(exc)}
+            finally:
+                with held_lock:
+                    held_jobs.discard(job_id)
+
+            def publish():
+                # Leftovers of an earlier session's attempt, none is still running
+                shutil.rmtree(run_dir, ignore_errors=True)
+                if os.path.exists(attempt_dir):
+                    os.rename(attempt_dir, run_dir)
+                result["run_dir"] = run_dir
+
+            if not queue.complete(job_id, worker_id, result, publish=publish):
+                thread_safe_print(
+                    f"  Lost the lease of run {run_index} for '{example_name}': result dropped"
                 )
+                shutil.rmtree(attempt_dir, ignore_errors=True)
 
-    return results
+    thread_safe_print(
+        f"Worker {worker_id} serving {queue_path} with {max_parallel} slots"
+    )
+    threading.Thread(target=renew_leases, daemon=True).start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        for future in [executor.submit(work) for _ in range(max_parallel)]:
+            future.result()
+    stopped.set()
+    thread_safe_print(f"Worker {worker_id}: queue drained, exiting")
 
 
-def run_evaluation(examples, num_runs, output_dir, max_parallel, max_steps):
-    """Run each example n times and save the results"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    git_hash = get_git_hash()
-    eval_dir = os.path.join(output_dir, f"eval_{timestamp}_{git_hash}")
-    os.makedirs(eval_dir, exist_ok=True)
+def read_run_metadata(run_dir):
+    """A run's metadata.json, or None if the run never finished"""
+    try:
+        return read_json_file(os.path.join(run_dir, "metadata.json"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-    start_time = datetime.now()
 
-    thread_safe_print(f"Starting evaluation. Results will be saved to: {eval_dir}")
-    thread_safe_print(
-        f"Will run {len(examples)} examples, {num_runs} times each, with {max_parallel} parallel examples"
+def list_run_indices(example_dir):
+    if not os.path.exists(example_dir):
+        return []
+    return sorted(
+        int(item[len("run_") :])
+        for item in os.listdir(example_dir)
+        if item.startswith("run_") and item[len("run_") :].isdigit()
     )
 
-    # Save examples to the evaluation directory
-    with open(os.path.join(eval_dir, "examples.json"), "w") as f:
-        json.dump(examples, f, indent=2)
 
-    all_results = {}
+def iter_jobs(eval_dir, examples, num_runs, resume=False):
+    """Yield the (example_name, example_text, run_index, example_dir) jobs left to run.
 
-    # Run examples in parallel, but limit the number of parallel examples
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
-        # Prepare the example directories first
-        example_dirs = {}
+    On a fresh evaluation, that's every run. When resuming, completed runs and runs
+    stopped by their budget are skipped, while failed, interrupted or never started runs
+    are cleared and queued again.
+    """
+    for example_name, example_text in examples.items():
+        example_dir = os.path.join(eval_dir, f"example_{example_name}")
+        os.makedirs(example_dir, exist_ok=True)
+        for run_index in range(num_runs):
+            run_dir = os.path.join(example_dir, f"run_{run_index}")
+            if resume:
+                if read_run_status(run_dir) in ("completed", BUDGET_EXCEEDED_STATUS):
+                    continue
+                # Drop leftovers (screenshots, partial trace) of the previous attempt
+                shutil.rmtree(run_dir, ignore_errors=True)
+            yield (example_name, example_text, run_index, example_dir)
+
+
+def plan_jobs(eval_dir, examples, num_runs, resume=False):
+    """List the jobs left to run, see iter_jobs"""
+    return list(iter_jobs(eval_dir, examples, num_runs, resume=resume))
+
+
+class SequentialStopping:
+    """Keeps scheduling runs of an example until its success rate is known well enough.
+
+    An example stops once it has at least min_runs finished runs and the 95% Wilson
+    interval of its success rate is at most target_ci_width wide, or once max_runs runs are
+    finished or in flight. Saturated examples (0/n or n/n) converge after a few runs, so
+    the sandboxes go to the uncertain ones. Runs that crashed before saving a status are
+    not counted as outcomes. Outcomes are kept per run index: a run read from disk that
+    planning queues again (e.g. a failed run on --resume) only counts once rerun.
+    """
+
+    def __init__(self, eval_dir, examples, min_runs, max_runs, target_ci_width):
+        self.eval_dir = eval_dir
+        self.examples = examples
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.target_ci_width = target_ci_width
+        self.outcomes = {}
+        self.next_index = {}
+        self.in_flight = Counter()
         for example_name in examples:
             example_dir = os.path.join(eval_dir, f"example_{example_name}")
-            os.makedirs(example_dir, exist_ok=True)
-            example_dirs[example_name] = example_dir
-
-        # Submit all examples to the executor
-        future_to_example = {
-            executor.submit(
-                run_example,
-                example_name,
-                example_text,
-                num_runs,
-                example_dirs[example_name],
-                max_steps,
-            ): example_name
-            for example_name, example_text in examples.items()
+            indices = list_run_indices(example_dir)
+            statuses = [
+                read_run_status(os.path.join(example_dir, f"run_{run_index}"))
+                for run_index in indices
+            ]
+            self.outcomes[example_name] = {
+                run_index: status == "completed"
+                for run_index, status in zip(indices, statuses)
+                if status is not None
+            }
+            self.next_index[example_name] = max(indices + [min_runs - 1]) + 1
+
+    def ci_width(self, example_name):
+        outcomes = self.outcomes[example_name]
+        interval = wilson_interval(sum(outcomes.values()), len(outcomes))
+        return interval[1] - interval[0] if interval else 1.0
+
+    def converged(self, example_name):
+        return (
+            len(self.outcomes[example_name]) >= self.min_runs
+            and self.ci_width(example_name) <= self.target_ci_width
+        )
+
+    def wants_more(self, example_name):
+        scheduled = len(self.outcomes[example_name]) + self.in_flight[example_name]
+        return not self.converged(example_name) and scheduled < self.max_runs
+
+    def start(self, jobs):
+        """Yield the planned jobs, then one run per unsettled example that had none"""
+        planned = set()
+        for job in jobs:
+            planned.add(job[0])
+            self.in_flight[job[0]] += 1
+            # Its previous outcome was cleared to run it again
+            self.outcomes[job[0]].pop(job[2], None)
+            yield job
+        for example_name, example_text in self.examples.items():
+            if example_name not in planned and self.wants_more(example_name):
+                yield self._next_job(example_name, example_text)
+
+    def _next_job(self, example_name, example_text):
+        run_index = self.next_index[example_name]
+        self.next_index[example_name] += 1
+        self.in_flight[example_name] += 1
+        example_dir = os.path.join(self.eval_dir, f"example_{example_name}")
+        return (example_name, example_text, run_index, example_dir)
+
+    def on_result(self, job, result):
+        example_name, example_text, run_index = job[0], job[1], job[2]
+        self.in_flight[example_name] -= 1
+        if result["status"] != "error":
+            self.outcomes[example_name][run_index] = result["status"] == "completed"
+        if self.wants_more(example_name):
+            return [self._next_job(example_name, example_text)]
+        return []
+
+    def report(self):
+        runs = {name: len(outcomes) for name, outcomes in self.outcomes.items()}
+        return {
+            "target_ci_width": self.target_ci_width,
+            "min_runs": self.min_runs,
+            "max_runs": self.max_runs,
+            "runs": sum(runs.values()),
+            # Compared to running every example max_runs times
+            "runs_saved": sum(max(0, self.max_runs - n) for n in runs.values()),
+            "examples": {
+                name: {
+                    "runs": runs[name],
+                    "ci_width": self.ci_width(name),
+                    "converged": self.converged(name),
+                }
+                for name in self.examples
+            },
         }
 
-        # Collect results as they complete
-        for future in concurrent.futures.as_completed(future_to_example):
-            example_name = future_to_example[future]
-            try:
-                results = future.result()
-                all_results[example_name] = results
 
-                # Calculate success rate for this example
-                success_count = sum(1 for r in results if r["status"] == "completed")
-                thread_safe_print(
-                    f"Example '{example_name}' complete: {success_count}/{num_runs} successful runs ({success_count / num_runs * 100:.1f}%)"
-                )
-            except Exception as exc:
-                thread_safe_print(
-                    f"Example '{example_name}' generated an exception: {exc}"
-                )
-                all_results[example_name] = [{"status": "error", "error": str(exc)}]
+def collect_results(eval_dir, examples):
+    """Read back the result of every run on disk, including runs from previous sessions"""
+    all_results = {}
+    for example_name in examples:
+        example_dir = os.path.join(eval_dir, f"example_{example_name}")
+        results = []
+        for run_index in list_run_indices(example_dir):
+            run_dir = os.path.join(example_dir, f"run_{run_index}")
+            metadata = read_run_metadata(run_dir) or {}
+            results.append(
+                {
+                    "status": metadata.get("status") or "missing",
+                    "run_dir": run_dir,
+                    "stats": metadata.get("stats"),
+                }
+            )
+        all_results[example_name] = results
+    return all_results
+
 
+def write_summary(eval_dir, examples, all_results):
     # Calculate overall results and success rates
     success_counts = {
         example_name: sum(1 for r in results if r["status"] == "completed")
@@ -290,25 +770,267 @@ def run_evaluation(examples, num_runs, output_dir, max_parallel, max_steps):
 
     total_runs = sum(len(results) for results in all_results.values())
     total_successes = sum(success_counts.values())
+    status_counts = Counter(
+        r["status"] for results in all_results.values() for r in results
+    )
 
     # Save summary to evaluation directory
     summary = {
         "total_runs": total_runs,
         "total_successes": total_successes,
         "success_rate": total_successes / total_runs if total_runs > 0 else 0,
+        "budget_exceeded_runs": status_counts[BUDGET_EXCEEDED_STATUS],
+        "status_counts": dict(status_counts),
         "example_success_rates": {
-            example_name: success_counts[example_name] / len(all_results[example_name])
+            example_name: (
+                success_counts[example_name] / len(all_results[example_name])
+                if all_results[example_name]
+                else 0
+            )
+            for example_name in examples
+        },
+        # Performance next to quality: durations, steps, latencies, tokens, failures
+        "stats": aggregate_runs(
+            [r for results in all_results.values() for r in results]
+        ),
+        "example_stats": {
+            example_name: aggregate_runs(all_results.get(example_name, []))
             for example_name in examples
         },
     }
 
-    with open(os.path.join(eval_dir, "summary.json"), "w") as f:
-        json.dump(summary, f, indent=2)
+    atomic_write(os.path.join(eval_dir, "summary.json"), json.dumps(summary, indent=2))
+    return summary
+
+
+def record_results(output_dir, eval_dir, git_hash, all_results):
+    """Add the runs of an evaluation to the results store of output_dir, where
+    show_eval.py compares evaluations"""
+    store_path = os.path.join(output_dir, RESULTS_STORE_FILENAME)
+    try:
+        ResultsStore(store_path).record_eval(
+            os.path.basename(eval_dir.rstrip("/")),
+            git_hash,
+            [
+                run_record(example_name, r["run_dir"], r["status"], r["stats"])
+                for example_name, results in all_results.items()
+                for r in results
+            ],
+        )
+    except sqlite3.Error as e:
+        # The summary is saved already, the store can be rebuilt from the folders
+        thread_safe_print(f"WARNING: could not record results in {store_path}: {e}")
+
+
+def run_evaluation(
+    examples,
+    num_runs,
+    output_dir,
+    max_parallel,
+    max_steps,
+    resume_dir=None,
+    add_runs=0,
+    budget_limits=None,
+    early_stopping=None,
+    queue_path=None,
+    trace_compression=None,
+):
+    """Run each example n times and save the results.
+
+    With resume_dir, continue an interrupted evaluation in place instead of creating a new
+    one: its examples, number of runs and budget are read back from the folder, and
+    add_runs more runs per example can be requested on top.
+
+    With early_stopping, a {"target_ci_width", "max_runs"} dict, num_runs is only the
+    minimum: see SequentialStopping.
+
+    examples is either a {name: task} dict, saved as examples.json, or a TaskDataset,
+    copied line by line to examples.jsonl and streamed from there. Either way, every
+    finished run is appended to results.jsonl as soon as it completes.
+
+    With queue_path, runs are not executed here but queued for worker processes, on this
+    host or others sharing the filesystem: see coordinate_jobs and run_worker.
+
+    With trace_compression ("gz" or "zst"), run metadata files are saved compressed.
+    """
+    if resume_dir:
+        eval_dir = resume_dir.rstrip("/")
+        output_dir = os.path.dirname(eval_dir)
+        if os.path.exists(os.path.join(eval_dir, "examples.jsonl")):
+            examples = TaskDataset(os.path.join(eval_dir, "examples.jsonl"))
+        else:
+            with open(os.path.join(eval_dir, "examples.json"), "r") as f:
+                examples = json.load(f)
+        config_path = os.path.join(eval_dir, "eval_config.json")
+        # The commit the evaluation started on, which its folder is named after
+        git_hash = git_hash_from_name(os.path.basename(eval_dir))
+        if os.path.exists(config_path):
+            with open(config_path, "r") as f:
+                config = json.load(f)
+            num_runs = config["num_runs"]
+            git_hash = config.get("git_hash", git_hash)
+            budget_limits = config.get("budget_limits", budget_limits)
+            early_stopping = config.get("early_stopping", early_stopping)
+            trace_compression = config.get("trace_compression", trace_compression)
+        else:
+            # Evaluations started before eval_config.json existed: trust what's on disk
+            num_runs = max(
+                [num_runs]
+                + [
+                    len(list_run_indices(os.path.join(eval_dir, f"example_{name}")))
+                    for name in examples
+                ]
+            )
+        num_runs += add_runs
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        git_hash = get_git_hash()
+        eval_dir = os.path.join(output_dir, f"eval_{timestamp}_{git_hash}")
+
+    # Read history before creating this evaluation's folder
+    expected_durations = load_historical_durations(output_dir)
+    os.makedirs(eval_dir, exist_ok=True)
+
+    start_time = datetime.now()
+
+    if resume_dir:
+        thread_safe_print(f"Resuming evaluation in: {eval_dir}")
+        if not eval_dir.endswith(f"_{get_git_hash()}"):
+            thread_safe_print(
+                f"WARNING: current commit {get_git_hash()} differs from the one this evaluation started on"
+            )
+    else:
+        thread_safe_print(f"Starting evaluation. Results will be saved to: {eval_dir}")
+
+    # Save examples and run count first, so an interrupted evaluation can be resumed
+    if isinstance(examples, TaskDataset):
+        examples_path = os.path.join(eval_dir, "examples.jsonl")
+        if examples.path != examples_path:
+            examples.write_jsonl(examples_path)
+            examples = TaskDataset(examples_path)
+    else:
+        atomic_write(
+            os.path.join(eval_dir, "examples.json"), json.dumps(examples, indent=2)
+        )
+    num_examples = sum(1 for _ in examples)
+    atomic_write(
+        os.path.join(eval_dir, "eval_config.json"),
+        json.dumps(
+            {
+                "num_runs": num_runs,
+                "max_steps": max_steps,
+                "budget_limits": budget_limits,
+                "early_stopping": early_stopping,
+                "trace_compression": trace_compression,
+                "git_hash": git_hash,
+            },
+            indent=2,
+        ),
+    )
+
+    # A single scheduler over every (example, run) pair, so max_parallel bounds sandboxes
+    if isinstance(examples, TaskDataset):
+        jobs = iter_jobs(eval_dir, examples, num_runs, resume=bool(resume_dir))
+        thread_safe_print(
+            f"Will stream runs over {num_examples} examples ({num_runs} runs each), with at most {max_parallel} sandboxes in parallel"
+        )
+    else:
+        jobs = plan_jobs(eval_dir, examples, num_runs, resume=bool(resume_dir))
+        thread_safe_print(
+            f"Will run {len(jobs)} runs over {num_examples} examples ({num_runs} runs each), with at most {max_parallel} sandboxes in parallel"
+        )
+
+    stopping = None
+    if early_stopping:
+        stopping = SequentialStopping(
+            eval_dir,
+            examples,
+            min_runs=num_runs,
+            max_runs=early_stopping["max_runs"],
+            target_ci_width=early_stopping["target_ci_width"],
+        )
+        jobs = stopping.start(jobs)
+        if not isinstance(examples, TaskDataset):
+            jobs = list(jobs)
+        thread_safe_print(
+            f"Early stopping: up to {stopping.max_runs} runs per example, until the success rate's 95% CI is at most {stopping.target_ci_width:.2f} wide"
+        )
+
+    results_path = os.path.join(eval_dir, "results.jsonl")
+
+    def on_result(job, result):
+        # One line per finished run, so large suites can be followed while they run
+        with open(results_path, "a") as results_file:
+            results_file.write(
+                json.dumps(
+                    {"example": job[0], "run_index": job[2], **result}, default=str
+                )
+                + "\n"
+            )
+        return stopping.on_result(job, result) if stopping else []
+
+    if queue_path:
+        thread_safe_print(
+            f"Queued runs in {queue_path}: start workers with `python eval.py --worker {queue_path}`"
+        )
+        all_results = coordinate_jobs(
+            queue_path,
+            jobs,
+            {
+                "max_steps": max_steps,
+                "budget_limits": budget_limits,
+                "trace_compression": trace_compression,
+            },
+            on_result=on_result,
+        )
+    else:
+        all_results = run_jobs(
+            jobs,
+            max_parallel,
+            max_steps,
+            expected_durations,
+            run_fn=functools.partial(
+                run_example_once,
+                budget_limits=budget_limits,
+                trace_compression=trace_compression,
+            ),
+            on_result=on_result,
+        )
+
+    for example_name, results in all_results.items():
+        success_count = sum(1 for r in results if r["status"] == "completed")
+        thread_safe_print(
+            f"Example '{example_name}' complete: {success_count}/{len(results)} successful runs ({success_count / len(results) * 100:.1f}%)"
+        )
+
+    # The summary covers every run on disk, not only the ones run in this session
+    all_results = collect_results(eval_dir, examples)
+    summary = write_summary(eval_dir, examples, all_results)
+    if stopping:
+        summary["early_stopping"] = stopping.report()
+        atomic_write(
+            os.path.join(eval_dir, "summary.json"), json.dumps(summary, indent=2)
+        )
+    record_results(output_dir, eval_dir, git_hash, all_results)
 
     thread_safe_print(f"\nEvaluation complete. Results saved to: {eval_dir}")
     thread_safe_print(
-        f"Overall success rate: {summary['success_rate'] * 100:.1f}% ({total_successes}/{total_runs})"
+        f"Overall success rate: {summary['success_rate'] * 100:.1f}% ({summary['total_successes']}/{summary['total_runs']})"
     )
+    stats = summary["stats"]
+    if stats["duration"]:
+        thread_safe_print(
+            f"Run duration p50 {stats['duration']['p50']:.1f}s, p95 {stats['duration']['p95']:.1f}s"
+            f" | {stats['input_tokens']['total']} input tokens, {stats['output_tokens']['total']} output tokens"
+        )
+    if stopping:
+        thread_safe_print(
+            f"Early stopping saved {summary['early_stopping']['runs_saved']} runs out of {stopping.max_runs * num_examples}"
+        )
+    if summary["budget_exceeded_runs"]:
+        thread_safe_print(
+            f"Runs stopped by their budget: {summary['budget_exceeded_runs']}"
+        )
     for example_name in examples:
         success_rate = summary["example_success_rates"][example_name] * 100
         thread_safe_print(f"Example '{example_name}': {success_rate:.1f}% success")
@@ -318,6 +1040,109 @@ def run_evaluation(examples, num_runs, output_dir, max_parallel, max_steps):
     return eval_dir
 
 
+def find_replay_sources(replay_dir):
+    """List (example_name, task, run_dir) for every recorded run found under replay_dir"""
+    sources = []
+    for root, _, files in sorted(os.walk(replay_dir)):
+        if not {MODEL_CALLS_FILENAME, TRACE_FILENAME, "metadata.json"} & set(files):
+            continue
+        task = None
+        if "task.txt" in files:
+            with open(os.path.join(root, "task.txt"), "r") as f:
+                task = f.read().strip()
+        elif TRACE_FILENAME in files:
+            task = read_trace(root)["task"]
+        if not task:
+            thread_safe_print(f"Skipping {root}: no task found")
+            continue
+        parent = os.path.basename(os.path.dirname(root))
+        example_name = (
+            parent[len("example_") :]
+            if parent.startswith("example_")
+            else os.path.basename(root)
+        )
+        sources.append((example_name, task, root))
+    return sources
+
+
+def run_replay_benchmark(
+    replay_dir,
+    output_dir,
+    max_parallel,
+    max_steps,
+    latency="recorded",
+    seed=0,
+    tokenizer_id=None,
+):
+    """Replay recorded runs end to end, offline, and report how long the framework takes.
+
+    Every run found under replay_dir is re-run through run_example_once with its recorded
+    model outputs and screenshots, so only the agent framework, our callbacks and the
+    simulated model latency are measured. Results are saved like a normal evaluation.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    git_hash = get_git_hash()
+    eval_dir = os.path.join(output_dir, f"eval_{timestamp}_{git_hash}_replay")
+    os.makedirs(eval_dir, exist_ok=True)
+
+    examples, jobs, replay_sources = {}, [], {}
+    for example_name, task, source_dir in find_replay_sources(replay_dir):
+        examples[example_name] = task
+        example_dir = os.path.join(eval_dir, f"example_{example_name}")
+        os.makedirs(example_dir, exist_ok=True)
+        run_index = sum(1 for job in jobs if job[0] == example_name)
+        jobs.append((example_name, task, run_index, example_dir))
+        replay_sources[(example_name, run_index)] = source_dir
+
+    def replay_run(example_name, example_text, run_index, example_dir, max_steps):
+        return run_example_once(
+            example_name,
+            example_text,
+            run_index,
+            example_dir,
+            max_steps,
+            replay_source=replay_sources[(example_name, run_index)],
+            replay_latency=latency,
+            replay_seed=seed,
+            replay_tokenizer=tokenizer_id,
+        )
+
+    atomic_write(
+        os.path.join(eval_dir, "examples.json"), json.dumps(examples, indent=2)
+    )
+    thread_safe_print(
+        f"Replaying {len(jobs)} recorded runs from {replay_dir} (latency: {latency}) into {eval_dir}"
+    )
+
+    start_time = time.time()
+    all_results = run_jobs(jobs, max_parallel, max_steps, {}, run_fn=replay_run)
+    wall_time = time.time() - start_time
+
+    results = [r for example_results in all_results.values() for r in example_results]
+    durations = sorted(r["duration"] for r in results if "duration" in r)
+    total_steps = sum(r.get("steps", 0) for r in results)
+    all_results = collect_results(eval_dir, examples)
+    summary = write_summary(eval_dir, examples, all_results)
+    record_results(output_dir, eval_dir, git_hash, all_results)
+    summary["replay"] = {
+        "source": replay_dir,
+        "latency": latency,
+        "seed": seed,
+        "wall_time": wall_time,
+        "total_steps": total_steps,
+        "steps_per_second": total_steps / wall_time if wall_time > 0 else 0,
+        "run_duration_p50": statistics.median(durations) if durations else None,
+        "run_duration_max": durations[-1] if durations else None,
+    }
+    atomic_write(os.path.join(eval_dir, "summary.json"), json.dumps(summary, indent=2))
+
+    thread_safe_print(
+        f"\nReplay complete in {wall_time:.2f}s: {len(results)} runs, {total_steps} steps "
+        f"({summary['replay']['steps_per_second']:.1f} steps/s). Results saved to: {eval_dir}"
+    )
+    return eval_dir
+
+
 def main():
     parser = argparse.ArgumentParser(description="Evaluate computer agent on examples")
     parser.add_argument(
@@ -333,12 +1158,150 @@ def main():
         "--max-parallel",
         type=int,
         default=2,
-        help="Maximum number of examples to run in parallel",
+        help="Maximum number of runs (hence sandboxes) alive in parallel",
     )
     parser.add_argument(
         "--max-steps", type=int, default=200, help="Maximum number of steps in each run"
     )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        metavar="EVAL_DIR",
+        help="Resume an interrupted evaluation: skip completed runs, rerun failed or missing ones",
+    )
+    parser.add_argument(
+        "--add-runs",
+        type=int,
+        default=0,
+        help="With --resume, add this many runs per example on top of the existing ones",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        default=None,
+        metavar="RUNS_DIR",
+        help="Offline benchmark: replay every recorded run under this folder against a fake desktop",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=str,
+        default="recorded",
+        help="Model latency during replay: 'recorded', a number of seconds, or 'lognormal:<median>,<sigma>'",
+    )
+    parser.add_argument(
+        "--replay-seed", type=int, default=0, help="Seed of sampled replay latencies"
+    )
+    parser.add_argument(
+        "--replay-tokenizer",
+        type=str,
+        default=None,
+        help="Hub tokenizer counting replayed tokens, downloaded if needed (default: estimate offline)",
+    )
+    parser.add_argument(
+        "--max-input-tokens",
+        type=int,
+        default=None,
+        help="Budget: stop a run once it has sent this many input tokens",
+    )
+    parser.add_argument(
+        "--max-output-tokens",
+        type=int,
+        default=None,
+        help="Budget: stop a run once it has generated this many output tokens",
+    )
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=None,
+        help="Budget: stop a run once this many wall-clock seconds have passed since it started, checked after each step",
+    )
+    parser.add_argument(
+        "--max-steps-without-progress",
+        type=int,
+        default=None,
+        help="Budget: stop a run after this many consecutive steps that errored or left the screen unchanged",
+    )
+    parser.add_argument(
+        "--trace-compression",
+        choices=TRACE_COMPRESSIONS,
+        default=None,
+        help="Save the metadata.json of each run compressed, as metadata.json.gz or .zst (zst needs the zstandard package)",
+    )
+    parser.add_argument(
+        "--target-ci-width",
+        type=float,
+        default=None,
+        help="Early stopping: keep adding runs to an example until the 95%% CI of its success rate is at most this wide (--num-runs becomes the minimum)",
+    )
+    parser.add_argument(
+        "--max-runs",
+        type=int,
+        default=20,
+        help="Early stopping: maximum number of runs per example",
+    )
+    parser.add_argument(
+        "--tasks",
+        type=str,
+        default=None,
+        metavar="TASKS_JSONL",
+        help='Stream tasks from a JSONL file of {"id", "task", ...} objects instead of the built-in examples',
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="With --tasks, only keep tasks whose FIELD equals (or, for lists, contains) VALUE. Repeatable",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        metavar="I/N",
+        help="With --tasks, only run shard I (0-based) of N, split by task id",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="With --tasks, run at most this many tasks",
+    )
+    parser.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        metavar="QUEUE_DB",
+        help="Coordinator mode: queue the runs in this SQLite file for --worker processes instead of running them",
+    )
+    parser.add_argument(
+        "--worker",
+        type=str,
+        default=None,
+        metavar="QUEUE_DB",
+        help="Worker mode: run jobs from this queue file, with --max-parallel runs per process, until it is drained",
+    )
+    parser.add_argument(
+        "--worker-processes",
+        type=int,
+        default=1,
+        help="With --worker, number of worker processes to start on this host",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=120,
+        help="With --worker, seconds after which the run of an unresponsive worker is handed out again",
+    )
     args = parser.parse_args()
+    early_stopping = (
+        {"target_ci_width": args.target_ci_width, "max_runs": args.max_runs}
+        if args.target_ci_width is not None
+        else None
+    )
+    budget_limits = {name: getattr(args, name) for name in BUDGET_LIMITS}
+    if args.add_runs and not args.resume:
+        parser.error("--add-runs requires --resume")
 
     # Examples from the original code
     examples = {
@@ -349,12 +1312,66 @@ def main():
         "hf_space": "Go to Hugging Face Spaces and then find the Space flux.1 schnell. Use the space to generate an image of a GPU",
     }
 
+    if args.tasks:
+        try:
+            examples = TaskDataset(
+                args.tasks,
+                filters=parse_filters(args.filter),
+                shard=parse_shard(args.shard) if args.shard else None,
+                limit=args.limit,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.filter or args.shard or args.limit:
+        parser.error("--filter, --shard and --limit require --tasks")
+
+    if args.worker:
+        # Separate processes, so PIL work and callbacks aren't serialized by one GIL
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(args.worker, args.max_parallel, args.lease_seconds),
+            )
+            for _ in range(args.worker_processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
 
+    if args.replay:
+        try:
+            latency = float(args.replay_latency)
+        except ValueError:
+            latency = args.replay_latency
+        run_replay_benchmark(
+            args.replay,
+            args.output_dir,
+            args.max_parallel,
+            args.max_steps,
+            latency=latency,
+            seed=args.replay_seed,
+            tokenizer_id=args.replay_tokenizer,
+        )
+        return
+
     # Run the evaluation
     run_evaluation(
-        examples, args.num_runs, args.output_dir, args.max_parallel, args.max_steps
+        examples,
+        args.num_runs,
+        args.output_dir,
+        args.max_parallel,
+        args.max_steps,
+        resume_dir=args.resume,
+        add_runs=args.add_runs,
+        budget_limits=budget_limits,
+        early_stopping=early_stopping,
+        queue_path=args.queue,
+        trace_compression=args.trace_compression,
     )
 
 
@@ -0,0 +1,262 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from run_status import STATUS_FILENAME, read_run_status
+from trace_files import find_trace_file, read_json_file
+
+
+def run_sort_key(name: str):
+    # run_10 after run_9
+    suffix = name.rsplit("_", 1)[-1]
+    return (0, int(suffix), name) if suffix.isdigit() else (1, 0, name)
+
+
+def list_subdirs(path: str, prefix: str) -> List[str]:
+    with os.scandir(path) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.name.startswith(prefix) and entry.is_dir()
+        ]
+
+
+def read_examples_file(eval_dir: str) -> Dict[str, str]:
+    """The ``{example_id: task}`` an eval was started with, from examples.json(l)"""
+    examples_jsonl_path = os.path.join(eval_dir, "examples.jsonl")
+    examples_json_path = os.path.join(eval_dir, "examples.json")
+    examples = {}
+    try:
+        if os.path.exists(examples_jsonl_path):
+            with open(examples_jsonl_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        examples[str(record["id"])] = record["task"]
+        elif os.path.exists(examples_json_path):
+            with open(examples_json_path, "r") as f:
+                examples = json.load(f)
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"Error parsing the examples file of {eval_dir}: {e}")
+    return examples
+
+
+def read_run_task(run_dir: str) -> Optional[str]:
+    """Task of a run, from its task.txt or, for older runs, its metadata summary"""
+    task_path = os.path.join(run_dir, "task.txt")
+    if os.path.exists(task_path):
+        with open(task_path, "r") as f:
+            return f.read().strip()
+    try:
+        summary = read_json_file(os.path.join(run_dir, "metadata.json")).get("summary")
+        if summary and "task" in summary[0]:
+            return summary[0]["task"]
+    except Exception:
+        pass
+    return None
+
+
+def _file_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class EvalIndex:
+    """In-memory index of eval result folders: evals -> examples -> runs -> status/task.
+
+    Every folder of the tree is a node, cached with the mtime of the directory. Adding,
+    removing or atomically replacing a file (as eval.py does for metadata.json) changes
+    the mtime of its directory, so a node is only rebuilt when its directory changed, and
+    a run's metadata.json is only parsed again when the file itself changed. A folder is
+    validated at most once every ``max_age`` seconds; in between, lookups are served from
+    memory.
+
+    With ``db_path``, nodes are also saved to a SQLite file and loaded back on start, so a
+    restarted server only re-reads the folders that changed while it was down.
+
+    Parameters:
+        db_path (str): Optional path to the SQLite file persisting the index.
+        max_age (float): Seconds during which a validated folder is trusted as is.
+        racy_window (float): Directories modified less than this many seconds before they
+            are indexed are revalidated on the next lookup, since a second change within
+            the mtime resolution of the filesystem would go unnoticed.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_age: float = 1.0,
+        racy_window: float = 2.0,
+    ):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.racy_window = racy_window
+        # path -> (directory mtime or None if it must be revalidated, data)
+        self._nodes: Dict[str, Tuple[Optional[int], Any]] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        if db_path:
+            conn = self._connect()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, mtime INTEGER, data TEXT)"
+            )
+            for row in conn.execute("SELECT path, mtime, data FROM nodes"):
+                self._nodes[row[0]] = (row[1], json.loads(row[2]))
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _save(self, path: str, node: Optional[Tuple[Optional[int], Any]]) -> None:
+        if not self.db_path:
+            return
+        if node is None:
+            self._connect().execute(
+                "DELETE FROM nodes WHERE path = ? OR substr(path, 1, ?) = ?",
+                (path, len(path) + 1, path + os.sep),
+            )
+        else:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO nodes (path, mtime, data) VALUES (?, ?, ?)",
+                (path, node[0], json.dumps(node[1])),
+            )
+
+    def _node(self, path: str, build: Callable[[str, Any], Any]) -> Optional[Any]:
+        """Data of the folder at ``path``, rebuilt by ``build(path, old_data)`` if the
+        folder changed since it was indexed, or None if it doesn't exist."""
+        current_time = time.time()
+        with self._lock:
+            cached = self._nodes.get(path)
+            if (
+                cached is not None
+                and current_time - self._checked_at.get(path, 0) < self.max_age
+            ):
+                return cached[1]
+            mtime = _file_mtime(path)
+            self._checked_at[path] = current_time
+            if mtime is None:
+                if cached is not None:
+                    self._nodes = {
+                        key: value
+                        for key, value in self._nodes.items()
+                        if key != path and not key.startswith(path + os.sep)
+                    }
+                    self._save(path, None)
+                return None
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            data = build(path, cached[1] if cached is not None else None)
+            if current_time - mtime / 1e9 < self.racy_window:
+                mtime = None
+            node = (mtime, data)
+            if node != cached:
+                self._nodes[path] = node
+                self._save(path, node)
+            return data
+
+    def _build_base(self, path: str, old_data: Any) -> List[str]:
+        return sorted(list_subdirs(path, "eval_"))
+
+    def _build_eval(self, path: str, old_data: Any) -> Dict[str, Any]:
+        return {
+            "examples": read_examples_file(path),
+            "example_ids": sorted(
+                name[len("example_") :] for name in list_subdirs(path, "example_")
+            ),
+        }
+
+    def _build_example(self, path: str, old_data: Any) -> List[str]:
+        return sorted(list_subdirs(path, "run_"), key=run_sort_key)
+
+    def _build_run(self, path: str, old_data: Any) -> Dict[str, Any]:
+        # New screenshots change the run directory while the run is going on: only
+        # read metadata.json and task.txt again when they changed
+        old_data = old_data or {}
+        data = {
+            "metadata_mtime": _file_mtime(
+                find_trace_file(os.path.join(path, "metadata.json"))
+                or os.path.join(path, "metadata.json")
+            ),
+            "status_mtime": _file_mtime(os.path.join(path, STATUS_FILENAME)),
+            "task_mtime": _file_mtime(os.path.join(path, "task.txt")),
+        }
+        metadata_changed = data["metadata_mtime"] != old_data.get("metadata_mtime")
+        task_changed = data["task_mtime"] != old_data.get("task_mtime") or (
+            data["task_mtime"] is None and metadata_changed
+        )
+        if (
+            metadata_changed
+            or data["status_mtime"] != old_data.get("status_mtime")
+            or "status" not in old_data
+        ):
+            data["status"] = read_run_status(path) or "unknown"
+        else:
+            data["status"] = old_data["status"]
+        if task_changed or "task" not in old_data:
+            data["task"] = read_run_task(path)
+        else:
+            data["task"] = old_data["task"]
+        return data
+
+    def evals(self, base_dir: str) -> Optional[List[str]]:
+        """Names of the eval folders in ``base_dir``, or None if it doesn't exist."""
+        return self._node(os.path.abspath(base_dir), self._build_base)
+
+    def runs(
+        self, base_dir: str, eval_id: str, example_id: str
+    ) -> Optional[List[Dict]]:
+        """``[{"id", "status"}]`` of the runs of an example, or None if it doesn't exist."""
+        example_dir = os.path.join(
+            os.path.abspath(base_dir), eval_id, f"example_{example_id}"
+        )
+        run_ids = self._node(example_dir, self._build_example)
+        if run_ids is None:
+            return None
+        runs = []
+        for run_id in run_ids:
+            run = self._node(os.path.join(example_dir, run_id), self._build_run)
+            if run is not None:
+                runs.append({"id": run_id, "status": run["status"]})
+        return runs
+
+    def run(
+        self, base_dir: str, eval_id: str, example_id: str, run_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """Indexed data of a run, with its ``status`` and ``task``, or None if it doesn't exist."""
+        run_dir = os.path.join(
+            os.path.abspath(base_dir), eval_id, f"example_{example_id}", run_id
+        )
+        return self._node(run_dir, self._build_run)
+
+    def examples(self, base_dir: str, eval_id: str) -> Optional[Dict[str, str]]:
+        """``{example_id: task}`` of an eval, or None if it doesn't exist.
+
+        Evals saved without an examples file get the task of each example's first run.
+        """
+        eval_dir = os.path.join(os.path.abspath(base_dir), eval_id)
+        data = self._node(eval_dir, self._build_eval)
+        if data is None:
+            return None
+        if data["examples"]:
+            return data["examples"]
+        examples = {}
+        for example_id in data["example_ids"]:
+            example_dir = os.path.join(eval_dir, f"example_{example_id}")
+            run_ids = self._node(example_dir, self._build_example)
+            if not run_ids:
+                continue
+            run = self._node(os.path.join(example_dir, run_ids[0]), self._build_run)
+            task = run.get("task") if run else None
+            examples[example_id] = task if task else f"Task for {example_id}"
+        return examples
@@ -0,0 +1,111 @@
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from smolagents.utils import AgentGenerationError
+
+from run_budget import BUDGET_EXCEEDED_STATUS
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linearly interpolated percentile, q in [0, 1]"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = q * (len(ordered) - 1)
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def describe(values: List[float]) -> Optional[Dict[str, float]]:
+    """Count, mean and tail percentiles of a list of values, or None if it's empty"""
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p95": percentile(values, 0.95),
+        "max": max(values),
+    }
+
+
+def wilson_interval(
+    successes: int, runs: int, z: float = 1.96
+) -> Optional[Tuple[float, float]]:
+    """Wilson score confidence interval of a success rate (95% by default).
+
+    Unlike the normal approximation, it stays within [0, 1] and is meaningful for the
+    handful of runs per example that evaluations can afford, including 0/n and n/n.
+    """
+    if runs == 0:
+        return None
+    rate = successes / runs
+    denominator = 1 + z**2 / runs
+    center = (rate + z**2 / (2 * runs)) / denominator
+    margin = (
+        z * math.sqrt(rate * (1 - rate) / runs + z**2 / (4 * runs**2)) / denominator
+    )
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def failure_category(
+    status: str, error: Optional[BaseException] = None
+) -> Optional[str]:
+    """Coarse reason why a run did not complete, to aggregate failures in summaries"""
+    if status == "completed":
+        return None
+    if status == BUDGET_EXCEEDED_STATUS:
+        return "budget_exceeded"
+    if error is None:
+        return "unknown"
+    description = f"{type(error).__name__} {error}".lower()
+    if (
+        "timeout" in description
+        or "timed out" in description
+        or "deadline" in description
+    ):
+        return "timeout"
+    if isinstance(error, AgentGenerationError):
+        return "model_error"
+    return "agent_error"
+
+
+def aggregate_runs(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate the results of runs, each with its status and optional per-run stats.
+
+    Runs saved before per-run stats existed only count towards the success rate.
+    """
+    runs = len(results)
+    successes = sum(1 for r in results if r["status"] == "completed")
+    stats = [r["stats"] for r in results if r.get("stats")]
+    failure_categories = Counter(
+        (r.get("stats") or {}).get("failure_category") or "unknown"
+        for r in results
+        if r["status"] != "completed"
+    )
+    interval = wilson_interval(successes, runs)
+
+    def collect(key):
+        return [stat.get(key) for stat in stats]
+
+    input_tokens = [value for value in collect("input_tokens") if value is not None]
+    output_tokens = [value for value in collect("output_tokens") if value is not None]
+    return {
+        "runs": runs,
+        "successes": successes,
+        "success_rate": successes / runs if runs else 0,
+        "success_rate_ci95": list(interval) if interval else None,
+        "duration": describe(collect("duration")),
+        "setup_time": describe(collect("setup_time")),
+        "steps": describe(collect("steps")),
+        "model_latency": describe(
+            [latency for stat in stats for latency in stat.get("model_latencies") or []]
+        ),
+        "input_tokens": dict(describe(input_tokens) or {}, total=sum(input_tokens)),
+        "output_tokens": dict(describe(output_tokens) or {}, total=sum(output_tokens)),
+        "failure_categories": dict(failure_categories),
+    }
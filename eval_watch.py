@@ -0,0 +1,216 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from run_status import read_run_status
+
+try:
+    from inotify_simple import INotify
+    from inotify_simple import flags as inotify_flags
+except ImportError:
+    # Optional: `pip install inotify_simple` to be woken up by the kernel on Linux
+    INotify = None
+
+SCREENSHOT_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _subdirs(path: str, prefix: str) -> List[str]:
+    try:
+        with os.scandir(path) as entries:
+            return [
+                entry.name
+                for entry in entries
+                if entry.name.startswith(prefix) and entry.is_dir()
+            ]
+    except FileNotFoundError:
+        return []
+
+
+class EvalWatcher:
+    """Follow an eval folder while eval.py writes to it, as a stream of change events.
+
+    Events are dicts with a ``type``:
+        - ``example``: a new example folder, with ``example_id``.
+        - ``run``: a new run folder, with ``example_id``, ``run_id`` and ``status``.
+        - ``status``: the status of a run changed, same keys.
+        - ``screenshot``: a new screenshot, with ``example_id``, ``run_id`` and ``name``.
+
+    The folders are compared with their state at the previous call, and only folders
+    whose mtime changed are listed again. With the optional ``inotify_simple`` package,
+    the kernel tells which folders changed and ``poll`` sleeps until something happens;
+    otherwise, the mtimes of all folders are checked every ``poll_interval`` seconds.
+
+    Parameters:
+        eval_dir (str): The eval folder to watch.
+        poll_interval (float): Seconds between two checks when polling.
+        use_inotify (bool): Set to False to always poll.
+    """
+
+    # Folders changed this recently may change again within the mtime resolution of
+    # the filesystem: they are checked again until they settle
+    RACY_WINDOW = 2.0
+    # Files modified this recently may still be being written
+    SETTLE_TIME = 0.5
+
+    def __init__(
+        self, eval_dir: str, poll_interval: float = 1.0, use_inotify: bool = True
+    ):
+        self.eval_dir = eval_dir
+        self.poll_interval = poll_interval
+        self._mtimes: Dict[str, Optional[int]] = {}
+        # example_id -> run_id -> {"status", "screenshots"}
+        self._runs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._inotify = None
+        self._watches: Dict[int, str] = {}
+        if use_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+            except OSError as e:
+                print(f"inotify unavailable, polling {eval_dir} instead: {e}")
+        # The current state is the baseline: only later changes are reported
+        self._scan(dirty=None)
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _watch(self, path: str) -> None:
+        if self._inotify is None:
+            return
+        mask = (
+            inotify_flags.CREATE
+            | inotify_flags.MOVED_TO
+            | inotify_flags.CLOSE_WRITE
+            | inotify_flags.DELETE
+        )
+        try:
+            self._watches[self._inotify.add_watch(path, mask)] = path
+        except OSError as e:
+            # Typically the max_user_watches limit: fall back to polling everything
+            print(f"Could not watch {path}, polling instead: {e}")
+            self.close()
+
+    def _changed(self, path: str, dirty: Optional[Set[str]]) -> bool:
+        if dirty is not None and path not in dirty:
+            return False
+        mtime = _mtime(path)
+        previous = self._mtimes.get(path)
+        self._mtimes[path] = mtime
+        if mtime is None:
+            return False
+        return mtime != previous or time.time() - mtime / 1e9 < self.RACY_WINDOW
+
+    def _scan(self, dirty: Optional[Set[str]]) -> List[Dict[str, Any]]:
+        """Compare the folders in ``dirty``, or all of them if None, with their state
+        at the previous scan, and return the differences as events."""
+        events: List[Dict[str, Any]] = []
+        first_scan = not self._mtimes
+        if not self._mtimes:
+            self._watch(self.eval_dir)
+        if self._changed(self.eval_dir, dirty):
+            for name in _subdirs(self.eval_dir, "example_"):
+                example_id = name[len("example_") :]
+                if example_id not in self._runs:
+                    self._runs[example_id] = {}
+                    self._watch(os.path.join(self.eval_dir, name))
+                    events.append({"type": "example", "example_id": example_id})
+                    if dirty is not None:
+                        dirty.add(os.path.join(self.eval_dir, name))
+
+        for example_id, runs in self._runs.items():
+            example_dir = os.path.join(self.eval_dir, f"example_{example_id}")
+            if self._changed(example_dir, dirty):
+                for run_id in _subdirs(example_dir, "run_"):
+                    if run_id not in runs:
+                        runs[run_id] = {"status": None, "screenshots": set()}
+                        self._watch(os.path.join(example_dir, run_id))
+                        events.append(
+                            {
+                                "type": "run",
+                                "example_id": example_id,
+                                "run_id": run_id,
+                                "status": None,
+                            }
+                        )
+                        if dirty is not None:
+                            dirty.add(os.path.join(example_dir, run_id))
+
+            for run_id, run in runs.items():
+                run_dir = os.path.join(example_dir, run_id)
+                if not self._changed(run_dir, dirty):
+                    continue
+                try:
+                    names = os.listdir(run_dir)
+                except FileNotFoundError:
+                    continue
+                for name in sorted(names):
+                    if (
+                        not name.lower().endswith(SCREENSHOT_EXTENSIONS)
+                        or name in run["screenshots"]
+                    ):
+                        continue
+                    # Wait for screenshots still being written: their folder is
+                    # recent, so it is scanned again until they settle
+                    file_mtime = _mtime(os.path.join(run_dir, name))
+                    if (
+                        file_mtime is None
+                        or time.time() - file_mtime / 1e9 < self.SETTLE_TIME
+                    ):
+                        continue
+                    run["screenshots"].add(name)
+                    events.append(
+                        {
+                            "type": "screenshot",
+                            "example_id": example_id,
+                            "run_id": run_id,
+                            "name": name,
+                        }
+                    )
+                status = read_run_status(run_dir)
+                if status != run["status"]:
+                    run["status"] = status
+                    events.append(
+                        {
+                            "type": "status",
+                            "example_id": example_id,
+                            "run_id": run_id,
+                            "status": status,
+                        }
+                    )
+        return [] if first_scan else events
+
+    def poll(self, timeout: float) -> List[Dict[str, Any]]:
+        """Wait up to ``timeout`` seconds for changes and return them as events."""
+        deadline = time.time() + timeout
+        while True:
+            if self._inotify is not None:
+                # Racy folders are rechecked even without a new event
+                dirty = {
+                    path
+                    for path, mtime in self._mtimes.items()
+                    if mtime is not None
+                    and time.time() - mtime / 1e9 < self.RACY_WINDOW
+                }
+                wait = max(0.0, deadline - time.time())
+                if dirty:
+                    wait = min(wait, self.poll_interval)
+                dirty |= {
+                    self._watches[event.wd]
+                    for event in self._inotify.read(timeout=int(wait * 1000))
+                    if event.wd in self._watches
+                }
+                events = self._scan(dirty)
+            else:
+                events = self._scan(dirty=None)
+            if events or time.time() >= deadline:
+                return events
+            if self._inotify is None:
+                time.sleep(min(self.poll_interval, max(0.0, deadline - time.time())))
@@ -216,13 +216,17 @@ def stream_to_gradio(
         reset=reset_agent_memory,
         additional_args=additional_args,
     ):
-        # Track tokens if model provides them
-        if getattr(agent.model, "last_input_token_count", None) is not None:
-            total_input_tokens += agent.model.last_input_token_count
-            total_output_tokens += agent.model.last_output_token_count
-            if isinstance(step_log, (ActionStep, PlanningStep)):
+        # Track tokens once per step: stream deltas don't add model calls.
+        # Action steps already carry their counts (see TokenCounter.step_callback)
+        if isinstance(step_log, (ActionStep, PlanningStep)):
+            if (
+                getattr(step_log, "input_token_count", None) is None
+                and getattr(agent.model, "last_input_token_count", None) is not None
+            ):
                 step_log.input_token_count = agent.model.last_input_token_count
                 step_log.output_token_count = agent.model.last_output_token_count
+            total_input_tokens += getattr(step_log, "input_token_count", None) or 0
+            total_output_tokens += getattr(step_log, "output_token_count", None) or 0
 
         if isinstance(step_log, MemoryStep):
             intermediate_text = ""
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+# Widths are rounded up to a multiple of this, so that clients asking for slightly
+# different sizes share the same cached variants
+WIDTH_STEP = 40
+MAX_WIDTH = 4096
+
+
+def source_etag(path: str, stat: Optional[os.stat_result] = None) -> str:
+    """Strong validator of a source file: changes whenever it is rewritten"""
+    stat = stat or os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ImageVariantCache:
+    """On-disk cache of resized or transcoded variants of screenshots.
+
+    A variant is generated with Pillow on its first request and stored under a name
+    derived from the source path, mtime and size and the requested width, format and
+    quality, so a rewritten screenshot never serves a stale variant. Every hit refreshes
+    the variant's mtime; once the cache grows over ``max_bytes``, the least recently used
+    variants are deleted.
+
+    Parameters:
+        cache_dir (str): Folder of the cached variants, created if missing.
+        max_bytes (int): Size above which the least recently used variants are evicted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Files of other processes sharing the folder are only seen at the next scan
+        self._sizes: Dict[str, int] = {}
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    self._sizes[entry.path] = entry.stat().st_size
+        self._total_bytes = sum(self._sizes.values())
+
+    @staticmethod
+    def normalize_width(width: Optional[int]) -> Optional[int]:
+        if not width:
+            return None
+        width = min(max(int(width), 1), MAX_WIDTH)
+        return -(-width // WIDTH_STEP) * WIDTH_STEP
+
+    def get(
+        self,
+        path: str,
+        width: Optional[int] = None,
+        image_format: str = "webp",
+        quality: int = 80,
+    ) -> Tuple[str, str, str]:
+        """Path, ETag and mimetype of a variant of the image at ``path``, generating it
+        if it isn't cached yet. Images narrower than ``width`` are not enlarged."""
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(
+                f"Unsupported format '{image_format}', expected one of {list(IMAGE_FORMATS)}"
+            )
+        pil_format, mimetype = IMAGE_FORMATS[image_format]
+        width = self.normalize_width(width)
+        quality = min(max(int(quality), 1), 100)
+        etag = hashlib.sha1(
+            f"{source_etag(path)}:{width}:{image_format}:{quality}".encode("utf-8")
+        ).hexdigest()
+        variant_path = os.path.join(self.cache_dir, f"{etag}.{image_format}")
+        try:
+            # Mark as recently used
+            os.utime(variant_path)
+            return variant_path, etag, mimetype
+        except FileNotFoundError:
+            pass
+
+        with Image.open(path) as image:
+            if width and image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.Resampling.LANCZOS)
+            if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            save_kwargs = {"optimize": True} if pil_format == "PNG" else {}
+            if pil_format != "PNG":
+                save_kwargs["quality"] = quality
+            # Unique per thread, several requests may generate the same variant at once
+            tmp_path = f"{variant_path}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, pil_format, **save_kwargs)
+        os.replace(tmp_path, variant_path)
+        self.add(variant_path)
+        return variant_path, etag, mimetype
+
+    def add(self, variant_path: str) -> None:
+        """Account for a file written to the cache folder, evicting old ones if needed."""
+        size = os.path.getsize(variant_path)
+        with self._lock:
+            self._total_bytes += size - self._sizes.get(variant_path, 0)
+            self._sizes[variant_path] = size
+            if self._total_bytes <= self.max_bytes:
+                return
+            by_last_use = []
+            for cached_path in self._sizes:
+                try:
+                    by_last_use.append((os.stat(cached_path).st_mtime, cached_path))
+                except FileNotFoundError:
+                    by_last_use.append((0, cached_path))
+            by_last_use.sort()
+            # Evict down to 90% of the cap, not to evict again on the next miss
+            for _, cached_path in by_last_use:
+                if self._total_bytes <= self.max_bytes * 0.9:
+                    break
+                if cached_path == variant_path:
+                    continue
+                try:
+                    os.remove(cached_path)
+                except FileNotFoundError:
+                    pass
+                self._total_bytes -= self._sizes.pop(cached_path)
@@ -1,8 +1,36 @@
-from smolagents.models import Model, ChatMessage, Tool, MessageRole
+from smolagents.models import (
+    Model,
+    ChatMessage,
+    ChatMessageStreamDelta,
+    Tool,
+    MessageRole,
+)
 from time import sleep
-from typing import List, Dict, Optional
+from typing import Generator, List, Dict, Optional, Tuple, Union
 from huggingface_hub import hf_hub_download
+from io import BytesIO
+from PIL import Image
+import glob
+import hashlib
 import json
+import os
+import random
+import re
+import threading
+import time
+
+from token_counting import DEFAULT_TOKENIZER_ID, TokenCounter
+from trace_writer import TRACE_FILENAME, read_trace
+
+MODEL_CALLS_FILENAME = "model_calls.jsonl"
+
+
+def _message_text(content) -> str:
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content if part.get("type") == "text"
+        )
+    return content or ""
 
 
 class FakeModelReplayLog(Model):
@@ -12,41 +40,127 @@ class FakeModelReplayLog(Model):
     actual API calls but instead returns responses from a pre-recorded log file.
 
     Parameters:
-        log_url (str, optional):
-            URL to the log file. Defaults to the smolagents example log.
+        log_folder (str):
+            Local run folder (containing `model_calls.jsonl`, `trace.jsonl` or
+            `metadata.json`), local log file, or folder of the
+            `smolagents/computer-agent-logs` dataset to download.
+        latency (str or float, optional):
+            Delay before each response. A number is a fixed delay in seconds, `"recorded"`
+            replays the latencies stored in the log (0 when absent), and
+            `"lognormal:<median>,<sigma>"` samples from a log-normal distribution.
+            Defaults to 1.0.
+        seed (int, optional): Seed of the latency sampling, so that replays are deterministic.
+        tokens_per_second (float, optional):
+            Pace of `generate_stream`. By default, streams recorded by `RecordingModel` are
+            replayed with their original chunks and timings, and other outputs are split
+            into word chunks sent without delay. When set, outputs are split into word
+            chunks sent at this rate, after the latency above.
+        tokenizer_id (str, optional):
+            Tokenizer counting the tokens of the replayed calls, loaded from the Hub. None
+            estimates the counts from the text length, so that replays need no network.
         **kwargs: Additional keyword arguments passed to the Model base class.
     """
 
-    def __init__(self, log_folder: str, **kwargs):
+    def __init__(
+        self,
+        log_folder: str,
+        latency: Union[str, float] = 1.0,
+        seed: int = 0,
+        tokens_per_second: Optional[float] = None,
+        tokenizer_id: Optional[str] = DEFAULT_TOKENIZER_ID,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.dataset_name = "smolagents/computer-agent-logs"
         self.log_folder = log_folder
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
         self.call_counter = 0
-        self.model_outputs = self._load_model_outputs()
+        self.token_counter = TokenCounter(tokenizer_id)
+        self.model_outputs, self.recorded_latencies = self._load_model_outputs()
 
-    def _load_model_outputs(self) -> List[str]:
-        """Load model outputs from the log file using HuggingFace datasets library."""
+    def _resolve_log_file(self) -> str:
+        if os.path.isdir(self.log_folder):
+            for filename in (MODEL_CALLS_FILENAME, TRACE_FILENAME, "metadata.json"):
+                file_path = os.path.join(self.log_folder, filename)
+                if os.path.exists(file_path):
+                    return file_path
+            raise FileNotFoundError(f"No replayable log found in {self.log_folder}")
+        if os.path.isfile(self.log_folder):
+            return self.log_folder
         # Download the file from Hugging Face Hub
-        file_path = hf_hub_download(
+        return hf_hub_download(
             repo_id=self.dataset_name,
             filename=self.log_folder + "/metadata.json",
             repo_type="dataset",
         )
 
-        # Load and parse the JSON data
-        with open(file_path, "r") as f:
-            log_data = json.load(f)
+    def _load_model_outputs(self) -> Tuple[List[str], List[Optional[float]]]:
+        """Load model outputs, and their latencies when recorded, from the log file."""
+        file_path = self._resolve_log_file()
+        self.recorded_chunks: List[Optional[List]] = []
+
+        if os.path.basename(file_path) == MODEL_CALLS_FILENAME:
+            # Failed calls raised in the agent instead of returning an output
+            calls = [
+                call for call in read_model_calls(file_path) if "error" not in call
+            ]
+            self.recorded_chunks = [call.get("chunks") for call in calls]
+            print(f"Loaded {len(calls)} recorded model calls from log file")
+            return [call["content"] for call in calls], [
+                call.get("latency") for call in calls
+            ]
 
-        # Extract only the model_output from each step in tool_calls
-        model_outputs = []
+        if file_path.endswith(".jsonl"):
+            steps = read_trace(file_path)["summary"]
+        else:
+            # Load and parse the JSON data
+            with open(file_path, "r") as f:
+                steps = json.load(f)["summary"] or []
 
-        for step in log_data["summary"][1:]:
-            model_outputs.append(step["model_output_message"]["content"])
+        # Extract only the model outputs: steps carry a model_output_message, while
+        # summaries written from agent.write_memory_to_messages() are chat messages
+        model_outputs, latencies = [], []
+        for step in steps:
+            if step.get("model_output_message"):
+                content = step["model_output_message"]["content"]
+            elif step.get("role") == "assistant":
+                content = _message_text(step.get("content"))
+            else:
+                continue
+            model_outputs.append(content)
+            latencies.append(step.get("latency"))
+            self.recorded_chunks.append(None)
 
         print(f"Loaded {len(model_outputs)} model outputs from log file")
-        return model_outputs
+        return model_outputs, latencies
+
+    def _next_latency(self, call_index: int) -> float:
+        if self.latency == "recorded":
+            if call_index < len(self.recorded_latencies):
+                return self.recorded_latencies[call_index] or 0.0
+            return 0.0
+        if isinstance(self.latency, str) and self.latency.startswith("lognormal:"):
+            median, sigma = (float(x) for x in self.latency.split(":", 1)[1].split(","))
+            return self._random.lognormvariate(0.0, sigma) * median
+        return float(self.latency)
+
+    def _pop_content(self) -> Tuple[str, Optional[List]]:
+        # Get the next model output, with its recorded stream chunks if any
+        if self.call_counter < len(self.model_outputs):
+            content = self.model_outputs[self.call_counter]
+            chunks = self.recorded_chunks[self.call_counter]
+            self.call_counter += 1
+        else:
+            content, chunks = "No more pre-recorded responses available.", None
+        return content, chunks
+
+    def _next_content(self) -> str:
+        sleep(self._next_latency(self.call_counter))
+        return self._pop_content()[0]
 
-    def __call__(
+    def generate(
         self,
         messages: List[Dict[str, str]],
         stop_sequences: Optional[List[str]] = None,
@@ -66,18 +180,10 @@ class FakeModelReplayLog(Model):
         Returns:
             ChatMessage: The next pre-recorded response.
         """
-        sleep(1.0)
+        content = self._next_content()
 
-        # Get the next model output
-        if self.call_counter < len(self.model_outputs):
-            content = self.model_outputs[self.call_counter]
-            self.call_counter += 1
-        else:
-            content = "No more pre-recorded responses available."
-
-        # Token counts are simulated
-        self.last_input_token_count = len(str(messages)) // 4  # Rough approximation
-        self.last_output_token_count = len(content) // 4  # Rough approximation
+        self.last_input_token_count = self.token_counter.count_messages(messages)
+        self.last_output_token_count = self.token_counter.count_text(content)
 
         # Create and return a ChatMessage
         return ChatMessage(
@@ -86,3 +192,262 @@ class FakeModelReplayLog(Model):
             tool_calls=None,
             raw={"source": "pre-recorded log", "call_number": self.call_counter},
         )
+
+    def __call__(self, *args, **kwargs) -> ChatMessage:
+        return self.generate(*args, **kwargs)
+
+    def generate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta, None, None]:
+        """Stream the next pre-recorded response chunk by chunk.
+
+        See `tokens_per_second` for how chunks and their pace are chosen. Delays are
+        scheduled from the start of the call, so slow consumers don't add up drift.
+
+        Yields:
+            ChatMessageStreamDelta: The chunks of the next pre-recorded response.
+        """
+        start_time = time.time()
+        if self.tokens_per_second is None and self._has_recorded_chunks():
+            content, chunks = self._pop_content()
+        else:
+            first_chunk_delay = self._next_latency(self.call_counter)
+            content, _ = self._pop_content()
+            interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+            chunks = [
+                [first_chunk_delay + index * interval, text]
+                for index, text in enumerate(re.findall(r"\s*\S+\s*|\s+", content))
+            ]
+        if not chunks:
+            chunks = [[0.0, content]]
+
+        for offset, text in chunks:
+            delay = start_time + offset - time.time()
+            if delay > 0:
+                sleep(delay)
+            yield ChatMessageStreamDelta(content=text)
+
+        self.last_input_token_count = self.token_counter.count_messages(messages)
+        self.last_output_token_count = self.token_counter.count_text(content)
+
+    def _has_recorded_chunks(self) -> bool:
+        return self.call_counter < len(self.recorded_chunks) and bool(
+            self.recorded_chunks[self.call_counter]
+        )
+
+
+def _fingerprint_part(part):
+    if isinstance(part, Image.Image):
+        # Hashing the pixels is cheap next to the model call, and tells screenshots apart
+        digest = hashlib.blake2b(part.tobytes(), digest_size=8).hexdigest()
+        return f"image:{part.size[0]}x{part.size[1]}:{digest}"
+    if isinstance(part, dict):
+        return {key: _fingerprint_part(value) for key, value in part.items()}
+    if isinstance(part, (list, tuple)):
+        return [_fingerprint_part(value) for value in part]
+    return getattr(part, "value", part)
+
+
+def fingerprint_messages(messages, stop_sequences=None) -> str:
+    """Stable hash of a model request, images included, to match replays with recordings."""
+    payload = json.dumps(
+        [_fingerprint_part(messages), stop_sequences], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def read_model_calls(path: str) -> List[Dict]:
+    """Read a file written by RecordingModel, ignoring a truncated final line."""
+    calls = []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            calls.append(json.loads(line))
+        except json.JSONDecodeError:
+            if index == len(lines) - 1:
+                break
+            raise
+    return calls
+
+
+class RecordingModel(Model):
+    """Wraps a model and records every call into a JSONL file replayable by FakeModelReplayLog.
+
+    Each line holds the call number, a request fingerprint, the full response, token
+    counts and latency. Streamed calls also record the time to first token and every chunk
+    as a compact `[seconds since request, text]` pair, so they can be replayed at their
+    original pace.
+
+    Parameters:
+        model (Model): The wrapped model.
+        log_path (str): File to append the records to, usually `<run dir>/model_calls.jsonl`.
+    """
+
+    def __init__(self, model: Model, log_path: str, **kwargs):
+        super().__init__(model_id=getattr(model, "model_id", None), **kwargs)
+        self.model = model
+        self.log_path = log_path
+        self.call_counter = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self._file = open(log_path, "a", encoding="utf-8")
+
+    def __getattr__(self, name):
+        # Only called for attributes missing on the wrapper: defer to the wrapped model
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _write(self, record: Dict) -> None:
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+                self._file.flush()
+
+    def _new_record(self, messages, stop_sequences, start_time: float) -> Dict:
+        with self._lock:
+            self.call_counter += 1
+            call = self.call_counter
+        return {
+            "call": call,
+            "fingerprint": fingerprint_messages(messages, stop_sequences),
+            "timestamp": start_time,
+        }
+
+    def _finish_record(self, record: Dict, content: str, start_time: float) -> None:
+        self.last_input_token_count = self.model.last_input_token_count
+        self.last_output_token_count = self.model.last_output_token_count
+        record["content"] = content
+        record["input_tokens"] = self.last_input_token_count
+        record["output_tokens"] = self.last_output_token_count
+        record["latency"] = time.time() - start_time
+        self._write(record)
+
+    def generate(
+        self,
+        messages: List[Dict],
+        stop_sequences: Optional[List[str]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        start_time = time.time()
+        record = self._new_record(messages, stop_sequences, start_time)
+        try:
+            message = self.model.generate(
+                messages, stop_sequences=stop_sequences, **kwargs
+            )
+        except Exception as e:
+            record["error"] = str(e)
+            record["latency"] = time.time() - start_time
+            self._write(record)
+            raise
+        self._finish_record(record, message.content, start_time)
+        return message
+
+    def __call__(self, *args, **kwargs) -> ChatMessage:
+        return self.generate(*args, **kwargs)
+
+    def generate_stream(
+        self,
+        messages: List[Dict],
+        stop_sequences: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta, None, None]:
+        start_time = time.time()
+        record = self._new_record(messages, stop_sequences, start_time)
+        chunks = []
+        try:
+            for delta in self.model.generate_stream(
+                messages, stop_sequences=stop_sequences, **kwargs
+            ):
+                if delta.content:
+                    chunks.append([round(time.time() - start_time, 4), delta.content])
+                yield delta
+        except Exception as e:
+            record["error"] = str(e)
+            record["chunks"] = chunks
+            record["latency"] = time.time() - start_time
+            self._write(record)
+            raise
+        record["ttft"] = chunks[0][0] if chunks else None
+        record["chunks"] = chunks
+        self._finish_record(record, "".join(text for _, text in chunks), start_time)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class _FakeCommands:
+    def run(self, cmd: str, **kwargs):
+        return None
+
+
+class _FakeStream:
+    def start(self, **kwargs) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class FakeDesktop:
+    """A local stand-in for the e2b desktop sandbox, to drive agents without network.
+
+    Actions are recorded in `actions` and do nothing. Screenshots replay the `step_*.png`
+    files of a recorded run in order (then repeat the last one), or are blank images.
+
+    Parameters:
+        screenshot_dir (str, optional): Run folder whose screenshots should be replayed.
+        resolution (tuple, optional): Screen size reported to the agent.
+    """
+
+    sandbox_id = "fake-desktop"
+
+    def __init__(
+        self,
+        screenshot_dir: Optional[str] = None,
+        resolution: Tuple[int, int] = (1024, 768),
+    ):
+        self.resolution = resolution
+        self.screenshot_paths = (
+            sorted(glob.glob(os.path.join(screenshot_dir, "step_*.png")))
+            if screenshot_dir
+            else []
+        )
+        self.screenshot_counter = 0
+        self.actions: List[Tuple] = []
+        self.commands = _FakeCommands()
+        self.stream = _FakeStream()
+        self._blank_screenshot = None
+
+    def get_screen_size(self) -> Tuple[int, int]:
+        return self.resolution
+
+    def screenshot(self, format: str = "bytes") -> bytes:
+        if self.screenshot_paths:
+            index = min(self.screenshot_counter, len(self.screenshot_paths) - 1)
+            self.screenshot_counter += 1
+            with open(self.screenshot_paths[index], "rb") as f:
+                return f.read()
+        if self._blank_screenshot is None:
+            buffer = BytesIO()
+            Image.new("RGB", self.resolution, "white").save(buffer, format="PNG")
+            self._blank_screenshot = buffer.getvalue()
+        return self._blank_screenshot
+
+    def __getattr__(self, name):
+        # Any other desktop action (left_click, write, press, scroll...) is a recorded no-op
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def action(*args, **kwargs):
+            self.actions.append((name, args, kwargs))
+
+        return action
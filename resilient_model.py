@@ -0,0 +1,414 @@
+import concurrent.futures
+import copy
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+from smolagents.models import ChatMessage, ChatMessageStreamDelta, Model
+
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+_STREAM_END = object()
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether a failed model call is worth retrying (timeouts, connection errors, 429/5xx)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class ResilientModel(Model):
+    """Wraps a model to add per-call deadlines, retries and optional hedged requests.
+
+    Transient failures (see ``is_transient_error``) are retried with full-jitter exponential
+    backoff. With ``hedge=True``, a non-streaming call that is still running after the
+    observed ``hedge_quantile`` latency gets a second, identical request; whichever answers
+    first is kept. Streaming calls are hedged the same way on their time to first chunk:
+    the stream whose first chunk arrives first is read, the other one is dropped. A stream
+    is retried as long as nothing has been yielded yet.
+
+    Keep one instance per process, so hedging learns from all the calls, and give each
+    agent run its own view of it with ``for_run``.
+
+    Parameters:
+        model (Model): The wrapped model, e.g. an ``InferenceClientModel``.
+        timeout (float): Deadline in seconds for a call (for streams: between two chunks).
+        max_retries (int): Number of retries after the first attempt.
+        backoff_base (float): Base delay in seconds of the exponential backoff.
+        backoff_max (float): Upper bound of a single backoff delay.
+        hedge (bool): Whether to send hedged requests.
+        hedge_quantile (float): Latency quantile after which the hedged request is sent.
+        hedge_min_samples (int): Number of observed latencies needed before hedging starts.
+        max_workers (int): Requests in flight at once, streams hold a thread until done.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        timeout: float = 90.0,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 20.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 10,
+        max_workers: int = 32,
+        **kwargs,
+    ):
+        super().__init__(model_id=getattr(model, "model_id", None), **kwargs)
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        # Abandoned calls keep running in the background until the endpoint answers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="model-call"
+        )
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "calls": 0,
+            "requests": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "hedged_requests": 0,
+            "hedge_wins": 0,
+            "latencies": [],
+            "primary_latencies": [],
+            "first_chunk_latencies": [],
+            "primary_first_chunk_latencies": [],
+        }
+
+    def __getattr__(self, name):
+        # Only called for attributes missing on the wrapper: defer to the wrapped model
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _record(self, key: str, value: Any = 1) -> None:
+        with self._stats_lock:
+            if isinstance(self.stats[key], list):
+                self.stats[key].append(value)
+                del self.stats[key][:-1000]
+            else:
+                self.stats[key] += value
+
+    def _backoff(self, attempt: int) -> None:
+        time.sleep(
+            random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        )
+
+    def _hedge_delay(self, key: str = "primary_latencies") -> Optional[float]:
+        with self._stats_lock:
+            latencies = list(self.stats[key])
+        if not self.hedge or len(latencies) < self.hedge_min_samples:
+            return None
+        return _percentile(latencies, self.hedge_quantile)
+
+    def _request_model(self) -> Model:
+        # The wrapped model stores the token counts of its last call on itself: each
+        # request gets its own copy, sharing the client, so concurrent ones can't mix them
+        return copy.copy(self.model)
+
+    def _submit(self, fn: Callable[[Model], ChatMessage], primary: bool):
+        self._record("requests")
+        start_time = time.time()
+
+        def timed_call():
+            model = self._request_model()
+            message = fn(model)
+            return message, (
+                model.last_input_token_count,
+                model.last_output_token_count,
+            )
+
+        def record_primary_latency(future):
+            if future.exception() is None:
+                self._record("primary_latencies", time.time() - start_time)
+
+        future = self._executor.submit(timed_call)
+        if primary:
+            # Primary latencies are what callers would see without hedging
+            future.add_done_callback(record_primary_latency)
+        return future
+
+    def _call_once(self, fn: Callable[[Model], ChatMessage]) -> ChatMessage:
+        start_time = time.time()
+        futures = [self._submit(fn, primary=True)]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < self.timeout:
+            done, _ = concurrent.futures.wait(futures, timeout=hedge_delay)
+            if not done:
+                self._record("hedged_requests")
+                futures.append(self._submit(fn, primary=False))
+
+        remaining = self.timeout - (time.time() - start_time)
+        pending = set(futures)
+        error = None
+        while pending and remaining > 0:
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=remaining,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                message, token_counts = future.result()
+                if future is not futures[0]:
+                    self._record("hedge_wins")
+                self._record("latencies", time.time() - start_time)
+                self.last_input_token_count, self.last_output_token_count = token_counts
+                return message
+            remaining = self.timeout - (time.time() - start_time)
+
+        if error is not None:
+            raise error
+        self._record("timeouts")
+        raise TimeoutError(f"Model call exceeded its {self.timeout}s deadline")
+
+    def generate(
+        self,
+        messages: List[Dict[str, Any]],
+        stop_sequences: Optional[List[str]] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        self._record("calls")
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._call_once(
+                    lambda model: model.generate(
+                        messages, stop_sequences=stop_sequences, **kwargs
+                    )
+                )
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    raise
+                print(f"Transient model error ({e}), retrying (attempt {attempt + 1})")
+                self._record("retries")
+                self._backoff(attempt)
+
+    def __call__(self, *args, **kwargs) -> ChatMessage:
+        return self.generate(*args, **kwargs)
+
+    def _start_stream(
+        self,
+        events: queue.Queue,
+        index: int,
+        cancelled: threading.Event,
+        messages,
+        stop_sequences,
+        **kwargs,
+    ) -> None:
+        """Stream a request in the background into ``events``, as ``(index, item)``.
+
+        Items are chunks, then ``_STREAM_END`` with the token counts, or the exception
+        that ended the stream. A cancelled stream stops at its next chunk, after the
+        first one for the primary request, whose latency is recorded either way.
+        """
+        self._record("requests")
+        start_time = time.time()
+
+        def produce():
+            model = self._request_model()
+            stream = None
+            first_chunk = True
+            try:
+                stream = model.generate_stream(
+                    messages, stop_sequences=stop_sequences, **kwargs
+                )
+                for chunk in stream:
+                    if first_chunk and index == 0:
+                        # What callers would see without hedging
+                        self._record(
+                            "primary_first_chunk_latencies", time.time() - start_time
+                        )
+                    first_chunk = False
+                    if cancelled.is_set():
+                        return
+                    events.put((index, chunk))
+                token_counts = (
+                    model.last_input_token_count,
+                    model.last_output_token_count,
+                )
+                events.put((index, (_STREAM_END, token_counts)))
+            except BaseException as e:
+                events.put((index, e))
+            finally:
+                if stream is not None:
+                    stream.close()
+
+        self._executor.submit(produce)
+
+    def _stream_once(
+        self, messages, stop_sequences, **kwargs
+    ) -> Generator[ChatMessageStreamDelta, None, None]:
+        start_time = time.time()
+        events: queue.Queue = queue.Queue()
+        cancelled = [threading.Event()]
+        self._start_stream(events, 0, cancelled[0], messages, stop_sequences, **kwargs)
+        hedge_delay = self._hedge_delay("primary_first_chunk_latencies")
+        winner = None
+        failed = 0
+        try:
+            # Wait for the first chunk of either request, hedging after hedge_delay
+            while winner is None:
+                elapsed = time.time() - start_time
+                can_hedge = (
+                    hedge_delay is not None
+                    and len(cancelled) == 1
+                    and hedge_delay < self.timeout
+                )
+                wait = (hedge_delay if can_hedge else self.timeout) - elapsed
+                try:
+                    index, item = events.get(timeout=max(0.0, wait))
+                except queue.Empty:
+                    if can_hedge:
+                        self._record("hedged_requests")
+                        cancelled.append(threading.Event())
+                        self._start_stream(
+                            events, 1, cancelled[1], messages, stop_sequences, **kwargs
+                        )
+                        continue
+                    self._record("timeouts")
+                    raise TimeoutError(
+                        f"Model stream produced nothing for {self.timeout}s"
+                    ) from None
+                if isinstance(item, BaseException):
+                    failed += 1
+                    if failed == len(cancelled):
+                        raise item
+                    continue
+                winner = index
+                for index, event in enumerate(cancelled):
+                    if index != winner:
+                        event.set()
+                if winner != 0:
+                    self._record("hedge_wins")
+                self._record("first_chunk_latencies", time.time() - start_time)
+
+            # Then read the winning stream, with the deadline between two chunks
+            while True:
+                if isinstance(item, tuple) and item[0] is _STREAM_END:
+                    self.last_input_token_count, self.last_output_token_count = item[1]
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+                while True:
+                    try:
+                        index, item = events.get(timeout=self.timeout)
+                    except queue.Empty:
+                        self._record("timeouts")
+                        raise TimeoutError(
+                            f"Model stream produced nothing for {self.timeout}s"
+                        ) from None
+                    if index == winner:
+                        break
+        finally:
+            # Also stops the stream when the caller stops reading it
+            for event in cancelled:
+                event.set()
+
+    def generate_stream(
+        self,
+        messages: List[Dict[str, Any]],
+        stop_sequences: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Generator[ChatMessageStreamDelta, None, None]:
+        self._record("calls")
+        start_time = time.time()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                for chunk in self._stream_once(messages, stop_sequences, **kwargs):
+                    started = True
+                    yield chunk
+                self._record("latencies", time.time() - start_time)
+                return
+            except Exception as e:
+                # Once chunks reached the caller, a retry would duplicate the output
+                if started or attempt == self.max_retries or not is_transient_error(e):
+                    raise
+                print(f"Transient model error ({e}), retrying (attempt {attempt + 1})")
+                self._record("retries")
+                self._backoff(attempt)
+
+    def for_run(self) -> "ResilientModel":
+        """View of this model for one agent run.
+
+        It shares the thread pool and the latency samples hedging is based on, and has
+        its own token counts, which concurrent runs would otherwise overwrite.
+        """
+        run_model = copy.copy(self)
+        run_model.last_input_token_count = None
+        run_model.last_output_token_count = None
+        return run_model
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Latency percentiles with and without hedging, and the extra request cost."""
+        with self._stats_lock:
+            stats = {k: v for k, v in self.stats.items() if not isinstance(v, list)}
+            latencies = list(self.stats["latencies"])
+            primary_latencies = list(self.stats["primary_latencies"])
+            first_chunk_latencies = list(self.stats["first_chunk_latencies"])
+            primary_first_chunk_latencies = list(
+                self.stats["primary_first_chunk_latencies"]
+            )
+        for q in (0.5, 0.95, 0.99):
+            stats[f"p{int(q * 100)}_latency"] = _percentile(latencies, q)
+            stats[f"p{int(q * 100)}_primary_latency"] = _percentile(
+                primary_latencies, q
+            )
+            stats[f"p{int(q * 100)}_first_chunk_latency"] = _percentile(
+                first_chunk_latencies, q
+            )
+            stats[f"p{int(q * 100)}_primary_first_chunk_latency"] = _percentile(
+                primary_first_chunk_latencies, q
+            )
+        stats["extra_request_ratio"] = (
+            (stats["requests"] - stats["calls"]) / stats["calls"]
+            if stats["calls"]
+            else 0.0
+        )
+        return stats
+
+    def format_stats(self) -> str:
+        stats = self.get_stats()
+
+        def fmt(value):
+            return "n/a" if value is None else f"{value:.2f}s"
+
+        return (
+            f"{stats['calls']} model calls, {stats['requests']} requests "
+            f"(+{stats['extra_request_ratio'] * 100:.1f}%: {stats['retries']} retries, "
+            f"{stats['hedged_requests']} hedged, {stats['hedge_wins']} hedge wins, "
+            f"{stats['timeouts']} timeouts). "
+            f"p95 latency {fmt(stats['p95_latency'])} vs {fmt(stats['p95_primary_latency'])} "
+            f"without hedging, p99 {fmt(stats['p99_latency'])} vs "
+            f"{fmt(stats['p99_primary_latency'])}. "
+            f"Time to first chunk p95 {fmt(stats['p95_first_chunk_latency'])} vs "
+            f"{fmt(stats['p95_primary_first_chunk_latency'])} without hedging, p99 "
+            f"{fmt(stats['p99_first_chunk_latency'])} vs "
+            f"{fmt(stats['p99_primary_first_chunk_latency'])}"
+        )
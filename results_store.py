@@ -0,0 +1,399 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from eval_stats import wilson_interval
+from run_status import read_status_file
+from trace_files import read_json_file
+
+# Saved in the folder of the evals, next to them
+RESULTS_STORE_FILENAME = "results.sqlite3"
+
+# Per-run stats compared between evals, all from the run's stats (see eval.run_stats)
+METRICS = ("duration", "setup_time", "steps", "input_tokens", "output_tokens")
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p95": 0.95}
+
+
+def git_hash_from_name(eval_id: str) -> Optional[str]:
+    """Commit an eval folder was named after: eval_<date>_<time>_<hash>[_replay]"""
+    parts = eval_id.split("_")
+    return parts[3] if len(parts) >= 4 else None
+
+
+def run_record(
+    example: str, run_dir: str, status: str, stats: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Row of a run in the store, from its status and its stats"""
+    stats = stats or {}
+    run_name = os.path.basename(run_dir.rstrip(os.sep))
+    suffix = run_name[len("run_") :]
+    return {
+        "example": example,
+        "run_index": int(suffix) if suffix.isdigit() else None,
+        "status": status,
+        "failure_category": stats.get("failure_category"),
+        **{metric: stats.get(metric) for metric in METRICS},
+    }
+
+
+def read_eval_runs(eval_dir: str) -> List[Dict[str, Any]]:
+    """Rows of the finished runs of an eval folder, for evals recorded before the store.
+
+    Read from the status sidecars, which hold the run stats, or for runs saved before
+    sidecars existed, from metadata.json.
+    """
+    records = []
+    for example_name in sorted(os.listdir(eval_dir)):
+        example_dir = os.path.join(eval_dir, example_name)
+        if not example_name.startswith("example_") or not os.path.isdir(example_dir):
+            continue
+        for run_name in os.listdir(example_dir):
+            run_dir = os.path.join(example_dir, run_name)
+            if not run_name.startswith("run_"):
+                continue
+            record = read_status_file(run_dir)
+            if record is None:
+                try:
+                    record = read_json_file(os.path.join(run_dir, "metadata.json"))
+                except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+                    # Never finished
+                    continue
+            records.append(
+                run_record(
+                    example_name[len("example_") :],
+                    run_dir,
+                    record.get("status") or "missing",
+                    record.get("stats"),
+                )
+            )
+    return records
+
+
+def interpolate(values: Dict[int, float], n: int, q: float) -> Optional[float]:
+    """Linearly interpolated percentile of n sorted values, given the ones around q,
+    as eval_stats.percentile computes it."""
+    position = q * (n - 1)
+    lower = int(position)
+    if lower not in values:
+        return None
+    upper = values.get(min(lower + 1, n - 1), values[lower])
+    return values[lower] + (upper - values[lower]) * (position - lower)
+
+
+class ResultsStore:
+    """Per-run results of every eval, in one SQLite table, to compare evals.
+
+    eval.py records the runs of an eval when it writes its summary, replacing the
+    ones recorded by a previous session of the same eval. Evals that predate the store
+    are imported from their folders on demand, see ``ensure_eval``.
+
+    Aggregates are computed by SQLite rather than by loading runs in Python:
+    percentiles are read off a window ranking the runs, and histograms are a GROUP BY
+    over buckets. The runs of a recorded eval don't change, so its summary is computed
+    once when it is recorded and stored with it: listing hundreds of evals reads one row
+    per eval instead of ranking all their runs again.
+
+    Parameters:
+        db_path (str): Path to the SQLite file, created if missing.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS evals (
+                eval_id TEXT PRIMARY KEY,
+                git_hash TEXT,
+                recorded_at REAL,
+                summary TEXT
+            )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                eval_id TEXT NOT NULL,
+                example TEXT NOT NULL,
+                run_index INTEGER,
+                status TEXT NOT NULL,
+                failure_category TEXT,
+                duration REAL,
+                setup_time REAL,
+                steps INTEGER,
+                input_tokens INTEGER,
+                output_tokens INTEGER
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_eval ON runs (eval_id, example)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def record_eval(
+        self, eval_id: str, git_hash: Optional[str], runs: Iterable[Dict[str, Any]]
+    ) -> None:
+        """Replace the runs of an eval with ``runs``, rows made by ``run_record``"""
+        columns = ("example", "run_index", "status", "failure_category") + METRICS
+        rows = [
+            (eval_id,) + tuple(run.get(column) for column in columns) for run in runs
+        ]
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM runs WHERE eval_id = ?", (eval_id,))
+            conn.executemany(
+                f"INSERT INTO runs (eval_id, {', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO evals (eval_id, git_hash, recorded_at, summary) VALUES (?, ?, ?, ?)",
+                (
+                    eval_id,
+                    git_hash,
+                    time.time(),
+                    json.dumps(self._aggregate(conn, eval_id)),
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def ensure_eval(self, eval_dir: str) -> bool:
+        """Import an eval folder if it isn't recorded yet, or is still running.
+
+        Returns False if the folder doesn't exist.
+        """
+        eval_dir = eval_dir.rstrip(os.sep)
+        if not os.path.isdir(eval_dir):
+            return False
+        eval_id = os.path.basename(eval_dir)
+        recorded = (
+            self._connect()
+            .execute("SELECT 1 FROM evals WHERE eval_id = ?", (eval_id,))
+            .fetchone()
+        )
+        # Finished evals have a summary and were recorded by eval.py when writing it
+        if recorded and os.path.exists(os.path.join(eval_dir, "summary.json")):
+            return True
+        git_hash = None
+        try:
+            with open(os.path.join(eval_dir, "eval_config.json"), "r") as f:
+                git_hash = json.load(f).get("git_hash")
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        self.record_eval(
+            eval_id,
+            git_hash or git_hash_from_name(eval_id),
+            read_eval_runs(eval_dir),
+        )
+        return True
+
+    def _percentiles(
+        self, conn: sqlite3.Connection, metric: str, eval_id: str
+    ) -> Dict[str, Optional[float]]:
+        """``{"p50", "p90", "p95"}`` of a metric of an eval, from a window query
+        returning only the values around each percentile."""
+        positions = " OR ".join(
+            f"position IN (CAST({q} * (n - 1) AS INTEGER), CAST({q} * (n - 1) AS INTEGER) + 1)"
+            for q in PERCENTILES.values()
+        )
+        rows = conn.execute(
+            f"""SELECT n, position, value FROM (
+                SELECT {metric} AS value,
+                    row_number() OVER (ORDER BY {metric}) - 1 AS position,
+                    count(*) OVER () AS n
+                FROM runs WHERE eval_id = ? AND {metric} IS NOT NULL
+            ) WHERE {positions}""",
+            (eval_id,),
+        ).fetchall()
+        if not rows:
+            return {}
+        values = {position: value for _, position, value in rows}
+        return {
+            name: interpolate(values, rows[0][0], q) for name, q in PERCENTILES.items()
+        }
+
+    def _aggregate(self, conn: sqlite3.Connection, eval_id: str) -> Dict[str, Any]:
+        """Success rate and metric distributions of an eval, from its runs"""
+        averages = ", ".join(
+            f"avg({metric}), sum({metric}), count({metric})" for metric in METRICS
+        )
+        row = conn.execute(
+            f"""SELECT count(*), coalesce(sum(status = 'completed'), 0), {averages}
+            FROM runs WHERE eval_id = ?""",
+            (eval_id,),
+        ).fetchone()
+        runs, successes = row[:2]
+        interval = wilson_interval(successes, runs)
+        summary = {
+            "runs": runs,
+            "successes": successes,
+            "success_rate": successes / runs if runs else 0,
+            "success_rate_ci95": list(interval) if interval else None,
+        }
+        for index, metric in enumerate(METRICS):
+            mean, total, count = row[2 + 3 * index : 5 + 3 * index]
+            summary[metric] = (
+                dict(
+                    count=count,
+                    mean=mean,
+                    total=total,
+                    **self._percentiles(conn, metric, eval_id),
+                )
+                if count
+                else None
+            )
+        return summary
+
+    def summaries(
+        self, eval_ids: Optional[Sequence[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Success rate and metric distributions of each eval, all evals by default"""
+        query = "SELECT eval_id, git_hash, recorded_at, summary FROM evals"
+        params: List[str] = []
+        if eval_ids is not None:
+            query += f" WHERE eval_id IN ({', '.join('?' * len(eval_ids))})"
+            params = list(eval_ids)
+        return [
+            dict(
+                eval_id=eval_id,
+                git_hash=git_hash,
+                recorded_at=recorded_at,
+                **json.loads(summary),
+            )
+            for eval_id, git_hash, recorded_at, summary in self._connect().execute(
+                query + " ORDER BY eval_id", params
+            )
+        ]
+
+    def example_success(
+        self, eval_ids: Sequence[str]
+    ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """``{example: {eval_id: {"runs", "successes"}}}`` of the given evals"""
+        rows = self._connect().execute(
+            f"""SELECT example, eval_id, count(*), sum(status = 'completed')
+            FROM runs WHERE eval_id IN ({", ".join("?" * len(eval_ids))})
+            GROUP BY example, eval_id""",
+            list(eval_ids),
+        )
+        examples: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for example, eval_id, runs, successes in rows:
+            examples.setdefault(example, {})[eval_id] = {
+                "runs": runs,
+                "successes": successes,
+            }
+        return examples
+
+    def histogram(
+        self, metric: str, eval_ids: Sequence[str], bins: int = 20
+    ) -> Optional[Dict[str, Any]]:
+        """Counts of a metric's values in ``bins`` equal buckets shared by the evals,
+        or None if none of them has values."""
+        if metric not in METRICS:
+            raise ValueError(
+                f"Unknown metric '{metric}', expected one of {list(METRICS)}"
+            )
+        conn = self._connect()
+        placeholders = ", ".join("?" * len(eval_ids))
+        low, high = conn.execute(
+            f"SELECT min({metric}), max({metric}) FROM runs WHERE eval_id IN ({placeholders})",
+            list(eval_ids),
+        ).fetchone()
+        if low is None:
+            return None
+        width = (high - low) / bins or 1
+        counts = {eval_id: [0] * bins for eval_id in eval_ids}
+        for eval_id, bucket, count in conn.execute(
+            f"""SELECT eval_id, min(CAST(({metric} - ?) / ? AS INTEGER), ?) AS bucket,
+                count(*)
+            FROM runs
+            WHERE {metric} IS NOT NULL AND eval_id IN ({placeholders})
+            GROUP BY eval_id, bucket""",
+            [low, width, bins - 1] + list(eval_ids),
+        ):
+            counts[eval_id][bucket] = count
+        return {
+            "edges": [low + width * index for index in range(bins + 1)],
+            "counts": counts,
+        }
+
+    def compare(self, eval_a: str, eval_b: str, bins: int = 20) -> Dict[str, Any]:
+        """Differences between two recorded evals, B minus A.
+
+        Returns their summaries, the difference of their success rates and metric
+        percentiles, the success of each example in both, and histograms of each metric.
+        """
+        summaries = {
+            summary["eval_id"]: summary for summary in self.summaries([eval_a, eval_b])
+        }
+        missing = [eval_id for eval_id in (eval_a, eval_b) if eval_id not in summaries]
+        if missing:
+            raise KeyError(f"Evals not recorded: {missing}")
+        a, b = summaries[eval_a], summaries[eval_b]
+
+        diff = {"success_rate": b["success_rate"] - a["success_rate"]}
+        for metric in METRICS:
+            if a[metric] and b[metric]:
+                diff[metric] = {
+                    key: b[metric][key] - a[metric][key]
+                    for key in ("mean", *PERCENTILES)
+                    if a[metric].get(key) is not None and b[metric].get(key) is not None
+                }
+
+        examples = []
+        for example, by_eval in self.example_success([eval_a, eval_b]).items():
+            row = {"example": example}
+            for side, eval_id in (("a", eval_a), ("b", eval_b)):
+                counts = by_eval.get(eval_id)
+                if counts:
+                    interval = wilson_interval(counts["successes"], counts["runs"])
+                    counts = dict(
+                        counts,
+                        success_rate=counts["successes"] / counts["runs"],
+                        success_rate_ci95=list(interval),
+                    )
+                row[side] = counts
+            if row["a"] and row["b"]:
+                row["diff"] = row["b"]["success_rate"] - row["a"]["success_rate"]
+                # The 95% intervals don't overlap: unlikely to be noise
+                row["significant"] = (
+                    row["b"]["success_rate_ci95"][0] > row["a"]["success_rate_ci95"][1]
+                    or row["a"]["success_rate_ci95"][0]
+                    > row["b"]["success_rate_ci95"][1]
+                )
+            examples.append(row)
+        # Largest changes first, examples run by only one eval last
+        examples.sort(
+            key=lambda row: (
+                "diff" not in row,
+                -abs(row.get("diff", 0)),
+                row["example"],
+            )
+        )
+
+        return {
+            "a": a,
+            "b": b,
+            "diff": diff,
+            "examples": examples,
+            "histograms": {
+                metric: self.histogram(metric, [eval_a, eval_b], bins)
+                for metric in METRICS
+            },
+        }
+
+
+if __name__ == "__main__":
+    # Import the evals of a results folder recorded before the store existed
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else "./eval_results"
+    store = ResultsStore(os.path.join(base_dir, RESULTS_STORE_FILENAME))
+    for name in sorted(os.listdir(base_dir)):
+        if name.startswith("eval_") and store.ensure_eval(os.path.join(base_dir, name)):
+            print(f"Recorded {name}")
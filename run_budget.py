@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+BUDGET_EXCEEDED_STATUS = "budget_exceeded"
+
+BUDGET_LIMITS = (
+    "max_input_tokens",
+    "max_output_tokens",
+    "max_duration",
+    "max_steps_without_progress",
+)
+
+
+def budget_limits_from_env(prefix: str) -> Dict[str, Optional[float]]:
+    """Read budget limits from ``<prefix>MAX_INPUT_TOKENS``-style environment variables.
+
+    Unset or empty variables leave the corresponding limit disabled.
+    """
+    limits = {}
+    for name in BUDGET_LIMITS:
+        value = os.getenv(prefix + name.upper())
+        limits[name] = float(value) if value else None
+    return limits
+
+
+def _screen_hash(memory_step) -> Optional[str]:
+    images = getattr(memory_step, "observations_images", None)
+    if not images:
+        return None
+    return hashlib.blake2b(images[-1].tobytes(), digest_size=16).hexdigest()
+
+
+class RunBudget:
+    """Token, time and progress budget of an agent run, enforced between steps.
+
+    Register ``step_callback`` after the callbacks that set the step's token counts and
+    screenshot. Once a limit is crossed, the agent is interrupted: it stops before its next
+    step and ``agent.run`` raises ``AgentError("Agent interrupted.")``, while
+    ``exceeded_reason`` tells the caller why, so the run can be saved with
+    ``BUDGET_EXCEEDED_STATUS`` instead of a generic failure.
+
+    Budgets can be chained: every step charged to a run budget is also charged to its
+    ``parent``, e.g. a budget shared by all the runs of a session, and crossing either one
+    interrupts the run.
+
+    Parameters:
+        max_input_tokens (int): Total input tokens allowed.
+        max_output_tokens (int): Total output tokens allowed.
+        max_duration (float): Wall-clock seconds allowed since the run started (see
+            ``start``), including screenshots, planning and callbacks between steps.
+        max_steps_without_progress (int): Consecutive steps allowed without progress. A step
+            makes no progress when it errors or leaves the screen exactly as it was.
+        parent (RunBudget): Budget also charged with, and checked for, every step.
+    """
+
+    def __init__(
+        self,
+        max_input_tokens: Optional[int] = None,
+        max_output_tokens: Optional[int] = None,
+        max_duration: Optional[float] = None,
+        max_steps_without_progress: Optional[int] = None,
+        parent: Optional["RunBudget"] = None,
+    ):
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_duration = max_duration
+        self.max_steps_without_progress = max_steps_without_progress
+        self.parent = parent
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.duration = 0.0
+        self.steps_without_progress = 0
+        self.exceeded_reason: Optional[str] = None
+        self._last_screen_hash: Optional[str] = None
+        self._lock = threading.Lock()
+        # Wall-clock time up to which the run's duration was charged
+        self._charged_until = time.time()
+
+    def start(self) -> None:
+        """Start the run's clock now, e.g. once its sandbox is ready (default: creation)."""
+        with self._lock:
+            self._charged_until = time.time()
+
+    def charge(self, input_tokens: int, output_tokens: int, duration: float) -> None:
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.duration += duration
+        if self.parent is not None:
+            self.parent.charge(input_tokens, output_tokens, duration)
+
+    def record_progress(self, memory_step) -> None:
+        screen_hash = _screen_hash(memory_step)
+        stalled = getattr(memory_step, "error", None) is not None or (
+            screen_hash is not None and screen_hash == self._last_screen_hash
+        )
+        self.steps_without_progress = self.steps_without_progress + 1 if stalled else 0
+        if screen_hash is not None:
+            self._last_screen_hash = screen_hash
+
+    def check(self) -> Optional[str]:
+        """Reason why this budget or one of its parents is exhausted, or None."""
+        if (
+            self.max_input_tokens is not None
+            and self.input_tokens >= self.max_input_tokens
+        ):
+            return f"{self.input_tokens} input tokens used, limit is {self.max_input_tokens:.0f}"
+        if (
+            self.max_output_tokens is not None
+            and self.output_tokens >= self.max_output_tokens
+        ):
+            return f"{self.output_tokens} output tokens used, limit is {self.max_output_tokens:.0f}"
+        if self.max_duration is not None and self.duration >= self.max_duration:
+            return f"{self.duration:.0f}s spent, limit is {self.max_duration:.0f}s"
+        if (
+            self.max_steps_without_progress is not None
+            and self.steps_without_progress >= self.max_steps_without_progress
+        ):
+            return f"{self.steps_without_progress} steps without progress"
+        if self.parent is not None:
+            reason = self.parent.check()
+            if reason is not None:
+                return f"session budget: {reason}"
+        return None
+
+    def step_callback(self, memory_step, agent=None) -> None:
+        """Step callback to register in ``agent.step_callbacks``."""
+        # Charge the wall-clock time since the last step, not the step's own duration,
+        # which leaves out the work done between steps
+        with self._lock:
+            current_time = time.time()
+            elapsed = current_time - self._charged_until
+            self._charged_until = current_time
+        self.charge(
+            getattr(memory_step, "input_token_count", None) or 0,
+            getattr(memory_step, "output_token_count", None) or 0,
+            elapsed,
+        )
+        self.record_progress(memory_step)
+        reason = self.check()
+        if reason is not None and self.exceeded_reason is None:
+            self.exceeded_reason = reason
+            print(f"Budget exceeded ({reason}), interrupting the agent")
+            if agent is not None:
+                agent.interrupt()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "duration": self.duration,
+            "steps_without_progress": self.steps_without_progress,
+            "exceeded_reason": self.exceeded_reason,
+        }
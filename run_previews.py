@@ -0,0 +1,189 @@
+import concurrent.futures
+import hashlib
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from image_cache import ImageVariantCache
+
+PREVIEW_KINDS = ("sprite", "animation")
+
+# WebP images can't be larger than this in either dimension
+MAX_WEBP_DIMENSION = 16383
+
+
+def sprite_layout(
+    image_paths: List[str], tile_width: int = 160
+) -> Optional[Dict[str, Any]]:
+    """Grid of a sprite sheet of ``image_paths``, as close to a square as possible.
+
+    Tiles keep the aspect ratio of the first image, which only needs its header read.
+    """
+    if not image_paths:
+        return None
+    with Image.open(image_paths[0]) as first_image:
+        tile_height = max(1, round(first_image.height * tile_width / first_image.width))
+    count = len(image_paths)
+    columns = max(1, math.ceil(math.sqrt(count * tile_height / tile_width)))
+    columns = min(columns, MAX_WEBP_DIMENSION // tile_width)
+    rows = math.ceil(count / columns)
+    if rows * tile_height > MAX_WEBP_DIMENSION:
+        raise ValueError(f"Too many screenshots ({count}) for a sprite sheet")
+    return {
+        "count": count,
+        "columns": columns,
+        "rows": rows,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "names": [os.path.basename(path) for path in image_paths],
+    }
+
+
+def build_sprite_sheet(
+    image_paths: List[str], layout: Dict[str, Any], out_path: str, quality: int = 70
+) -> None:
+    """Paste thumbnails of ``image_paths`` in a WebP grid, row by row."""
+    tile_width, tile_height = layout["tile_width"], layout["tile_height"]
+    sheet = Image.new(
+        "RGB", (layout["columns"] * tile_width, layout["rows"] * tile_height), "white"
+    )
+    for index, path in enumerate(image_paths):
+        with Image.open(path) as image:
+            # draft lets JPEG decoders downscale while decoding
+            image.draft("RGB", (tile_width, tile_height))
+            tile = image.convert("RGB").resize(
+                (tile_width, tile_height), Image.Resampling.BILINEAR
+            )
+        row, column = divmod(index, layout["columns"])
+        sheet.paste(tile, (column * tile_width, row * tile_height))
+    sheet.save(out_path, "WEBP", quality=quality, method=4)
+
+
+def build_animation(
+    image_paths: List[str],
+    out_path: str,
+    width: int = 480,
+    frame_duration: int = 500,
+    quality: int = 60,
+    max_frames: int = 240,
+) -> None:
+    """Animated WebP of the screenshots, one frame every ``frame_duration`` ms.
+
+    Long runs are sampled down to ``max_frames`` evenly spaced frames, which are all
+    held in memory while encoding.
+    """
+    if len(image_paths) > max_frames:
+        step = len(image_paths) / max_frames
+        image_paths = [image_paths[int(index * step)] for index in range(max_frames)]
+    frames = []
+    for path in image_paths:
+        with Image.open(path) as image:
+            height = max(1, round(image.height * width / image.width))
+            frames.append(
+                image.convert("RGB").resize((width, height), Image.Resampling.BILINEAR)
+            )
+    frames[0].save(
+        out_path,
+        "WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=frame_duration,
+        loop=0,
+        quality=quality,
+        method=4,
+    )
+
+
+def list_run_screenshots(run_dir: str) -> List[str]:
+    return sorted(
+        os.path.join(run_dir, name)
+        for name in os.listdir(run_dir)
+        if name.lower().endswith((".png", ".jpg", ".jpeg"))
+    )
+
+
+class RunPreviews:
+    """Sprite sheets and animated previews of runs, generated on a background pool.
+
+    Previews are stored in an ImageVariantCache folder, so they share its size cap and
+    LRU eviction, under a name derived from the names, mtimes and sizes of the run's
+    screenshots: a run that gets new screenshots gets a new preview. Request threads
+    never render: ``get`` returns the cached file if it exists, else queues its
+    generation, once per preview however many clients ask, and returns None.
+
+    Parameters:
+        cache (ImageVariantCache): The cache holding the generated previews.
+        max_workers (int): Number of previews generated at the same time.
+    """
+
+    def __init__(self, cache: ImageVariantCache, max_workers: int = 2):
+        self.cache = cache
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="run-preview"
+        )
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._errors: Dict[str, str] = {}
+        # Reentrant: a future that is already done runs its callback in submit's thread
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def preview_key(image_paths: List[str], kind: str) -> str:
+        parts = [kind]
+        for path in image_paths:
+            stat = os.stat(path)
+            parts.append(f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}")
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def preview_path(self, key: str) -> str:
+        return os.path.join(self.cache.cache_dir, f"{key}.webp")
+
+    def _generate(self, kind: str, image_paths: List[str], layout, out_path: str):
+        tmp_path = f"{out_path}.{threading.get_ident()}.tmp"
+        if kind == "sprite":
+            build_sprite_sheet(image_paths, layout, tmp_path)
+        else:
+            build_animation(image_paths, tmp_path)
+        os.replace(tmp_path, out_path)
+        self.cache.add(out_path)
+
+    def _done(self, key: str, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.exception() is not None:
+                self._errors[key] = str(future.exception())
+
+    def get(self, run_dir: str, kind: str) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        """State of a preview of a run: ``(key, path or None if not ready, info)``.
+
+        ``info`` has the sprite ``layout``, and the ``error`` of a failed generation.
+        Raises ValueError for an unknown kind and FileNotFoundError for a missing run.
+        """
+        if kind not in PREVIEW_KINDS:
+            raise ValueError(
+                f"Unknown preview '{kind}', expected one of {list(PREVIEW_KINDS)}"
+            )
+        image_paths = list_run_screenshots(run_dir)
+        info: Dict[str, Any] = {"layout": sprite_layout(image_paths)}
+        if not image_paths:
+            return "", None, info
+        key = self.preview_key(image_paths, kind)
+        out_path = self.preview_path(key)
+        try:
+            # Mark as recently used
+            os.utime(out_path)
+            return key, out_path, info
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if key in self._errors:
+                info["error"] = self._errors[key]
+            elif key not in self._pending:
+                future = self._executor.submit(
+                    self._generate, kind, image_paths, info["layout"], out_path
+                )
+                self._pending[key] = future
+                future.add_done_callback(lambda f, key=key: self._done(key, f))
+        return key, None, info
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from trace_files import find_trace_file, open_trace_file
+
+STATUS_FILENAME = "status.json"
+
+# Longest error message kept in the sidecar, the full one stays in metadata.json
+MAX_ERROR_LENGTH = 500
+
+# A JSON string, possibly cut at the end of the buffer, or a bracket
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(?P<end>"|\\?\Z)|[{}\[\]]', re.S)
+_DECODER = json.JSONDecoder()
+
+
+def write_status_file(
+    folder: str,
+    status: str,
+    error_message: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Write the small status record of a run next to its metadata.
+
+    Listing runs then costs one tiny read per run, however long their traces are.
+    Written to a temporary file then renamed, so readers never see it half-written.
+    """
+    record = {
+        "status": status,
+        "error_message": (
+            error_message[:MAX_ERROR_LENGTH] if error_message is not None else None
+        ),
+        "updated_at": time.time(),
+    }
+    if stats:
+        # Per-call latencies grow with the run, the sidecar keeps the totals
+        record["stats"] = {
+            key: value for key, value in stats.items() if key != "model_latencies"
+        }
+    path = os.path.join(folder, STATUS_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+
+
+def read_status_file(run_dir: str) -> Optional[Dict[str, Any]]:
+    """The status record of a run, or None if it has none"""
+    try:
+        with open(os.path.join(run_dir, STATUS_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def scan_top_level_field(path: str, field: str, chunk_size: int = 1 << 16) -> Any:
+    """Value of ``field`` in the JSON object stored at ``path``, read incrementally.
+
+    Only the text up to the field is read and tokenized, so finding the ``status`` that
+    metadata.json files start with costs one chunk, whatever the size of the trace after
+    it. Returns None if the object has no such top-level field.
+    """
+    key = json.dumps(field)
+    depth = 0
+    buffer = ""
+    with open_trace_file(path, "r") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            carry_from = None
+            for match in _TOKEN.finditer(buffer):
+                token = match.group()
+                if token in "{[":
+                    depth += 1
+                    continue
+                if token in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return None
+                    continue
+                if match.group("end") != '"':
+                    # String cut by the end of the chunk
+                    carry_from = match.start()
+                    break
+                if depth != 1 or token != key:
+                    continue
+                rest = buffer[match.end() :].lstrip()
+                if not rest:
+                    carry_from = match.start()
+                    break
+                if rest[0] != ":":
+                    # A string value equal to the key, not the key itself
+                    continue
+                try:
+                    return _DECODER.raw_decode(rest[1:].lstrip())[0]
+                except json.JSONDecodeError:
+                    carry_from = match.start()
+                    break
+            if not chunk:
+                return None
+            buffer = buffer[carry_from:] if carry_from is not None else ""
+
+
+def read_run_status(run_dir: str) -> Optional[str]:
+    """Final status of a run, or None if it never finished.
+
+    Read from the run's status sidecar, or for runs saved before sidecars existed, from
+    the beginning of its metadata.json.
+    """
+    record = read_status_file(run_dir)
+    if record is not None:
+        return record.get("status")
+    metadata_path = find_trace_file(os.path.join(run_dir, "metadata.json"))
+    if metadata_path is None:
+        return None
+    try:
+        return scan_top_level_field(metadata_path, "status")
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
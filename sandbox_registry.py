@@ -0,0 +1,259 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class InMemorySandboxRegistry:
+    """Registry of live sandboxes per session, kept in the memory of one process.
+
+    Each record is a dict with at least ``sandbox_id``, ``created_at``, ``last_accessed``,
+    ``owner`` and ``lease_expires_at``. The owner is the worker currently responsible for
+    the sandbox: only the lease holder may replace or kill it. Leases are only handed out
+    by ``acquire_lease``, renewed while the owner runs an agent (see ``LeaseRenewer``),
+    and expire if the worker goes away, so another worker can take over or reap the
+    sandbox.
+    """
+
+    def __init__(self):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(session_hash)
+            return dict(record) if record is not None else None
+
+    def put(self, session_hash: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._records[session_hash] = dict(record)
+
+    def touch(self, session_hash: str, current_time: float) -> None:
+        """Mark the session as accessed, without changing who holds its lease."""
+        with self._lock:
+            record = self._records.get(session_hash)
+            if record is not None:
+                record["last_accessed"] = current_time
+
+    def acquire_lease(
+        self, session_hash: str, owner: str, lease_seconds: float
+    ) -> bool:
+        """Take the lease if it is free, expired or already held by ``owner``."""
+        current_time = time.time()
+        with self._lock:
+            record = self._records.get(session_hash)
+            if record is None:
+                return False
+            if (
+                record.get("owner") not in (None, owner)
+                and record.get("lease_expires_at", 0) > current_time
+            ):
+                return False
+            record["owner"] = owner
+            record["lease_expires_at"] = current_time + lease_seconds
+            return True
+
+    def release_lease(self, session_hash: str, owner: str) -> None:
+        """Give up the lease if ``owner`` holds it, so another worker can take over."""
+        with self._lock:
+            record = self._records.get(session_hash)
+            if record is not None and record.get("owner") == owner:
+                record["owner"] = None
+                record["lease_expires_at"] = 0
+
+    def remove(self, session_hash: str) -> None:
+        with self._lock:
+            self._records.pop(session_hash, None)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return [(key, dict(record)) for key, record in self._records.items()]
+
+    def __contains__(self, session_hash: str) -> bool:
+        return self.get(session_hash) is not None
+
+
+class SQLiteSandboxRegistry(InMemorySandboxRegistry):
+    """Sandbox registry stored in a SQLite file, shared by all app processes on one host.
+
+    Lease acquisition runs in an ``IMMEDIATE`` transaction, so two workers can never both
+    take over (or reap) the same sandbox.
+
+    Parameters:
+        path (str): Path to the SQLite database file, created if missing.
+        busy_timeout (float): Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 10.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS sandboxes (
+                    session_hash TEXT PRIMARY KEY,
+                    sandbox_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    owner TEXT,
+                    lease_expires_at REAL NOT NULL DEFAULT 0,
+                    extra TEXT NOT NULL DEFAULT '{}'
+                )""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None
+            )
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    _COLUMNS = (
+        "sandbox_id",
+        "created_at",
+        "last_accessed",
+        "owner",
+        "lease_expires_at",
+    )
+
+    def _row_to_record(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = json.loads(row["extra"])
+        record.update({column: row[column] for column in self._COLUMNS})
+        return record
+
+    def get(self, session_hash: str) -> Optional[Dict[str, Any]]:
+        row = (
+            self._connect()
+            .execute("SELECT * FROM sandboxes WHERE session_hash = ?", (session_hash,))
+            .fetchone()
+        )
+        return self._row_to_record(row) if row is not None else None
+
+    def put(self, session_hash: str, record: Dict[str, Any]) -> None:
+        extra = {k: v for k, v in record.items() if k not in self._COLUMNS}
+        self._connect().execute(
+            """INSERT OR REPLACE INTO sandboxes
+            (session_hash, sandbox_id, created_at, last_accessed, owner, lease_expires_at, extra)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (
+                session_hash,
+                record["sandbox_id"],
+                record["created_at"],
+                record["last_accessed"],
+                record.get("owner"),
+                record.get("lease_expires_at", 0),
+                json.dumps(extra),
+            ),
+        )
+
+    def touch(self, session_hash: str, current_time: float) -> None:
+        self._connect().execute(
+            "UPDATE sandboxes SET last_accessed = ? WHERE session_hash = ?",
+            (current_time, session_hash),
+        )
+
+    def acquire_lease(
+        self, session_hash: str, owner: str, lease_seconds: float
+    ) -> bool:
+        current_time = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                """UPDATE sandboxes SET owner = ?, lease_expires_at = ?
+                WHERE session_hash = ?
+                AND (owner IS NULL OR owner = ? OR lease_expires_at <= ?)""",
+                (
+                    owner,
+                    current_time + lease_seconds,
+                    session_hash,
+                    owner,
+                    current_time,
+                ),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def release_lease(self, session_hash: str, owner: str) -> None:
+        self._connect().execute(
+            """UPDATE sandboxes SET owner = NULL, lease_expires_at = 0
+            WHERE session_hash = ? AND owner = ?""",
+            (session_hash, owner),
+        )
+
+    def remove(self, session_hash: str) -> None:
+        self._connect().execute(
+            "DELETE FROM sandboxes WHERE session_hash = ?", (session_hash,)
+        )
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        rows = self._connect().execute("SELECT * FROM sandboxes").fetchall()
+        return [(row["session_hash"], self._row_to_record(row)) for row in rows]
+
+
+class LeaseRenewer:
+    """Renews a worker's lease on a session in a background thread.
+
+    Runs while the worker drives the session's sandbox, which can take longer than the
+    lease, so that no other worker takes the sandbox over or reaps it meanwhile. Each
+    renewal also marks the session as accessed.
+
+    Parameters:
+        registry (InMemorySandboxRegistry): Registry holding the lease.
+        session_hash (str): Session whose lease is renewed.
+        owner (str): Worker holding the lease.
+        lease_seconds (float): Duration of each renewal, renewed every third of it.
+    """
+
+    def __init__(
+        self,
+        registry: InMemorySandboxRegistry,
+        session_hash: str,
+        owner: str,
+        lease_seconds: float,
+    ):
+        self.registry = registry
+        self.session_hash = session_hash
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def _renew(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.registry.acquire_lease(
+                    self.session_hash, self.owner, self.lease_seconds
+                ):
+                    print(f"Lost the lease on the sandbox of {self.session_hash}")
+                    return
+                self.registry.touch(self.session_hash, time.time())
+            except Exception as e:
+                print(f"Could not renew the lease of {self.session_hash}: {e}")
+
+    def start(self) -> "LeaseRenewer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def make_sandbox_registry(path: Optional[str] = None) -> InMemorySandboxRegistry:
+    """Return a SQLite-backed registry if ``path`` is given, else an in-memory one."""
+    if path:
+        return SQLiteSandboxRegistry(path)
+    return InMemorySandboxRegistry()
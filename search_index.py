@@ -0,0 +1,430 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from eval_index import list_subdirs
+from trace_files import find_trace_file, read_json_file
+
+# Rowids of the indexed rows are (run id << STEP_BITS) | (step + 1), so the rows of a
+# run are a rowid range, deleted in one range scan, and step -1 holds run level text
+STEP_BITS = 20
+MAX_STEPS = (1 << STEP_BITS) - 2
+
+# Longest text kept per column of a step, observations can be whole web pages
+MAX_FIELD_LENGTH = 20000
+
+# Runs indexed per transaction, so searches never wait long for the write lock
+BATCH_SIZE = 50
+
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+
+COLUMNS = ("task", "output", "tools", "error")
+
+# Column of each message role, for summaries saved as chat messages
+_ROLE_COLUMNS = {
+    "assistant": "output",
+    "tool-call": "tools",
+    "tool-response": "tools",
+    "user": "tools",
+}
+
+_QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _text(value: Any) -> str:
+    """Searchable text of a JSON value, without the keys of structured ones"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(filter(None, (_text(item) for item in value)))
+    if isinstance(value, dict):
+        if "text" in value:
+            return _text(value["text"])
+        if value.get("type") == "image":
+            return ""
+        return "\n".join(filter(None, (_text(item) for item in value.values())))
+    return str(value)
+
+
+def step_columns(step: Any, first_user_message: bool = False) -> Dict[str, str]:
+    """Text of a summary step, split into the indexed columns.
+
+    Handles both memory steps (``task``, ``model_output``, ``tool_calls``...) and chat
+    messages (``role`` and ``content``), the two shapes agent summaries are saved in.
+    The first user message of a chat holds the task, later ones carry observations.
+    """
+    columns = {column: [] for column in COLUMNS}
+    if not isinstance(step, dict):
+        columns["output"].append(_text(step))
+    elif "role" in step:
+        role = str(step["role"])
+        column = (
+            "task" if role == "user" and first_user_message else _ROLE_COLUMNS.get(role)
+        )
+        if column is not None:
+            columns[column].append(_text(step.get("content")))
+    else:
+        columns["task"].append(_text(step.get("task")))
+        model_output_message = step.get("model_output_message") or {}
+        if isinstance(model_output_message, dict):
+            columns["output"].append(_text(model_output_message.get("content")))
+        columns["output"].append(_text(step.get("model_output")))
+        columns["output"].append(_text(step.get("plan")))
+        for tool_call in step.get("tool_calls") or []:
+            function = tool_call.get("function") or tool_call
+            columns["tools"].append(_text(function.get("name")))
+            columns["tools"].append(_text(function.get("arguments")))
+        columns["tools"].append(_text(step.get("observations")))
+        columns["tools"].append(_text(step.get("action_output")))
+        error = step.get("error")
+        if isinstance(error, dict):
+            columns["error"].append(_text(error.get("type")))
+            columns["error"].append(_text(error.get("message")))
+        else:
+            columns["error"].append(_text(error))
+    return {
+        column: "\n".join(filter(None, parts))[:MAX_FIELD_LENGTH]
+        for column, parts in columns.items()
+    }
+
+
+def fts_query(text: str, fields: Optional[List[str]] = None) -> str:
+    """FTS5 query matching every term of ``text``.
+
+    Terms are quoted, so punctuation in URLs or error messages is matched literally
+    instead of being parsed as query syntax. "Quoted phrases" are kept together and
+    a trailing ``*`` makes a term a prefix. ``fields`` restricts the match to columns.
+    """
+    terms = []
+    for match in _QUERY_TERM.finditer(text):
+        phrase, word = match.groups()
+        prefix = word is not None and word.endswith("*") and len(word) > 1
+        term = (phrase if phrase is not None else word.rstrip("*")).strip()
+        # Terms without letters or digits, like a stray quote, match nothing
+        if re.search(r"\w", term):
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise ValueError("Empty search query")
+    query = " ".join(terms)
+    if fields:
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(
+                f"Unknown fields {sorted(unknown)}, expected some of {list(COLUMNS)}"
+            )
+        query = "{" + " ".join(fields) + "} : (" + query + ")"
+    return query
+
+
+def iter_run_dirs(base_dir: str) -> Iterator[Tuple[str, str, str, str]]:
+    """``(eval_id, example_id, run_id, run_dir)`` of every run under ``base_dir``"""
+    for eval_id in list_subdirs(base_dir, "eval_"):
+        eval_dir = os.path.join(base_dir, eval_id)
+        for example_name in list_subdirs(eval_dir, "example_"):
+            example_dir = os.path.join(eval_dir, example_name)
+            for run_id in list_subdirs(example_dir, "run_"):
+                yield (
+                    eval_id,
+                    example_name[len("example_") :],
+                    run_id,
+                    os.path.join(example_dir, run_id),
+                )
+
+
+class SearchIndex:
+    """Full-text index of the runs of eval folders, in a SQLite FTS5 table.
+
+    Every summary step of a run is a row, with its task, model output, tool calls and
+    observations, and errors in separate columns, plus one row for the run's task and
+    final error message. Runs are indexed in a background thread: a search schedules a
+    refresh of its base folder, at most once every ``max_age`` seconds, which only
+    parses the metadata.json files added or changed since they were last indexed, and
+    is answered right away from the rows indexed so far.
+
+    Parameters:
+        db_path (str): Path to the SQLite file holding the index.
+        max_age (float): Seconds during which a refreshed base folder is not walked again.
+    """
+
+    def __init__(self, db_path: str, max_age: float = 10.0):
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refreshed_at: Dict[str, float] = {}
+        # base folder -> runs left to index, for the folders being refreshed
+        self._pending: Dict[str, int] = {}
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                run_dir TEXT UNIQUE,
+                base_dir TEXT,
+                eval_id TEXT,
+                example_id TEXT,
+                run_id TEXT,
+                status TEXT,
+                mtime INTEGER,
+                size INTEGER
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_base ON runs (base_dir)")
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS steps USING fts5("
+            + ", ".join(COLUMNS)
+            + ", tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _index_run(
+        self, conn: sqlite3.Connection, run_key: int, run_dir: str
+    ) -> Optional[str]:
+        """Replace the rows of a run with the content of its metadata.json, and
+        return its status."""
+        conn.execute(
+            "DELETE FROM steps WHERE rowid BETWEEN ? AND ?",
+            (run_key << STEP_BITS, ((run_key + 1) << STEP_BITS) - 1),
+        )
+        try:
+            metadata = read_json_file(os.path.join(run_dir, "metadata.json"))
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            # Indexed again when the file changes
+            return None
+        if not isinstance(metadata, dict):
+            return None
+        summary = metadata.get("summary") or []
+        # The summary has the task too, but runs may be given another one in task.txt
+        try:
+            with open(os.path.join(run_dir, "task.txt"), "r") as f:
+                task = f.read().strip()
+        except FileNotFoundError:
+            task = ""
+        rows = [
+            (
+                run_key << STEP_BITS,
+                task[:MAX_FIELD_LENGTH],
+                "",
+                "",
+                _text(metadata.get("error_message"))[:MAX_FIELD_LENGTH],
+            )
+        ]
+        seen_user_message = False
+        for index, step in enumerate(summary[:MAX_STEPS]):
+            is_user_message = isinstance(step, dict) and step.get("role") == "user"
+            columns = step_columns(
+                step, first_user_message=is_user_message and not seen_user_message
+            )
+            seen_user_message = seen_user_message or is_user_message
+            if any(columns.values()):
+                rows.append(
+                    ((run_key << STEP_BITS) | (index + 1),)
+                    + tuple(columns[column] for column in COLUMNS)
+                )
+        conn.executemany(
+            f"INSERT INTO steps (rowid, {', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        status = metadata.get("status")
+        return status if isinstance(status, str) else None
+
+    def refresh(self, base_dir: str) -> int:
+        """Index the runs of ``base_dir`` added or changed since the last refresh and
+        drop the removed ones. Returns the number of runs (re)indexed."""
+        base_dir = os.path.abspath(base_dir)
+        with self._lock:
+            self._pending[base_dir] = 0
+        try:
+            return self._refresh(base_dir)
+        finally:
+            with self._lock:
+                self._pending.pop(base_dir, None)
+                self._refreshed_at[base_dir] = time.time()
+
+    def _refresh(self, base_dir: str) -> int:
+        conn = self._connect()
+        indexed = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT run_dir, id, mtime, size FROM runs WHERE base_dir = ?",
+                (base_dir,),
+            )
+        }
+        changed = []
+        seen = set()
+        for eval_id, example_id, run_id, run_dir in iter_run_dirs(base_dir):
+            try:
+                stat = os.stat(
+                    find_trace_file(os.path.join(run_dir, "metadata.json"))
+                    or os.path.join(run_dir, "metadata.json")
+                )
+            except FileNotFoundError:
+                # Still running: indexed once its metadata is written
+                continue
+            seen.add(run_dir)
+            previous = indexed.get(run_dir)
+            if previous is None or previous[1:] != (stat.st_mtime_ns, stat.st_size):
+                changed.append((eval_id, example_id, run_id, run_dir, stat))
+        removed = [
+            (run_key,)
+            for run_dir, (run_key, *_) in indexed.items()
+            if run_dir not in seen
+        ]
+
+        with self._lock:
+            self._pending[base_dir] = len(changed)
+        if removed:
+            conn.execute("BEGIN IMMEDIATE")
+            for (run_key,) in removed:
+                conn.execute(
+                    "DELETE FROM steps WHERE rowid BETWEEN ? AND ?",
+                    (run_key << STEP_BITS, ((run_key + 1) << STEP_BITS) - 1),
+                )
+            conn.executemany("DELETE FROM runs WHERE id = ?", removed)
+            conn.execute("COMMIT")
+        for start in range(0, len(changed), BATCH_SIZE):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for eval_id, example_id, run_id, run_dir, stat in changed[
+                    start : start + BATCH_SIZE
+                ]:
+                    if run_dir in indexed:
+                        run_key = indexed[run_dir][0]
+                    else:
+                        run_key = conn.execute(
+                            """INSERT INTO runs (run_dir, base_dir, eval_id, example_id, run_id)
+                            VALUES (?, ?, ?, ?, ?)""",
+                            (run_dir, base_dir, eval_id, example_id, run_id),
+                        ).lastrowid
+                    status = self._index_run(conn, run_key, run_dir)
+                    conn.execute(
+                        "UPDATE runs SET status = ?, mtime = ?, size = ? WHERE id = ?",
+                        (status, stat.st_mtime_ns, stat.st_size, run_key),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            with self._lock:
+                self._pending[base_dir] -= len(changed[start : start + BATCH_SIZE])
+        return len(changed)
+
+    def _refresh_in_background(self, base_dir: str) -> None:
+        try:
+            self.refresh(base_dir)
+        except Exception as e:
+            print(f"Error indexing {base_dir} for search: {e}")
+
+    def schedule_refresh(self, base_dir: str) -> None:
+        """Refresh ``base_dir`` in a background thread, unless it was refreshed within
+        ``max_age`` seconds or is being refreshed."""
+        base_dir = os.path.abspath(base_dir)
+        with self._lock:
+            if base_dir in self._pending:
+                return
+            if time.time() - self._refreshed_at.get(base_dir, 0) < self.max_age:
+                return
+            # Marked right away, so concurrent searches don't start another thread
+            self._pending[base_dir] = 0
+        threading.Thread(
+            target=self._refresh_in_background,
+            args=(base_dir,),
+            name="search-index",
+            daemon=True,
+        ).start()
+
+    def search(
+        self,
+        base_dir: str,
+        query: str,
+        eval_id: Optional[str] = None,
+        status: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Dict[str, Any]:
+        """Runs of ``base_dir`` matching ``query``, newest evals first.
+
+        Each result is a run, with the number of its matching rows and a snippet of the
+        first one, whose ``step`` is None for the run's task or final error. Raises
+        ValueError for an empty query or unknown fields.
+        """
+        start_time = time.perf_counter()
+        base_dir = os.path.abspath(base_dir)
+        match = fts_query(query, fields)
+        self.schedule_refresh(base_dir)
+
+        filters = ["runs.base_dir = ?"]
+        params: List[Any] = [match, base_dir]
+        if eval_id:
+            filters.append("runs.eval_id = ?")
+            params.append(eval_id)
+        if status:
+            filters.append("runs.status = ?")
+            params.append(status)
+        conn = self._connect()
+        # Matches are grouped by run before the join, so only one runs lookup is made
+        # per matching run rather than per matching step. Results are not ranked by
+        # relevance: bm25 scores every matching step, which a term found in most steps
+        # makes orders of magnitude slower than grouping them.
+        rows = conn.execute(
+            f"""SELECT matches.first_rowid, matches.hits, count(*) OVER (),
+                runs.eval_id, runs.example_id, runs.run_id, runs.status
+            FROM (
+                SELECT rowid >> {STEP_BITS} AS run_key, min(rowid) AS first_rowid,
+                    count(*) AS hits
+                FROM steps WHERE steps MATCH ? GROUP BY run_key
+            ) AS matches
+            JOIN runs ON runs.id = matches.run_key
+            WHERE {" AND ".join(filters)}
+            ORDER BY runs.eval_id DESC, runs.example_id,
+                length(runs.run_id), runs.run_id
+            LIMIT ? OFFSET ?""",
+            params + [limit, offset],
+        ).fetchall()
+        snippets = {}
+        if rows:
+            # Snippets are only built for the rows shown
+            snippets = dict(
+                conn.execute(
+                    f"""SELECT rowid, snippet(steps, -1, ?, ?, '…', 16) FROM steps
+                    WHERE steps MATCH ? AND rowid IN ({", ".join("?" * len(rows))})""",
+                    [SNIPPET_START, SNIPPET_END, match] + [row[0] for row in rows],
+                ).fetchall()
+            )
+        results = []
+        for rowid, hits, _, row_eval_id, example_id, run_id, run_status in rows:
+            step = (rowid & ((1 << STEP_BITS) - 1)) - 1
+            results.append(
+                {
+                    "eval_id": row_eval_id,
+                    "example_id": example_id,
+                    "run_id": run_id,
+                    "status": run_status,
+                    "step": step if step >= 0 else None,
+                    "hits": hits,
+                    "snippet": snippets.get(rowid, ""),
+                }
+            )
+        with self._lock:
+            pending = self._pending.get(base_dir)
+        return {
+            "query": query,
+            "total": rows[0][2] if rows else 0,
+            "offset": offset,
+            "results": results,
+            # Runs still being indexed, whose matches are missing from the results
+            "pending": pending,
+            "took_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        }
@@ -1,13 +1,221 @@
 import os
 import json
 import glob
+import gzip
+import hashlib
+import re
+import sqlite3
+import tempfile
 import traceback
-from flask import Flask, render_template, jsonify, send_file, request
+from urllib.parse import quote, urlencode
+
+from flask import (
+    Flask,
+    Response,
+    g,
+    render_template,
+    jsonify,
+    send_file,
+    request,
+    stream_with_context,
+)
 from flask_cors import CORS
 
+from eval_index import EvalIndex
+from eval_watch import EvalWatcher
+from image_cache import ImageVariantCache, source_etag
+from results_store import RESULTS_STORE_FILENAME, ResultsStore
+from run_previews import RunPreviews
+from run_status import (
+    STATUS_FILENAME,
+    read_run_status,
+    read_status_file,
+    scan_top_level_field,
+)
+from search_index import SearchIndex
+from step_index import StepIndex
+from trace_files import find_trace_file, open_trace_file
+
+try:
+    import brotli
+except ImportError:
+    # Optional: `pip install brotli` to serve brotli compressed responses
+    brotli = None
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Index of the eval folders, saved to EVAL_INDEX_PATH if set so restarts start warm
+EVAL_INDEX = EvalIndex(os.getenv("EVAL_INDEX_PATH"))
+
+# Resized and WebP screenshots, generated on first request
+IMAGE_CACHE = ImageVariantCache(
+    os.getenv("IMAGE_CACHE_DIR")
+    or os.path.join(tempfile.gettempdir(), "eval_viewer_image_cache"),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+THUMBNAIL_WIDTH = 320
+
+# Timeline sprite sheets and animated previews, stored in the same cache
+RUN_PREVIEWS = RunPreviews(
+    IMAGE_CACHE, max_workers=int(os.getenv("PREVIEW_WORKERS", "2"))
+)
+
+# Full-text index of the runs of every eval, updated in the background as runs are added
+SEARCH_INDEX = SearchIndex(
+    os.getenv("SEARCH_INDEX_PATH")
+    or os.path.join(tempfile.gettempdir(), "eval_viewer_search.sqlite3")
+)
+MAX_SEARCH_RESULTS = 100
+
+# Per-run results of the evals of each base folder, saved next to them by eval.py
+RESULTS_STORES = {}
+MAX_HISTOGRAM_BINS = 100
+
+# Offsets of the steps in metadata.json files, to serve traces page by page
+STEP_INDEX = StepIndex()
+MAX_STEPS_PAGE = 200
+
+# Live-tail streams send a comment when idle for this long
+SSE_KEEPALIVE_SECONDS = 15
+
+# Smaller JSON bodies fit in a packet or two, compressing them isn't worth the CPU
+MIN_COMPRESS_SIZE = 1024
+
+
+def run_status_record(run_dir):
+    """Status and error message of a run, from its sidecar when it has one"""
+    status_record = read_status_file(run_dir)
+    if status_record is not None:
+        return status_record
+    # Runs saved before status sidecars: only failed ones need the error message,
+    # which comes after the summary
+    status = read_run_status(run_dir)
+    metadata_path = run_metadata_path(run_dir)
+    return {
+        "status": status,
+        "error_message": (
+            scan_top_level_field(metadata_path, "error_message")
+            if status not in (None, "completed")
+            else None
+        ),
+    }
+
+
+def run_metadata_path(run_dir):
+    """A run's metadata.json, or its compressed variant if only that exists"""
+    metadata_path = os.path.join(run_dir, "metadata.json")
+    return find_trace_file(metadata_path) or metadata_path
+
+
+def screenshot_entry(file_path):
+    # The mtime versions the URLs, so browsers can cache them for good
+    image_url = f"/api/image?path={quote(file_path)}&v={os.stat(file_path).st_mtime_ns}"
+    return {
+        "name": os.path.basename(file_path),
+        "path": image_url,
+        "webp": f"{image_url}&format=webp&q=85",
+        "thumbnail": f"{image_url}&format=webp&w={THUMBNAIL_WIDTH}&q=70",
+    }
+
+
+def list_screenshots(run_dir):
+    screenshots = []
+    for ext in ["png", "jpg", "jpeg"]:
+        pattern = os.path.join(run_dir, f"*.{ext}")
+        for file_path in glob.glob(pattern):
+            screenshots.append(screenshot_entry(file_path))
+
+    # Sort by filename
+    screenshots.sort(key=lambda x: x["name"])
+    return screenshots
+
+
+def results_store(base_dir):
+    db_path = os.path.join(os.path.abspath(base_dir), RESULTS_STORE_FILENAME)
+    store = RESULTS_STORES.get(db_path)
+    if store is None:
+        store = RESULTS_STORES[db_path] = ResultsStore(db_path)
+    return store
+
+
+def negotiate_encoding():
+    """Best content encoding the client accepts: brotli if available, else gzip"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def not_modified_since(*paths):
+    """Validate the request against the files a response is built from.
+
+    The ETag is derived from the mtimes and sizes of ``paths`` and the query string,
+    and Last-Modified is the latest mtime. Returns a 304 response if the client's copy
+    is still current, else None, and the validators are set on the response later.
+    """
+    parts = [request.full_path]
+    last_modified = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            parts.append(f"{path}:-")
+            continue
+        parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        last_modified = max(last_modified, int(stat.st_mtime))
+    g.etag = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+    g.last_modified = last_modified or None
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(g.etag):
+            return None
+    elif not (
+        g.last_modified
+        and request.if_modified_since
+        and request.if_modified_since.timestamp() >= g.last_modified
+    ):
+        return None
+    response = Response(status=304)
+    response.set_etag(g.etag, weak=True)
+    return response
+
+
+@app.after_request
+def add_validators_and_compress(response):
+    """Conditional GETs and compression for the JSON endpoints.
+
+    Responses validated by not_modified_since get their file based validators, the
+    others an ETag hashed from their body. Either way, a client with a current copy
+    gets a 304 and no body. Bodies of at least MIN_COMPRESS_SIZE bytes are compressed.
+    """
+    if response.mimetype != "application/json" or response.status_code != 200:
+        return response
+    response.cache_control.no_cache = True
+    if "etag" in g:
+        response.set_etag(g.etag, weak=True)
+        if g.last_modified:
+            response.last_modified = g.last_modified
+    else:
+        body = response.get_data()
+        response.set_etag(hashlib.sha1(body).hexdigest(), weak=True)
+    response.make_conditional(request)
+    if response.status_code != 200:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+        return response
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=5))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
 
 # Serve the HTML viewer
 @app.route("/")
@@ -19,15 +227,10 @@ def index():
 @app.route("/api/evals")
 def list_evals():
     base_dir = request.args.get("path", "./eval_results")
-    if not os.path.exists(base_dir):
+    eval_dirs = EVAL_INDEX.evals(base_dir)
+    if eval_dirs is None:
         return jsonify({"error": f"Path {base_dir} does not exist"}), 404
 
-    eval_dirs = []
-    for item in os.listdir(base_dir):
-        full_path = os.path.join(base_dir, item)
-        if os.path.isdir(full_path) and item.startswith("eval_"):
-            eval_dirs.append(item)
-
     return jsonify(eval_dirs)
 
 
@@ -35,63 +238,10 @@ def list_evals():
 @app.route("/api/eval/<eval_id>/examples")
 def get_examples(eval_id):
     base_dir = request.args.get("path", "./eval_results")
-    eval_path = os.path.join(base_dir, eval_id)
-
-    # Try to read examples.json
-    examples_json_path = os.path.join(eval_path, "examples.json")
-    examples = {}
-
-    if os.path.exists(examples_json_path):
-        try:
-            with open(examples_json_path, "r") as f:
-                examples = json.load(f)
-        except json.JSONDecodeError:
-            app.logger.error(f"Error parsing examples.json at {examples_json_path}")
-
-    # If examples.json doesn't exist or is empty, scan for example directories
-    if not examples:
-        for item in os.listdir(eval_path):
-            if os.path.isdir(os.path.join(eval_path, item)) and item.startswith(
-                "example_"
-            ):
-                example_id = item.replace("example_", "")
-                example_dir = os.path.join(eval_path, item)
-
-                # Find the first run and read task.txt
-                run_dirs = []
-                for run_item in os.listdir(example_dir):
-                    run_path = os.path.join(example_dir, run_item)
-                    if os.path.isdir(run_path) and run_item.startswith("run_"):
-                        run_dirs.append(run_item)
-
-                if run_dirs:
-                    task_path = os.path.join(example_dir, run_dirs[0], "task.txt")
-                    if os.path.exists(task_path):
-                        with open(task_path, "r") as f:
-                            examples[example_id] = f.read().strip()
-                    else:
-                        # If no task.txt, try reading from metadata.json
-                        metadata_path = os.path.join(
-                            example_dir, run_dirs[0], "metadata.json"
-                        )
-                        if os.path.exists(metadata_path):
-                            try:
-                                with open(metadata_path, "r") as f:
-                                    metadata = json.load(f)
-                                    # Look for task in summary[0].task
-                                    if (
-                                        "summary" in metadata
-                                        and metadata["summary"]
-                                        and "task" in metadata["summary"][0]
-                                    ):
-                                        examples[example_id] = metadata["summary"][0][
-                                            "task"
-                                        ]
-                            except:
-                                # Default to directory name if all else fails
-                                examples[example_id] = f"Task for {example_id}"
-                        else:
-                            examples[example_id] = f"Task for {example_id}"
+    examples = EVAL_INDEX.examples(base_dir, eval_id)
+    if examples is None:
+        eval_path = os.path.join(base_dir, eval_id)
+        return jsonify({"error": f"Eval directory not found: {eval_path}"}), 404
 
     return jsonify(examples)
 
@@ -100,34 +250,11 @@ def get_examples(eval_id):
 @app.route("/api/eval/<eval_id>/example/<example_id>/runs")
 def get_runs(eval_id, example_id):
     base_dir = request.args.get("path", "./eval_results")
-    example_dir = os.path.join(base_dir, eval_id, f"example_{example_id}")
-
-    if not os.path.exists(example_dir):
+    runs = EVAL_INDEX.runs(base_dir, eval_id, example_id)
+    if runs is None:
+        example_dir = os.path.join(base_dir, eval_id, f"example_{example_id}")
         return jsonify({"error": f"Example directory not found: {example_dir}"}), 404
 
-    runs = []
-    for item in os.listdir(example_dir):
-        item_path = os.path.join(example_dir, item)
-        if os.path.isdir(item_path) and item.startswith("run_"):
-            run_id = item
-
-            # Try to get status from metadata.json
-            metadata_path = os.path.join(item_path, "metadata.json")
-            status = "unknown"
-
-            if os.path.exists(metadata_path):
-                try:
-                    with open(metadata_path, "r") as f:
-                        metadata = json.load(f)
-                        status = metadata.get("status", "unknown")
-                except Exception as e:
-                    app.logger.error(
-                        f"Error reading metadata.json for {run_id}: {str(e)}"
-                    )
-
-            runs.append({"id": run_id, "status": status})
-    app.logger.info(f"runs: {runs}")
-
     return jsonify(runs)
 
 
@@ -136,14 +263,17 @@ def get_runs(eval_id, example_id):
 def get_metadata(eval_id, example_id, run_id):
     base_dir = request.args.get("path", "./eval_results")
     run_dir = os.path.join(base_dir, eval_id, f"example_{example_id}", run_id)
-    metadata_path = os.path.join(run_dir, "metadata.json")
+    metadata_path = run_metadata_path(run_dir)
     app.logger.info(f"metadata: {metadata_path}")
+    not_modified = not_modified_since(metadata_path)
+    if not_modified:
+        return not_modified
 
     if not os.path.exists(metadata_path):
         return jsonify({"error": "Metadata not found", "path": metadata_path}), 404
 
     try:
-        with open(metadata_path, "r") as f:
+        with open_trace_file(metadata_path, "r") as f:
             metadata_content = f.read()
             if not metadata_content.strip():
                 return jsonify({"error": "Metadata file is empty"}), 404
@@ -169,6 +299,84 @@ def get_metadata(eval_id, example_id, run_id):
         return jsonify(error_info), 500
 
 
+# Get a page of the agent steps of a run
+@app.route("/api/eval/<eval_id>/example/<example_id>/run/<run_id>/steps")
+def get_steps(eval_id, example_id, run_id):
+    base_dir = request.args.get("path", "./eval_results")
+    run_dir = os.path.join(base_dir, eval_id, f"example_{example_id}", run_id)
+    metadata_path = run_metadata_path(run_dir)
+    offset = max(request.args.get("offset", default=0, type=int), 0)
+    limit = min(max(request.args.get("limit", default=20, type=int), 1), MAX_STEPS_PAGE)
+
+    if not os.path.exists(metadata_path):
+        return jsonify({"error": "Metadata not found", "path": metadata_path}), 404
+    not_modified = not_modified_since(
+        metadata_path, os.path.join(run_dir, STATUS_FILENAME)
+    )
+    if not_modified:
+        return not_modified
+
+    try:
+        page = STEP_INDEX.read(metadata_path, offset, limit)
+    except Exception as e:
+        app.logger.error(f"Error reading steps of {metadata_path}: {str(e)}")
+        return (
+            jsonify(
+                {
+                    "error": "Error reading steps",
+                    "details": str(e),
+                    "path": metadata_path,
+                }
+            ),
+            500,
+        )
+    page["limit"] = limit
+    # Small enough to send along, the viewer then doesn't need metadata.json
+    status_record = run_status_record(run_dir)
+    page["status"] = status_record.get("status")
+    page["error_message"] = status_record.get("error_message")
+    return jsonify(page)
+
+
+# Everything the viewer shows when opening a run, in one response
+@app.route("/api/eval/<eval_id>/example/<example_id>/run/<run_id>/overview")
+def get_overview(eval_id, example_id, run_id):
+    base_dir = request.args.get("path", "./eval_results")
+    run_dir = os.path.join(base_dir, eval_id, f"example_{example_id}", run_id)
+    metadata_path = run_metadata_path(run_dir)
+    limit = min(max(request.args.get("limit", default=20, type=int), 1), MAX_STEPS_PAGE)
+
+    run = EVAL_INDEX.run(base_dir, eval_id, example_id, run_id)
+    if run is None:
+        return jsonify({"error": f"Run directory not found: {run_dir}"}), 404
+    # New screenshots and the status sidecar change the run directory
+    not_modified = not_modified_since(
+        run_dir, metadata_path, os.path.join(run_dir, STATUS_FILENAME)
+    )
+    if not_modified:
+        return not_modified
+
+    status_record = run_status_record(run_dir)
+    overview = {
+        "id": run_id,
+        "task": run.get("task"),
+        "status": status_record.get("status"),
+        "error_message": status_record.get("error_message"),
+        # Duration, setup time, action steps and tokens, for runs saved by eval.py
+        "stats": status_record.get("stats"),
+        "screenshots": list_screenshots(run_dir),
+        "steps": {"total": 0, "offset": 0, "limit": limit, "steps": []},
+    }
+    if os.path.exists(metadata_path):
+        try:
+            overview["steps"] = dict(
+                STEP_INDEX.read(metadata_path, 0, limit), limit=limit
+            )
+        except Exception as e:
+            app.logger.error(f"Error reading steps of {metadata_path}: {str(e)}")
+    return jsonify(overview)
+
+
 # Get screenshots for a run
 @app.route("/api/eval/<eval_id>/example/<example_id>/run/<run_id>/screenshots")
 def get_screenshots(eval_id, example_id, run_id):
@@ -177,24 +385,192 @@ def get_screenshots(eval_id, example_id, run_id):
 
     if not os.path.exists(run_dir):
         return jsonify({"error": f"Run directory not found: {run_dir}"}), 404
+    not_modified = not_modified_since(run_dir)
+    if not_modified:
+        return not_modified
 
-    screenshots = []
-    for ext in ["png", "jpg", "jpeg"]:
-        pattern = os.path.join(run_dir, f"*.{ext}")
-        for file_path in glob.glob(pattern):
-            filename = os.path.basename(file_path)
-            screenshots.append(
-                {"name": filename, "path": f"/api/image?path={file_path}"}
-            )
-
-    # Sort by filename
-    screenshots.sort(key=lambda x: x["name"])
+    screenshots = list_screenshots(run_dir)
 
     app.logger.info(f"screenshots: {screenshots}")
 
     return jsonify(screenshots)
 
 
+# Search the tasks, model outputs, tool calls and errors of the runs of all evals
+@app.route("/api/search")
+def search_runs():
+    base_dir = request.args.get("path", "./eval_results")
+    query = request.args.get("q", "")
+    fields = [field for field in request.args.get("fields", "").split(",") if field]
+    limit = min(
+        max(request.args.get("limit", default=20, type=int), 1), MAX_SEARCH_RESULTS
+    )
+    offset = max(request.args.get("offset", default=0, type=int), 0)
+
+    if not os.path.isdir(base_dir):
+        return jsonify({"error": f"Path {base_dir} does not exist"}), 404
+
+    try:
+        results = SEARCH_INDEX.search(
+            base_dir,
+            query,
+            eval_id=request.args.get("eval") or None,
+            status=request.args.get("status") or None,
+            fields=fields or None,
+            limit=limit,
+            offset=offset,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    for result in results["results"]:
+        # Opens the run in the viewer, scrolled to the matching step
+        link = {
+            "path": request.args.get("path", ""),
+            "eval": result["eval_id"],
+            "example": result["example_id"],
+            "run": result["run_id"],
+        }
+        if result["step"] is not None:
+            link["step"] = result["step"]
+        result["url"] = "/#" + urlencode(link, quote_via=quote)
+    return jsonify(results)
+
+
+# Success rate and distributions of duration, steps and tokens of every eval
+@app.route("/api/results")
+def list_results():
+    base_dir = request.args.get("path", "./eval_results")
+    eval_dirs = EVAL_INDEX.evals(base_dir)
+    if eval_dirs is None:
+        return jsonify({"error": f"Path {base_dir} does not exist"}), 404
+
+    try:
+        store = results_store(base_dir)
+        # Evals older than the store, or still running, are read from their folders
+        for eval_id in eval_dirs:
+            store.ensure_eval(os.path.join(base_dir, eval_id))
+        return jsonify(store.summaries(eval_dirs))
+    except sqlite3.Error as e:
+        app.logger.error(f"Error reading the results store of {base_dir}: {str(e)}")
+        return jsonify({"error": f"Error reading the results store: {str(e)}"}), 500
+
+
+# Differences of success rates and latency distributions between two evals, B minus A
+@app.route("/api/compare")
+def compare_evals():
+    base_dir = request.args.get("path", "./eval_results")
+    eval_a = request.args.get("a")
+    eval_b = request.args.get("b")
+    bins = min(
+        max(request.args.get("bins", default=20, type=int), 1), MAX_HISTOGRAM_BINS
+    )
+    if not eval_a or not eval_b:
+        return jsonify({"error": "Two evals to compare are needed, as a and b"}), 400
+
+    try:
+        store = results_store(base_dir)
+        for eval_id in (eval_a, eval_b):
+            eval_dir = os.path.join(base_dir, eval_id)
+            if not store.ensure_eval(eval_dir):
+                return jsonify({"error": f"Eval directory not found: {eval_dir}"}), 404
+        return jsonify(store.compare(eval_a, eval_b, bins=bins))
+    except sqlite3.Error as e:
+        app.logger.error(f"Error reading the results store of {base_dir}: {str(e)}")
+        return jsonify({"error": f"Error reading the results store: {str(e)}"}), 500
+
+
+# Stream the changes of an eval folder while it is being written, as Server-Sent Events
+@app.route("/api/eval/<eval_id>/events")
+def stream_events(eval_id):
+    base_dir = request.args.get("path", "./eval_results")
+    eval_dir = os.path.join(base_dir, eval_id)
+    if not os.path.isdir(eval_dir):
+        return jsonify({"error": f"Eval directory not found: {eval_dir}"}), 404
+
+    watcher = EvalWatcher(eval_dir)
+
+    def generate():
+        # Browsers reconnect by themselves after this many milliseconds
+        yield "retry: 3000\n\n"
+        try:
+            while True:
+                events = watcher.poll(timeout=SSE_KEEPALIVE_SECONDS)
+                if not events:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                for event in events:
+                    if event["type"] == "screenshot":
+                        file_path = os.path.join(
+                            eval_dir,
+                            f"example_{event['example_id']}",
+                            event["run_id"],
+                            event["name"],
+                        )
+                        try:
+                            event.update(screenshot_entry(file_path))
+                        except FileNotFoundError:
+                            continue
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            # Runs when the client disconnects and the generator is closed
+            watcher.close()
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.cache_control.no_cache = True
+    # Don't let nginx buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+# Sprite sheet or animated preview of a run, generated in the background on first request
+@app.route("/api/eval/<eval_id>/example/<example_id>/run/<run_id>/preview/<kind>")
+def get_preview(eval_id, example_id, run_id, kind):
+    base_dir = request.args.get("path", "./eval_results")
+    run_dir = os.path.join(base_dir, eval_id, f"example_{example_id}", run_id)
+
+    if not os.path.isdir(run_dir):
+        return jsonify({"error": f"Run directory not found: {run_dir}"}), 404
+
+    try:
+        key, preview_path, info = RUN_PREVIEWS.get(run_dir, kind)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if info.get("error"):
+        return jsonify({"error": f"Error generating preview: {info['error']}"}), 500
+    if info["layout"] is None:
+        return jsonify({"ready": False, "layout": None, "url": None})
+    if preview_path is None:
+        # Accepted: the client should ask again shortly
+        response = jsonify({"ready": False, "layout": info["layout"], "url": None})
+        response.status_code = 202
+        response.headers["Retry-After"] = "1"
+        return response
+    return jsonify(
+        {"ready": True, "layout": info["layout"], "url": f"/api/preview/{key}.webp"}
+    )
+
+
+# Serve a generated preview: named after its content, so cacheable for good
+@app.route("/api/preview/<key>.webp")
+def serve_preview(key):
+    if not re.fullmatch(r"[0-9a-f]{40}", key):
+        return jsonify({"error": "Invalid preview key"}), 400
+    preview_path = RUN_PREVIEWS.preview_path(key)
+    if not os.path.exists(preview_path):
+        return jsonify({"error": "Preview not found"}), 404
+    response = send_file(
+        preview_path,
+        mimetype="image/webp",
+        etag=key,
+        max_age=31536000,
+        conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 # Serve an image file
 @app.route("/api/image")
 def get_image():
@@ -205,8 +581,35 @@ def get_image():
     if not os.path.exists(path):
         return jsonify({"error": f"Image not found at path: {path}"}), 404
 
+    width = request.args.get("w", type=int)
+    image_format = request.args.get("format")
+    quality = request.args.get("q", default=80, type=int)
+    try:
+        if width or image_format:
+            file_path, etag, mimetype = IMAGE_CACHE.get(
+                path, width=width, image_format=image_format or "webp", quality=quality
+            )
+        else:
+            file_path, etag, mimetype = path, source_etag(path), None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error converting image: {str(e)}"}), 500
+
     try:
-        return send_file(path)
+        # Versioned URLs never change content: a year, else revalidate after an hour
+        versioned = bool(request.args.get("v"))
+        response = send_file(
+            file_path,
+            mimetype=mimetype,
+            etag=etag,
+            max_age=31536000 if versioned else 3600,
+            conditional=True,
+        )
+        response.cache_control.public = True
+        if versioned:
+            response.cache_control.immutable = True
+        return response
     except Exception as e:
         return jsonify({"error": f"Error serving image: {str(e)}"}), 500
 
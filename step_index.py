@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from trace_files import open_trace_file
+
+# A JSON string, possibly cut at the end of the buffer, or a bracket. JSON syntax is
+# ASCII and UTF-8 never reuses ASCII bytes, so files are tokenized as raw bytes and the
+# match positions are byte offsets.
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(?P<end>"|\\?\Z)|[{}\[\]]', re.S)
+
+
+def array_element_offsets(
+    path: str, field: str = "summary", chunk_size: int = 1 << 20
+) -> List[Tuple[int, int]]:
+    """Byte ranges of the elements of the top-level array ``field`` of a JSON file.
+
+    The file is tokenized in one streaming pass, without decoding any element, so the
+    elements can later be read and parsed one by one by seeking to their offsets. Only
+    object, array and string elements are located, which is what agent summaries hold.
+    Compressed files (see trace_files.py) are decompressed on the fly, and the offsets
+    are those of the decompressed content.
+    """
+    key = json.dumps(field).encode("utf-8")
+    offsets: List[Tuple[int, int]] = []
+    depth = 0
+    # 0: looking for the key, 1: key found, expecting its value, 2: inside the array
+    state = 0
+    element_start = None
+    base = 0
+    buffer = b""
+    with open_trace_file(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            carry_from = None
+            for match in _TOKEN.finditer(buffer):
+                token = match.group()
+                if token[:1] == b'"' and match.group("end") != b'"':
+                    # String cut by the end of the chunk
+                    carry_from = match.start()
+                    break
+                if state == 1:
+                    if token != b"[":
+                        return []
+                    state = 2
+                    depth += 1
+                    continue
+                if state == 2 and depth == 2 and element_start is None:
+                    element_start = base + match.start()
+                if token in (b"{", b"["):
+                    depth += 1
+                elif token in (b"}", b"]"):
+                    depth -= 1
+                    if state == 2 and depth == 1:
+                        # End of the array
+                        return offsets
+                    if depth == 0:
+                        return offsets
+                elif state == 0 and depth == 1 and token == key:
+                    rest = buffer[match.end() :].lstrip()
+                    if not rest:
+                        carry_from = match.start()
+                        break
+                    if rest[:1] == b":":
+                        state = 1
+                if state == 2 and depth == 2 and element_start is not None:
+                    offsets.append((element_start, base + match.end()))
+                    element_start = None
+            if not chunk:
+                return offsets
+            if carry_from is None:
+                carry_from = len(buffer)
+            base += carry_from
+            buffer = buffer[carry_from:]
+
+
+class StepIndex:
+    """Offsets of the summary steps of run metadata files, to serve them page by page.
+
+    The offsets of a file are computed on its first request and kept in memory, keyed by
+    its path and checked against its mtime and size, for the ``max_files`` most recently
+    used files. Pages are then read by seeking to their steps, so a page costs the size
+    of its steps rather than of the whole trace. In compressed files, seeking decompresses
+    the content up to the page.
+    """
+
+    def __init__(self, field: str = "summary", max_files: int = 256):
+        self.field = field
+        self.max_files = max_files
+        self._offsets: "OrderedDict[str, Tuple[int, int, List[Tuple[int, int]]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def offsets(self, path: str) -> List[Tuple[int, int]]:
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._offsets.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._offsets.move_to_end(path)
+                return cached[2]
+        offsets = array_element_offsets(path, self.field)
+        with self._lock:
+            self._offsets[path] = (stat.st_mtime_ns, stat.st_size, offsets)
+            self._offsets.move_to_end(path)
+            while len(self._offsets) > self.max_files:
+                self._offsets.popitem(last=False)
+        return offsets
+
+    def count(self, path: str) -> int:
+        return len(self.offsets(path))
+
+    def read(
+        self, path: str, offset: int = 0, limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Steps ``offset`` to ``offset + limit`` of the file, with the total count"""
+        offsets = self.offsets(path)
+        selected = offsets[offset : offset + limit if limit is not None else None]
+        steps = []
+        if selected:
+            with open_trace_file(path, "rb") as f:
+                # Steps are contiguous: read the whole page at once
+                f.seek(selected[0][0])
+                page = f.read(selected[-1][1] - selected[0][0])
+            for start, end in selected:
+                start -= selected[0][0]
+                end -= selected[0][0]
+                steps.append(json.loads(page[start:end]))
+        return {"total": len(offsets), "offset": offset, "steps": steps}
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TASK_FIELDS = ("task", "prompt", "text")
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse an ``i/n`` shard spec, with 0 <= i < n."""
+    match = re.fullmatch(r"(\d+)/(\d+)", shard.strip())
+    if not match or not 0 <= int(match.group(1)) < int(match.group(2)):
+        raise ValueError(f"Invalid shard '{shard}', expected i/n with 0 <= i < n")
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_filters(filters: Optional[List[str]]) -> Dict[str, str]:
+    """Parse ``field=value`` filter specs."""
+    parsed = {}
+    for spec in filters or []:
+        field, sep, value = spec.partition("=")
+        if not sep or not field:
+            raise ValueError(f"Invalid filter '{spec}', expected field=value")
+        parsed[field] = value
+    return parsed
+
+
+def example_id(record: Dict[str, Any], task: str) -> str:
+    """Stable id of a task: its ``id`` field, else a hash of its text.
+
+    Ids name the example folders, so they are restricted to safe file name characters.
+    """
+    if record.get("id") is not None:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", str(record["id"]))
+    return "task_" + hashlib.sha1(task.encode("utf-8")).hexdigest()[:10]
+
+
+def in_shard(example_id: str, shard: Optional[Tuple[int, int]]) -> bool:
+    # Hash-based, so a task stays in its shard whatever the file order or filters
+    if shard is None:
+        return True
+    index, count = shard
+    digest = hashlib.sha1(example_id.encode("utf-8")).hexdigest()
+    return int(digest, 16) % count == index
+
+
+def _matches(record: Dict[str, Any], filters: Dict[str, str]) -> bool:
+    for field, value in filters.items():
+        actual = record.get(field)
+        if isinstance(actual, list):
+            if value not in [str(item) for item in actual]:
+                return False
+        elif str(actual) != value:
+            return False
+    return True
+
+
+class TaskDataset:
+    """Task set streamed from a JSONL file, one ``{"id", "task", ...}`` object per line.
+
+    The file is read lazily on every iteration, so it can hold far more tasks than fit
+    in memory. It behaves like the read-only ``{example_id: task}`` dict eval.py uses for
+    hard-coded examples: iterating yields ids and ``items()`` yields ``(id, task)`` pairs.
+
+    Parameters:
+        path (str): The JSONL file. The task text is read from its ``task``, ``prompt``
+            or ``text`` field.
+        filters (dict): ``{field: value}`` pairs a record must match; list fields match if
+            they contain the value.
+        shard (tuple): ``(index, count)`` to keep only the tasks of one shard.
+        limit (int): Maximum number of tasks to yield.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        filters: Optional[Dict[str, str]] = None,
+        shard: Optional[Tuple[int, int]] = None,
+        limit: Optional[int] = None,
+    ):
+        self.path = path
+        self.filters = filters or {}
+        self.shard = shard
+        self.limit = limit
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Yield the selected records, with their ``id`` and ``task`` normalized."""
+        count = 0
+        seen_ids = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if self.limit is not None and count >= self.limit:
+                    return
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                task = next(
+                    (record[field] for field in TASK_FIELDS if record.get(field)), None
+                )
+                if task is None:
+                    print(f"Skipping line {line_number} of {self.path}: no task")
+                    continue
+                record_id = example_id(record, task)
+                if not _matches(record, self.filters) or not in_shard(
+                    record_id, self.shard
+                ):
+                    continue
+                if record_id in seen_ids:
+                    raise ValueError(f"Duplicate task id '{record_id}' in {self.path}")
+                seen_ids.add(record_id)
+                count += 1
+                yield {**record, "id": record_id, "task": task}
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for record in self.records():
+            yield record["id"], record["task"]
+
+    def __iter__(self) -> Iterator[str]:
+        for record_id, _ in self.items():
+            yield record_id
+
+    def write_jsonl(self, path: str) -> int:
+        """Write the selected tasks to ``path``, one line at a time. Returns their count."""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.records():
+                f.write(json.dumps(record) + "\n")
+                count += 1
+        return count
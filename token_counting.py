@@ -0,0 +1,140 @@
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from smolagents.utils import _is_package_available
+
+DEFAULT_TOKENIZER_ID = "Qwen/Qwen2.5-VL-72B-Instruct"
+# Chat template overhead per message: <|im_start|>role\n ... <|im_end|>\n
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(tokenizer_id: str):
+    """Load a fast tokenizer once per process, or return None if it is unavailable."""
+    if not _is_package_available("tokenizers"):
+        print("Install 'tokenizers' for exact token counts, falling back to estimates")
+        return None
+    from tokenizers import Tokenizer
+
+    try:
+        return Tokenizer.from_pretrained(tokenizer_id)
+    except Exception as e:
+        print(
+            f"Could not load tokenizer {tokenizer_id} ({e}), falling back to estimates"
+        )
+        return None
+
+
+def smart_resize(
+    height: int,
+    width: int,
+    factor: int = 28,
+    min_pixels: int = 4 * 28 * 28,
+    max_pixels: int = 16384 * 28 * 28,
+) -> Tuple[int, int]:
+    """Size an image is resized to by the Qwen2.5-VL processor before being split in patches."""
+    resized_height = max(factor, round(height / factor) * factor)
+    resized_width = max(factor, round(width / factor) * factor)
+    if resized_height * resized_width > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        resized_height = math.floor(height / beta / factor) * factor
+        resized_width = math.floor(width / beta / factor) * factor
+    elif resized_height * resized_width < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        resized_height = math.ceil(height * beta / factor) * factor
+        resized_width = math.ceil(width * beta / factor) * factor
+    return resized_height, resized_width
+
+
+class TokenCounter:
+    """Counts the tokens of agent messages without stringifying them.
+
+    Text is tokenized with the model's tokenizer (or estimated at 4 characters per token
+    when there is none or it can't be loaded), and counts are memoized per text, so the unchanged history
+    that prefixes every step's messages costs a dictionary lookup. Images are counted from
+    their dimensions with the Qwen2.5-VL formula: one token per merged 28x28 patch of the
+    resized image, plus the vision start/end tokens.
+
+    Parameters:
+        tokenizer_id (str, optional): Hub repository of the tokenizer. None estimates
+            counts without loading one, e.g. to stay offline.
+        patch_size (int): Vision encoder patch size.
+        merge_size (int): Number of patches merged into one token, per side.
+        min_pixels (int): Minimum resized image area.
+        max_pixels (int): Maximum resized image area.
+        cache_size (int): Number of distinct texts whose counts are kept.
+    """
+
+    def __init__(
+        self,
+        tokenizer_id: Optional[str] = DEFAULT_TOKENIZER_ID,
+        patch_size: int = 14,
+        merge_size: int = 2,
+        min_pixels: int = 4 * 28 * 28,
+        max_pixels: int = 16384 * 28 * 28,
+        cache_size: int = 4096,
+    ):
+        self.tokenizer_id = tokenizer_id
+        self.patch_size = patch_size
+        self.merge_size = merge_size
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.count_text = lru_cache(maxsize=cache_size)(self._count_text)
+        self.count_image_size = lru_cache(maxsize=64)(self._count_image_size)
+
+    def _count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = load_tokenizer(self.tokenizer_id) if self.tokenizer_id else None
+        if tokenizer is None:
+            return max(1, len(text) // 4)
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def _count_image_size(self, width: int, height: int) -> int:
+        factor = self.patch_size * self.merge_size
+        resized_height, resized_width = smart_resize(
+            height, width, factor, self.min_pixels, self.max_pixels
+        )
+        return (resized_height // factor) * (resized_width // factor) + 2
+
+    def count_image(self, image) -> int:
+        width, height = image.size
+        return self.count_image_size(width, height)
+
+    def count_content(self, content) -> int:
+        if content is None:
+            return 0
+        if isinstance(content, str):
+            return self.count_text(content)
+        total = 0
+        for part in content:
+            if part.get("type") == "text":
+                total += self.count_text(part.get("text") or "")
+            elif part.get("type") == "image" and hasattr(part.get("image"), "size"):
+                total += self.count_image(part["image"])
+        return total
+
+    def count_messages(self, messages: Optional[List[Dict[str, Any]]]) -> int:
+        if not messages:
+            return 0
+        return sum(
+            MESSAGE_OVERHEAD_TOKENS + self.count_content(message.get("content"))
+            for message in messages
+        )
+
+    def step_callback(self, memory_step, agent=None) -> None:
+        """Attach input/output token counts to an ActionStep, if the model reported none."""
+        model = getattr(agent, "model", None)
+        reported_input = getattr(model, "last_input_token_count", None)
+        reported_output = getattr(model, "last_output_token_count", None)
+        if reported_input is not None and reported_output is not None:
+            memory_step.input_token_count = reported_input
+            memory_step.output_token_count = reported_output
+            return
+        memory_step.input_token_count = self.count_messages(
+            getattr(memory_step, "model_input_messages", None)
+        )
+        memory_step.output_token_count = self.count_text(
+            getattr(memory_step, "model_output", None) or ""
+        )
@@ -0,0 +1,72 @@
+import gzip
+import io
+import json
+import os
+from typing import IO, Any, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    # Optional: `pip install zstandard` to write and read .zst run files
+    zstandard = None
+
+# Run files such as metadata.json can be stored compressed, as metadata.json.gz or .zst
+COMPRESSIONS = ("gz", "zst")
+
+
+def compression_of(path: str) -> Optional[str]:
+    """Compression of a file according to its extension, or None if it is plain."""
+    extension = os.path.splitext(path)[1][1:]
+    return extension if extension in COMPRESSIONS else None
+
+
+def trace_file_variants(path: str) -> List[str]:
+    """``path`` and the names of its compressed variants, in lookup order."""
+    return [path] + [f"{path}.{compression}" for compression in COMPRESSIONS]
+
+
+def find_trace_file(path: str) -> Optional[str]:
+    """``path`` if it exists, else its compressed variant that does, else None."""
+    for candidate in trace_file_variants(path):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def open_trace_file(path: str, mode: str = "r", compression=None) -> IO:
+    """Open a file, compressed according to its extension unless ``compression`` says
+    otherwise. Modes are ``r`` and ``w`` for UTF-8 text, ``rb`` and ``wb`` for bytes."""
+    compression = compression or compression_of(path)
+    binary = mode.endswith("b")
+    mode = mode.rstrip("b")
+    if compression == "gz":
+        # Level 6 compresses JSON nearly as well as 9 at a fraction of the cost
+        if binary:
+            return gzip.open(path, mode + "b", compresslevel=6)
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    if compression == "zst":
+        if zstandard is None:
+            raise ModuleNotFoundError(
+                "Please install 'zstandard' to read or write .zst run files: `pip install zstandard`"
+            )
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+    if binary:
+        return open(path, mode + "b")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_json_file(path: str) -> Any:
+    """Load the JSON file at ``path``, or at its compressed variant if only that exists.
+
+    Raises FileNotFoundError if there is neither.
+    """
+    found = find_trace_file(path)
+    if found is None:
+        raise FileNotFoundError(path)
+    with open_trace_file(found, "r") as f:
+        return json.load(f)
@@ -0,0 +1,256 @@
+import json
+import os
+from enum import Enum
+from typing import IO, Any, Dict, Iterator
+
+from smolagents.memory import MemoryStep, ToolCall
+from smolagents.models import ChatMessage, ChatMessageToolCall
+
+from trace_files import open_trace_file, trace_file_variants
+from trace_writer import step_to_record
+
+
+def _tool_call_record(tool_call) -> Dict[str, Any]:
+    if isinstance(tool_call, ChatMessageToolCall):
+        name, arguments = tool_call.function.name, tool_call.function.arguments
+    else:
+        name, arguments = tool_call.name, tool_call.arguments
+    return {
+        "id": tool_call.id,
+        "type": "function",
+        "function": {"name": name, "arguments": arguments},
+    }
+
+
+class TraceEncoder(json.JSONEncoder):
+    """JSON encoder with an explicit schema for the agent objects found in traces.
+
+    Plain dicts and lists are walked by the C encoder as they are; only agent objects
+    reach ``default``, which builds the few fields we keep instead of copying their
+    ``__dict__``. The raw API response of chat messages and images are left out.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, ChatMessage):
+            return {
+                "role": obj.role,
+                "content": obj.content,
+                "tool_calls": (
+                    [_tool_call_record(tc) for tc in obj.tool_calls]
+                    if obj.tool_calls
+                    else None
+                ),
+            }
+        if isinstance(obj, (ToolCall, ChatMessageToolCall)):
+            return _tool_call_record(obj)
+        if isinstance(obj, MemoryStep):
+            return step_to_record(obj)
+        if isinstance(obj, Enum):
+            return obj.value
+        if hasattr(obj, "size") and hasattr(obj, "mode"):
+            # PIL images: screenshots are saved next to the trace, not inside it
+            return None
+        if isinstance(obj, BaseException):
+            return {"type": type(obj).__name__, "message": str(obj)}
+        return str(obj)
+
+
+# Traces are trees, so the C encoder can skip its cycle bookkeeping, and escaping to
+# ASCII keeps it on its fastest path: both measurably faster on long traces
+_ENCODER = TraceEncoder(check_circular=False, separators=(",", ":"))
+
+
+def iter_chunks(obj: Any, batch_size: int = 64) -> Iterator[str]:
+    """Encode ``obj`` as JSON text chunks, to stream it without building one big string.
+
+    ``json.dump`` streams through the pure Python encoder, which is several times slower
+    than ``json.dumps``. Instead, the values of a top-level dict are encoded separately,
+    and top-level lists ``batch_size`` elements per C encoder call.
+    """
+    if isinstance(obj, dict):
+        yield "{"
+        for index, (key, value) in enumerate(obj.items()):
+            yield ("," if index else "") + _ENCODER.encode(str(key)) + ":"
+            yield from (
+                iter_chunks(value, batch_size)
+                if isinstance(value, (list, tuple))
+                else [_ENCODER.encode(value)]
+            )
+        yield "}"
+    elif isinstance(obj, (list, tuple)):
+        yield "["
+        for start in range(0, len(obj), batch_size):
+            yield ("," if start else "") + _ENCODER.encode(
+                list(obj[start : start + batch_size])
+            )[1:-1]
+        yield "]"
+    else:
+        yield _ENCODER.encode(obj)
+
+
+def dump(obj: Any, fp: IO[str]) -> None:
+    """Stream ``obj`` as compact JSON to a text file object."""
+    for chunk in iter_chunks(obj):
+        fp.write(chunk)
+
+
+def dumps(obj: Any) -> str:
+    return _ENCODER.encode(obj)
+
+
+def write_json_file(path: str, obj: Any, compression=None) -> str:
+    """Stream ``obj`` to ``path`` as JSON, atomically, and return the path written.
+
+    With ``compression`` (``"gz"`` or ``"zst"``, see trace_files.py), it is written to
+    ``path.gz`` or ``path.zst`` instead. Other variants of ``path`` left by a previous
+    write are removed, so readers of ``find_trace_file(path)`` get this one.
+    """
+    target = f"{path}.{compression}" if compression else path
+    tmp_path = f"{target}.tmp"
+    with open_trace_file(tmp_path, "w", compression=compression) as f:
+        dump(obj, f)
+    os.replace(tmp_path, target)
+    for variant in trace_file_variants(path):
+        if variant != target and os.path.exists(variant):
+            os.remove(variant)
+    return target
+
+
+def _benchmark_trace(num_steps: int = 200):
+    """A synthetic metadata.json payload shaped like a long run's."""
+    from smolagents.memory import ActionStep
+    from smolagents.models import ChatMessageToolCallDefinition, MessageRole
+
+    summary, steps = [], []
+    for step_number in range(1, num_steps + 1):
+        thought = f"Short term goal: step {step_number}. " * 20
+        code = f"click({step_number}, {step_number * 2})"
+        tool_call = ChatMessageToolCall(
+            function=ChatMessageToolCallDefinition(
+                name="python_interpreter", arguments=code
+            ),
+            id=f"call_{step_number}",
+            type="function",
+        )
+        message = ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=thought + code,
+            tool_calls=[tool_call],
+            raw={"choices": [{"message": {"content": thought + code}}], "usage": {}},
+        )
+        steps.append(
+            ActionStep(
+                step_number=step_number,
+                start_time=0.0,
+                end_time=1.0,
+                duration=1.0,
+                model_output_message=message,
+                model_output=thought + code,
+                tool_calls=[
+                    ToolCall(
+                        name="python_interpreter",
+                        arguments=code,
+                        id=f"call_{step_number}",
+                    )
+                ],
+                observations="Execution logs:\nclicked\n" * 5,
+            )
+        )
+        summary.append(
+            {
+                "role": MessageRole.ASSISTANT,
+                "content": [{"type": "text", "text": thought + code}],
+            }
+        )
+        summary.append(
+            {
+                "role": MessageRole.TOOL_CALL,
+                "content": [{"type": "text", "text": f"Calling tools:\n{code}"}],
+            }
+        )
+        summary.append(
+            {
+                "role": MessageRole.TOOL_RESPONSE,
+                "content": [{"type": "text", "text": "Observation:\nclicked"}],
+            }
+        )
+    return {
+        "status": "completed",
+        "summary": summary,
+        "steps": steps,
+        "error_message": None,
+    }
+
+
+def _legacy_chat_message_to_json(obj):
+    """The serializer eval.py used before this module, kept for the benchmark"""
+    if hasattr(obj, "__dict__"):
+        result = obj.__dict__.copy()
+        if "raw" in result:
+            del result["raw"]
+        if "content" in result and result["content"] is not None:
+            if hasattr(result["content"], "__dict__"):
+                result["content"] = _legacy_chat_message_to_json(result["content"])
+        if "tool_calls" in result and result["tool_calls"] is not None:
+            result["tool_calls"] = [
+                _legacy_chat_message_to_json(tc) for tc in result["tool_calls"]
+            ]
+        return result
+    elif isinstance(obj, (list, tuple)):
+        return [_legacy_chat_message_to_json(item) for item in obj]
+    else:
+        return obj
+
+
+def benchmark(num_steps: int = 200, repeat: int = 20) -> None:
+    """Compare this serializer with the previous json.dumps(default=chat_message_to_json)
+    on a long trace: the chat summary eval.py saves, and the same run's memory steps."""
+    import functools
+    import tempfile
+    import time
+
+    from trace_files import zstandard
+
+    payload = _benchmark_trace(num_steps)
+    documents = {
+        "summary": {
+            key: payload[key] for key in ("status", "summary", "error_message")
+        },
+        "memory steps": {"status": payload["status"], "steps": payload["steps"]},
+    }
+
+    def write_legacy(path, document):
+        with open(path, "w") as f:
+            f.write(json.dumps(document, default=_legacy_chat_message_to_json))
+        return path
+
+    candidates = {
+        "json.dumps(default=chat_message_to_json)": write_legacy,
+        "trace_serializer.write_json_file": write_json_file,
+        "trace_serializer.write_json_file, gz": functools.partial(
+            write_json_file, compression="gz"
+        ),
+    }
+    if zstandard is not None:
+        candidates["trace_serializer.write_json_file, zst"] = functools.partial(
+            write_json_file, compression="zst"
+        )
+    print(f"Writing a {num_steps}-step trace, best mean of 5 x {repeat} writes:")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "metadata.json")
+        for document_name, document in documents.items():
+            for name, write in candidates.items():
+                best = float("inf")
+                for _ in range(5):
+                    start_time = time.perf_counter()
+                    for _ in range(repeat):
+                        written_path = write(path, document)
+                    best = min(best, (time.perf_counter() - start_time) / repeat)
+                print(
+                    f"{document_name:13s} {name:42s} {best * 1000:7.2f} ms  "
+                    f"{os.path.getsize(written_path) / 1024:7.1f} KiB"
+                )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+TRACE_FILENAME = "trace.jsonl"
+
+
+def _chat_message_record(message) -> Optional[Dict[str, Any]]:
+    if message is None:
+        return None
+    if isinstance(message, dict):
+        return {"role": message.get("role"), "content": message.get("content")}
+    role = getattr(message, "role", "assistant")
+    return {
+        "role": getattr(role, "value", role),
+        "content": getattr(message, "content", None),
+    }
+
+
+def _tool_call_record(tool_call) -> Dict[str, Any]:
+    return {
+        "id": getattr(tool_call, "id", None),
+        "type": "function",
+        "function": {
+            "name": getattr(tool_call, "name", None),
+            "arguments": getattr(tool_call, "arguments", None),
+        },
+    }
+
+
+def step_to_record(memory_step, data_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Convert a smolagents memory step into a JSON-serializable trace record.
+
+    The record mirrors the shape of the steps found in the ``summary`` of
+    ``metadata.json``, so readers of either format see the same keys. Images and
+    model input messages are left out: screenshots are referenced by file name.
+    """
+    record: Dict[str, Any] = {"type": type(memory_step).__name__}
+
+    if hasattr(memory_step, "task"):
+        record["task"] = memory_step.task
+    if hasattr(memory_step, "plan"):
+        record["plan"] = memory_step.plan
+
+    step_number = getattr(memory_step, "step_number", None)
+    if step_number is not None:
+        record["step"] = step_number
+
+    for key in ("start_time", "end_time", "duration"):
+        if getattr(memory_step, key, None) is not None:
+            record[key] = getattr(memory_step, key)
+
+    if hasattr(memory_step, "model_output_message"):
+        record["model_output_message"] = _chat_message_record(
+            memory_step.model_output_message
+        )
+    if hasattr(memory_step, "model_output"):
+        record["model_output"] = memory_step.model_output
+    if hasattr(memory_step, "tool_calls"):
+        record["tool_calls"] = [
+            _tool_call_record(tc) for tc in (memory_step.tool_calls or [])
+        ]
+    if hasattr(memory_step, "observations"):
+        record["observations"] = memory_step.observations
+    if hasattr(memory_step, "action_output"):
+        record["action_output"] = memory_step.action_output
+
+    error = getattr(memory_step, "error", None)
+    if error is not None:
+        record["error"] = {
+            "type": type(error).__name__,
+            "message": getattr(error, "message", str(error)),
+        }
+
+    for key in ("input_token_count", "output_token_count"):
+        if getattr(memory_step, key, None) is not None:
+            record[key] = getattr(memory_step, key)
+
+    if data_dir is not None and step_number is not None:
+        screenshot_name = f"step_{step_number:03d}.png"
+        if os.path.exists(os.path.join(data_dir, screenshot_name)):
+            record["screenshot"] = screenshot_name
+
+    return record
+
+
+class TraceWriter:
+    """Append-only JSONL writer that persists each agent step as soon as it completes.
+
+    Every record is written and flushed to the OS immediately, so a crashed or killed
+    process keeps all the steps it finished. ``os.fsync`` is batched: it runs every
+    ``fsync_every`` records or ``fsync_interval`` seconds, whichever comes first, and
+    always on ``close``.
+
+    Parameters:
+        data_dir (str): Folder of the run; the trace is written to ``data_dir/trace.jsonl``.
+        fsync_every (int): Number of records between two fsyncs.
+        fsync_interval (float): Maximum number of seconds between two fsyncs.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        fsync_every: int = 10,
+        fsync_interval: float = 5.0,
+    ):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, TRACE_FILENAME)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_fsync = time.time()
+        os.makedirs(data_dir, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Append one record to the trace."""
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.fsync_every
+                or time.time() - self._last_fsync >= self.fsync_interval
+            ):
+                self._fsync()
+
+    def _fsync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.time()
+
+    def write_task(self, task: str, **extra) -> None:
+        self.write(
+            {"type": "TaskStep", "task": task, "timestamp": time.time(), **extra}
+        )
+
+    def write_step(self, memory_step) -> None:
+        record = step_to_record(memory_step, data_dir=self.data_dir)
+        record["timestamp"] = time.time()
+        self.write(record)
+
+    def write_final(self, status: str, error_message: Optional[str] = None) -> None:
+        self.write(
+            {
+                "type": "final",
+                "status": status,
+                "error_message": error_message,
+                "timestamp": time.time(),
+            }
+        )
+
+    def step_callback(self, memory_step, agent=None) -> None:
+        """Step callback to register in ``agent.step_callbacks``."""
+        self.write_step(memory_step)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            self._fsync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_trace(path: str) -> Dict[str, Any]:
+    """Rebuild a run summary from a trace written by ``TraceWriter``.
+
+    ``path`` may be the trace file or the run folder containing it. A truncated final
+    line (e.g. the process was killed mid-write) is ignored and reported through the
+    ``truncated`` key.
+
+    Returns:
+        dict: ``{"task", "status", "error_message", "summary", "truncated"}`` where
+        ``summary`` is the list of step records, starting with the task step. ``status``
+        is ``"incomplete"`` if the run never wrote its final record.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, TRACE_FILENAME)
+
+    summary: List[Dict[str, Any]] = []
+    task = None
+    status = "incomplete"
+    error_message = None
+    truncated = False
+
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            if index == len(lines) - 1:
+                truncated = True
+                break
+            raise
+        if record.get("type") == "final":
+            status = record.get("status", status)
+            error_message = record.get("error_message")
+            continue
+        if record.get("type") == "TaskStep" and task is None:
+            task = record.get("task")
+        summary.append(record)
+
+    return {
+        "task": task,
+        "status": status,
+        "error_message": error_message,
+        "summary": summary,
+        "truncated": truncated,
+    }
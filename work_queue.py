@@ -0,0 +1,273 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class WorkQueue:
+    """Queue of eval jobs in a SQLite file, shared by a coordinator and its workers.
+
+    Workers on any host that sees the file claim a job under a lease, renew the lease while
+    the run is alive, and complete it with its result. A job whose lease expired, because
+    its worker died or lost the file, is handed out again, up to ``max_attempts`` times;
+    after that it is finished with an ``error`` status. Finished jobs get an increasing
+    ``finished_seq``, so the coordinator can follow results in completion order.
+
+    Like SQLiteSandboxRegistry, state changes run in ``IMMEDIATE`` transactions, so two
+    workers never claim the same job. The file must be on a filesystem with working locks.
+    It uses SQLite's rollback journal rather than WAL, which needs memory shared by all
+    the processes using the file, so doesn't work across hosts on a network filesystem.
+
+    Parameters:
+        path (str): Path to the SQLite database file, created if missing.
+        max_attempts (int): Number of times a job is handed out before giving up on it.
+        busy_timeout (float): Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, busy_timeout: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._connect()
+        # Also switches back files created in WAL mode
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                example_name TEXT NOT NULL,
+                example_text TEXT NOT NULL,
+                run_index INTEGER NOT NULL,
+                example_dir TEXT NOT NULL,
+                options TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires_at REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                finished_seq INTEGER,
+                UNIQUE (example_dir, run_index)
+            )""")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_finished_seq ON jobs (finished_seq)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None
+            )
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def _finish(self, conn: sqlite3.Connection, job_id: int, result: Dict) -> None:
+        conn.execute(
+            """UPDATE jobs SET status = 'done', result = ?, lease_expires_at = 0,
+            finished_seq = (SELECT COALESCE(MAX(finished_seq), 0) + 1 FROM jobs)
+            WHERE id = ?""",
+            (json.dumps(result, default=str), job_id),
+        )
+
+    def _reap(self, conn: sqlite3.Connection, current_time: float) -> None:
+        # Jobs whose lease expired too many times are finished as errors
+        rows = conn.execute(
+            """SELECT id, attempts FROM jobs WHERE status = 'running'
+            AND lease_expires_at <= ? AND attempts >= ?""",
+            (current_time, self.max_attempts),
+        ).fetchall()
+        for row in rows:
+            self._finish(
+                conn,
+                row["id"],
+                {
+                    "status": "error",
+                    "error": f"Lease expired after {row['attempts']} attempts",
+                },
+            )
+
+    def enqueue(
+        self, jobs: Iterable[Tuple], options: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """Add (example_name, example_text, run_index, example_dir) jobs.
+
+        A job already in the queue is reset to pending, e.g. when an evaluation is resumed
+        with the same queue file, unless a worker is currently running it. Returns the
+        number of jobs queued.
+        """
+        options_json = json.dumps(options or {})
+        added = 0
+        batch: List[Tuple] = []
+
+        def insert(conn):
+            cursor = conn.executemany(
+                """INSERT INTO jobs
+                (example_name, example_text, run_index, example_dir, options)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (example_dir, run_index) DO UPDATE SET
+                example_text = excluded.example_text, options = excluded.options,
+                status = 'pending', owner = NULL, lease_expires_at = 0, attempts = 0,
+                result = NULL, finished_seq = NULL
+                WHERE status != 'running'""",
+                batch,
+            )
+            return cursor.rowcount
+
+        for job in jobs:
+            batch.append((*job, options_json))
+            if len(batch) >= 500:
+                added += self._transaction(insert)
+                batch = []
+        if batch:
+            added += self._transaction(insert)
+        return added
+
+    def claim(
+        self, owner: str, lease_seconds: float
+    ) -> Optional[Tuple[int, Tuple, Dict[str, Any], int]]:
+        """Lease the next pending or expired job to ``owner``.
+
+        Returns:
+            ``(job_id, job, options, attempt)`` or None if no job is available.
+        """
+        current_time = time.time()
+
+        def claim_next(conn):
+            self._reap(conn, current_time)
+            row = conn.execute(
+                """SELECT * FROM jobs WHERE status = 'pending'
+                OR (status = 'running' AND lease_expires_at <= ?)
+                ORDER BY id LIMIT 1""",
+                (current_time,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """UPDATE jobs SET status = 'running', owner = ?, lease_expires_at = ?,
+                attempts = attempts + 1 WHERE id = ?""",
+                (owner, current_time + lease_seconds, row["id"]),
+            )
+            job = (
+                row["example_name"],
+                row["example_text"],
+                row["run_index"],
+                row["example_dir"],
+            )
+            return row["id"], job, json.loads(row["options"]), row["attempts"] + 1
+
+        return self._transaction(claim_next)
+
+    def renew(self, job_ids: List[int], owner: str, lease_seconds: float) -> None:
+        """Extend the leases ``owner`` still holds on ``job_ids``."""
+        if not job_ids:
+            return
+        expires_at = time.time() + lease_seconds
+        self._transaction(
+            lambda conn: conn.executemany(
+                """UPDATE jobs SET lease_expires_at = ?
+                WHERE id = ? AND owner = ? AND status = 'running'""",
+                [(expires_at, job_id, owner) for job_id in job_ids],
+            )
+        )
+
+    def complete(
+        self,
+        job_id: int,
+        owner: str,
+        result: Dict[str, Any],
+        publish: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Record the result of a job. Returns False if ``owner`` lost its lease.
+
+        ``publish`` is called first, only if ``owner`` still holds the job, in the same
+        transaction: no other worker can claim the job meanwhile, so e.g. moving the run's
+        files in place can't race with another attempt. If it raises, nothing is recorded.
+        """
+
+        def complete_job(conn):
+            row = conn.execute(
+                "SELECT owner, status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None or row["owner"] != owner or row["status"] != "running":
+                return False
+            if publish is not None:
+                publish()
+            self._finish(conn, job_id, result)
+            return True
+
+        return self._transaction(complete_job)
+
+    def finished_since(self, seq: int) -> List[Tuple[int, Tuple, Dict[str, Any]]]:
+        """``(finished_seq, job, result)`` of the jobs finished after ``seq``, in order."""
+        self._transaction(lambda conn: self._reap(conn, time.time()))
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT * FROM jobs WHERE finished_seq > ? ORDER BY finished_seq",
+                (seq,),
+            )
+            .fetchall()
+        )
+        return [
+            (
+                row["finished_seq"],
+                (
+                    row["example_name"],
+                    row["example_text"],
+                    row["run_index"],
+                    row["example_dir"],
+                ),
+                json.loads(row["result"]),
+            )
+            for row in rows
+        ]
+
+    def last_finished_seq(self) -> int:
+        row = (
+            self._connect()
+            .execute("SELECT COALESCE(MAX(finished_seq), 0) AS seq FROM jobs")
+            .fetchone()
+        )
+        return row["seq"]
+
+    def counts(self) -> Dict[str, int]:
+        rows = (
+            self._connect()
+            .execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+            .fetchall()
+        )
+        return {row["status"]: row["n"] for row in rows}
+
+    def set_closed(self, closed: bool = True) -> None:
+        """Tell workers whether more jobs may be added; they exit once closed and idle."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('closed', ?)",
+            ("1" if closed else "0",),
+        )
+
+    def is_closed(self) -> bool:
+        row = (
+            self._connect()
+            .execute("SELECT value FROM meta WHERE key = 'closed'")
+            .fetchone()
+        )
+        return row is not None and row["value"] == "1"